@@ -1,25 +1,61 @@
+import importlib
+
 import click
-from nanotext.cli.embed import train
-from nanotext.cli.similarity import search, compare, taxonomy, lookup
-from nanotext.cli.predict import predict
 
 # TODO: bash completion
 # http://click.palletsprojects.com/en/7.x/bashcomplete/
 
 
-@click.group()
-def cli():
-    pass
+# Subcommands are only imported when invoked, so that e.g. "nanotext --help"
+# does not pay for gensim, faiss or tensorflow; name: (module:attr, help)
+COMMANDS = {
+    # embed
+    'train': ('nanotext.cli.embed:train', 'Train a genome embedding'),
+    'convert': ('nanotext.cli.embed:convert', 'Convert a corpus to binary'),
+    # similarity
+    'index': ('nanotext.cli.similarity:index', 'Index the genome vectors'),
+    'search': ('nanotext.cli.similarity:search', 'Search similar genomes'),
+    'compare': ('nanotext.cli.similarity:compare', 'Compare two genomes'),
+    'taxonomy': (
+        'nanotext.cli.similarity:taxonomy', 'Taxonomy of similar genomes'),
+    'lookup': ('nanotext.cli.similarity:lookup', 'Look up a genome vector'),
+    # predict
+    'predict': ('nanotext.cli.predict:predict', 'Predict culture media'),
+    # serve
+    'serve': ('nanotext.cli.serve:serve', 'Serve search and prediction'),
+    }
+
+
+class LazyGroup(click.Group):
+    '''
+    A click group that imports its subcommands on first use.
+
+    https://click.palletsprojects.com/en/7.x/commands/#lazy-loading
+    '''
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
 
+    def list_commands(self, ctx):
+        return list(self.lazy_commands) + super().list_commands(ctx)
 
-# embed
-cli.add_command(train)
+    def get_command(self, ctx, name):
+        if name not in self.lazy_commands:
+            return super().get_command(ctx, name)
+        module, attr = self.lazy_commands[name][0].split(':')
+        return getattr(importlib.import_module(module), attr)
+
+    def format_commands(self, ctx, formatter):
+        # list the commands w/o importing them
+        rows = [(k, v[1]) for k, v in self.lazy_commands.items()]
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
+def cli():
+    pass
 
-# similarity
-cli.add_command(search)
-cli.add_command(compare)
-cli.add_command(taxonomy)
-cli.add_command(lookup)
 
-# predict
-cli.add_command(predict)
+if __name__ == '__main__':
+    cli()
@@ -1,11 +1,12 @@
 from pathlib import Path
 
-import faiss
 import numpy as np
-from sklearn.preprocessing import normalize
 
-from nanotext.utils import subtract_mean, index_model, infer_genome_vector
-from nanotext.io import eprint, load_embedding
+from nanotext.utils import index_model, tune_index
+from nanotext.utils import encode_tokens, infer_encoded, infer_genome_vectors
+from nanotext.utils import infer_cached
+from nanotext.io import eprint, load_embedding, load_demeaned, load_tokens
+from nanotext.io import load_index, save_index, VectorCache
 
 
 class GenomeModel():
@@ -18,19 +19,87 @@ class GenomeModel():
     from nanotext.classes import GenomeModel
     fp_models = 'path/to/gensim/models'
     ensemble = GenomeModel(fp_models, mode='core', norm='l2')
+    # the mean of each model is cached next to it, pass cache=False to skip
+
+    # approximate index for large collections, see build_index()
+    ensemble = GenomeModel(
+        fp_models, mode='core', norm='l2', index_type='HNSW32', ef_search=64)
 
     # example query
     fp_query = 'path/to/query.pfam.tsv'
     v = ensemble.infer(fp_query, fmt='pfamscan')
     ensemble.search(v, topn=5, min_dist=0.5)
 
+    # search within a taxon
+    ensemble.add_taxonomy('path/to/metadata_GTDB_r89.db')
+    ensemble.search(v, topn=5, within='c__Clostridia')
+
     # lookup
     from nanotext.utils import cosine
     cosine(ensemble['GCA_003529605.1'], ensemble['GCA_002433265.1'])
+
+    # persist the index once (see "nanotext index") ...
+    ensemble.save('path/to/index')
+    # ... and load it memory-mapped later; the gensim models are only loaded
+    # once we infer a vector
+    ensemble = GenomeModel(fp_models, index='path/to/index')
     '''
-    def __init__(self, fp, mode='ensemble', norm=None, names=None):
-        
+    def __init__(self, fp=None, mode='ensemble', norm=None, names=None,
+        index=None, cache=True, index_type='Flat', nprobe=None,
+        ef_search=None):
+
+        self._models = None
+        self.steps_used = []  # see infer()
+        self.dispersion = None  # see infer()
+        self.taxonomy = None  # see add_taxonomy()
+        self._clades = {}  # see _clade()
+        self.warn_on_ensemble_inference = False
+
+        if index:
+            self._load(fp, index)
+            return
+
+        self.fp = fp
         self.mode = mode
+        self.fps = self._locate(fp, mode)
+
+        self.norm = norm
+        eprint('Subtracting mean from model(s) ...')
+        if not self.fps:
+            raise ValueError('No models given, cannot build the index')
+        nomean = [load_demeaned(str(p), cache) for p in self.fps]
+        self.means = np.array([mu for _, mu, _ in nomean], dtype='float32')
+
+        if not names:
+            names = nomean[0][0]
+
+        self.dim = self.means.shape[1]
+        
+        eprint('Indexing model(s) ...')
+        if norm:
+            eprint(f'{self.norm} norm will be applied to vectors')
+        self.index_type = index_type
+        self.search_params = {'nprobe': nprobe, 'ef_search': ef_search}
+        self.names, self.db, self.index = index_model(
+            names, [(k, m) for k, _, m in nomean], self.norm,
+            index_type=index_type, **self.search_params)
+        self._rows = {name: i for i, name in enumerate(self.names)}
+
+
+    @property
+    def models(self):
+        '''
+        The gensim models are loaded lazily, i.e. only when we need them for
+        inference or to build the index.
+        '''
+        if self._models is None:
+            if not self.fps:
+                raise ValueError('No models given, cannot infer vectors')
+            self._models = [load_embedding(str(p)) for p in self.fps]
+        return self._models
+
+
+    def _locate(self, fp, mode):
         if mode == 'ensemble':
             nn = ['22', '45', '93']
         elif mode == 'core':
@@ -41,60 +110,174 @@ class GenomeModel():
             raise ValueError(
                 'More not implemented (try "ensemble", "core" or "accessory")')
         
-        self.models = []
-        for n in nn:
-            p = Path(fp) / f'{n}/nanotext_r89.model'
-            model = load_embedding(str(p))
-            self.models.append(model)
-    
-        self.norm = norm
-        eprint('Subtracting mean from model(s) ...')
-        self.nomean = self._demean(self.models)
+        if not fp:
+            return []
+        return [Path(fp) / f'{n}/nanotext_r89.model' for n in nn]
 
-        if not names:
-            self.names = self.models[0].docvecs.index2entity
 
-        self.dim = len(self.models[0].docvecs[0])
+    def _load(self, fp, index):
+        names, db, means, ix, meta = load_index(index)
         
-        eprint('Indexing model(s) ...')
-        if norm:
-            eprint(f'{self.norm} norm will be applied to vectors')
-        found, m, self.index = index_model(
-            self.names, [i for i in self.nomean], self.norm)
-        self.embedding = dict(zip(found, m))
-    
-        self.means = []
-        for model in self.models:
-            mu = np.mean(
-                [model.docvecs[i] for i in range(len(model.docvecs))], axis=0)
-            self.means.append(mu)
+        self.fp = fp or meta['models']
+        self.mode = meta['mode']
+        self.fps = self._locate(self.fp, self.mode)
+        self.norm = meta['norm']
+        self.index_type = meta.get('index_type', 'Flat')
+        self.search_params = meta.get(
+            'search_params', {'nprobe': None, 'ef_search': None})
+        
+        self.names, self.db, self.means, self.index = names, db, means, ix
+        tune_index(self.index, **self.search_params)
+        
+        fp_tax = Path(index) / 'taxonomy.npz'
+        if fp_tax.exists():
+            self.taxonomy = TaxonomyIndex.load(str(fp_tax))
+        self._rows = {name: i for i, name in enumerate(self.names)}
+        self.dim = self.db.shape[1]
+
+
+    def save(self, outdir):
+        '''
+        Write the index to <outdir> so it can be loaded memory-mapped w/
+        GenomeModel(fp, index=outdir).
+        '''
+        meta = {
+            'mode': self.mode,
+            'norm': self.norm,
+            'models': str(Path(self.fp).resolve()) if self.fp else None,
+            'dim': self.dim,
+            'size': len(self.names),
+            'index_type': self.index_type,
+            'search_params': self.search_params,
+            }
+        save_index(outdir, self.names, self.db, self.means, self.index, meta)
+        if self.taxonomy:
+            self.taxonomy.save(str(Path(outdir) / 'taxonomy.npz'))
+
+
+    def add_taxonomy(self, fp):
+        '''
+        Index the taxonomy of the genomes in the model (see TaxonomyIndex),
+        either from the GTDB taxonomy file or the metadata database (.db).
+        It is saved along w/ the index.
+        '''
+        if str(fp).endswith('.db'):
+            self.taxonomy = TaxonomyIndex.from_db(fp, self.names)
+        else:
+            self.taxonomy = TaxonomyIndex.from_gtdb(fp, self.names)
+        self._clades = {}
+        return self.taxonomy
+
+
+    def tune(self, nprobe=None, ef_search=None):
+        '''
+        Change the search parameters of an approximate index (see
+        tune_index()), e.g. to increase its recall.
+        '''
+        tune_index(self.index, nprobe, ef_search)
+        for k, v in [('nprobe', nprobe), ('ef_search', ef_search)]:
+            if v:
+                self.search_params[k] = v
 
-        self.warn_on_ensemble_inference = False
 
+    def infer(
+        self, fp, steps=1000, fmt='pfamscan', truncate_by=0, workers=1,
+        seed=None, cache=True, tol=None, n_samples=1, pool=None):
+        '''
+        Infer the vector of the genome annotation <fp>. If <fp> is a list of
+        annotations, infer all of them and return one row per genome, so we
+        can search them in one go.
+
+        With more than one of <workers>, the inference across both genomes
+        and ensemble members runs in a process pool (see
+        infer_genome_vectors()). Given a <seed>, the result is the same
+        regardless of the number of workers. To reuse the workers across
+        calls, pass a ProcessPoolExecutor as <pool>.
 
-    def _demean(self, models):
-        for i in models:
-            yield subtract_mean(i)
+        Given a <tol>, inference stops before <steps> once the vector has
+        converged (see infer_adaptive()). The steps used for each genome and
+        model (w/o those from the cache) are kept in self.steps_used.
 
+        Inference is stochastic. W/ <n_samples>, each genome is inferred that
+        many times (seeded w/ seed, seed + 1, ...; in parallel given
+        <workers>), and we return the mean vector. How much the samples
+        scatter around it is kept in self.dispersion, one value per genome:
+        the mean cosine distance of the samples to their mean. The larger it
+        is, the less we can trust the hits of a genome (nan for 1 sample).
 
-    def infer(self, fp, steps=1000, fmt='pfamscan', truncate_by=0):
+        By default, the parsed annotations are cached (see load_tokens()).
+        Pass a VectorCache as <cache> to also cache the inferred vectors, or
+        False to cache nothing.
+        '''
         if (self.mode == 'ensemble') and (not self.warn_on_ensemble_inference):
             eprint('''Warning: Inference w/ a model ensemble will work well if you don't combine the resulting vectors w/ the indexed ones. This is because small variations in the inference will magnify in model ensembles to offset the inferred and indexed vectors by more than they actually differ.
                 ''')
             self.warn_on_ensemble_inference = True  # print only once
-        bag = []
+        
+        fps = [fp] if isinstance(fp, (str, Path)) else fp
+        params = {
+            'steps': steps, 'fmt': fmt, 'truncate_by': truncate_by,
+            'seed': seed}
+        if tol:
+            params['tol'] = tol  # part of the cache key only if set
+        self.steps_used = []
 
-        for model, mu in zip(self.models, self.means):
-            v = infer_genome_vector(
-                fp, model, steps=steps, fmt=fmt, truncate_by=truncate_by)
-            v_ = v-mu
+        # each sample is inferred like another genome w/ its own seed
+        samples = [str(i) for i in fps for _ in range(n_samples)]
+        seeds = [
+            None if seed is None else seed + k
+            for _ in fps for k in range(n_samples)]
+
+        def raw(fps, seeds):
+            if pool or workers > 1:
+                vv = infer_genome_vectors(
+                    fps, self.fps, workers, seeds=seeds, pool=pool,
+                    cache=bool(cache), **params)
+                if tol:
+                    vv, used = vv
+                    self.steps_used.extend(used.reshape(-1).tolist())
+                return vv
+            
+            vv, tokens = [], {}
+            for i, s in zip(fps, seeds):
+                if i not in tokens:  # parse once per genome
+                    tokens[i] = load_tokens(i, fmt=fmt, cache=bool(cache))
+                bag = []
+                for model in self.models:
+                    v = infer_encoded(
+                        encode_tokens(tokens[i], model), model, steps,
+                        truncate_by, s, tol)
+                    if tol:
+                        v, n = v
+                        self.steps_used.append(n)
+                    bag.append(v)
+                vv.append(bag)
+            return np.array(vv, dtype='float32')
+
+        if isinstance(cache, VectorCache):
+            # w/o a seed, all samples of a genome would share one key
+            numbers = list(range(n_samples)) * len(fps) \
+                if n_samples > 1 else None
+            vv = infer_cached(
+                samples, [str(i) for i in self.fps], cache, raw, seeds=seeds,
+                samples=numbers, **params)
+        else:
+            vv = raw(samples, seeds)
+        
+        # ensemble vectors, one per genome and sample
+        e = np.mean(vv - self.means, axis=1).reshape(len(fps), n_samples, -1)
+        m = e.mean(axis=1)
 
-            bag.append(v_)
+        self.dispersion = np.full(len(fps), np.nan)
+        if n_samples > 1:
+            unit = lambda x: x / np.linalg.norm(x, axis=-1, keepdims=True)
+            cos = np.sum(unit(e) * unit(m)[:, None, :], axis=-1)
+            self.dispersion = np.mean(1 - cos, axis=1)
         
-        ve = np.mean(bag, axis=0)  # ensemble vector
-        ve = np.array([ve], dtype='float32')  # cast for norm and index search
+        ve = np.array(m, dtype='float32')  # cast for norm and index search
         
         if self.norm == 'l2':
+            from sklearn.preprocessing import normalize
             # eprint('L2 normalization ...')
             ve = normalize(ve, norm=self.norm, axis=1)#.reshape(self.dim)
             # w/o reshape, dim is (1, dim), not (dim,) like the model's vecs;
@@ -107,26 +290,122 @@ class GenomeModel():
         # so we can directly use it w/ search 
 
 
-    def search(self, query, topn=3, min_dist=None):
-        D, I = self.index.search(query, topn)
-        if not min_dist:
-            return [(self.names[i], j) for i, j in zip(I[0], D[0])]
+    def search(self, query, topn=3, min_dist=None, within=None):
+        '''
+        Return a list of (name, distance) tuples for the <topn> genomes
+        closest to a single vector <query>. To search several vectors at
+        once, use search_batch().
+
+        Given a taxon <within> (e.g. "c__Clostridia"), only genomes in it are
+        searched. This requires a taxonomy (see add_taxonomy()).
+        '''
+        query = np.asarray(query, dtype='float32')
+        if query.ndim > 1 and len(query) != 1:
+            raise ValueError(
+                'Query holds several vectors, use search_batch() instead')
+        hits = self.search_batch(query.reshape(1, -1), topn, min_dist, within)
+        return hits[0]
+
+
+    def search_batch(self, query, topn=3, min_dist=None, within=None):
+        '''
+        Search all rows of <query> w/ a single call to the index and return
+        one list of (name, distance) tuples per row, even if there is only
+        one.
+        '''
+        query = np.asarray(query, dtype='float32')
+        
+        if not within:
+            D, I = self.index.search(query, topn)
+        else:
+            D, I = self._search_within(query, topn, within)
+        
+        hits = []
+        for ii, dd in zip(I, D):
+            # faiss pads w/ -1 if there are less than <topn> results
+            hits.append([(self.names[i], j) for i, j in zip(ii, dd) \
+                if (i >= 0) and ((not min_dist) or (j > min_dist))])
+        return hits
+
+
+    def _search_within(self, query, topn, within):
+        '''
+        Restrict the search to the rows of a taxon w/ a faiss ID selector.
+        Approximate indices can miss hits when most vectors are filtered out,
+        as can indices that do not support selectors at all. In these cases we
+        search an exact sub-index of the taxon instead.
+        '''
+        import faiss
+
+        clade = self._clade(within)
+        rows = clade['rows']
+        k = min(topn, len(rows))
+
+        try:
+            D, I = self.index.search(query, topn, params=clade['params'])
+            if (I[:, :k] >= 0).all():
+                return D, I
+        except RuntimeError:
+            pass
+
+        if clade['index'] is None:
+            clade['index'] = faiss.IndexFlat(self.dim, self.index.metric_type)
+            clade['index'].add(np.asarray(self.db[rows], dtype='float32'))
+        D, I = clade['index'].search(query, topn)
+        return D, np.where(I >= 0, rows[I], -1)
+
+
+    def _clade(self, taxon):
+        '''
+        Return (and cache) the rows, search parameters and sub-index of a
+        taxon.
+        '''
+        import faiss
+
+        if taxon in self._clades:
+            return self._clades[taxon]
+        
+        if not self.taxonomy:
+            raise ValueError('No taxonomy indexed, see add_taxonomy()')
+        rows = self.taxonomy.lookup(taxon)
+        if not len(rows):
+            raise ValueError(f'Taxon {taxon} not found, abort!')
+
+        sel = faiss.IDSelectorBatch(rows)
+        ivf = faiss.try_extract_index_ivf(self.index)
+        hnsw = getattr(self.index, 'hnsw', None)
+        if ivf:
+            params = faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+        elif hnsw:
+            params = faiss.SearchParametersHNSW(
+                sel=sel, efSearch=hnsw.efSearch)
         else:
-            return [(self.names[i], j) for i, j in zip(I[0], D[0]) \
-                    if j>min_dist]
+            params = faiss.SearchParameters(sel=sel)
+        
+        # keep a reference to the selector, which the parameters do not
+        self._clades[taxon] = {
+            'rows': rows, 'sel': sel, 'params': params, 'index': None}
+        return self._clades[taxon]
+
+
+    def lineage(self, name):
+        '''
+        Return the 7 GTDB ranks of genome <name> (see TaxonomyIndex).
+        '''
+        if not self.taxonomy:
+            raise ValueError('No taxonomy indexed, see add_taxonomy()')
+        return self.taxonomy.taxonomy(self._rows[name])
 
 
     def subset(self, names):
         '''
         Given a list of names, return a dict of name: vector
         '''
-        d = self.embedding.copy()
         embedding = {}
         notfound = 0
         for i in names:
             try:
-                v = d[i]
-                embedding[i] = v
+                embedding[i] = np.array(self.db[self._rows[i]])
             except KeyError:
                 notfound += 1
         eprint(f'{notfound} records not found')
@@ -134,4 +413,139 @@ class GenomeModel():
 
     
     def __getitem__(self, key):
-        return self.embedding[key].squeeze()
+        return np.array(self.db[self._rows[key]]).squeeze()
+
+
+class TaxonomyIndex():
+    '''
+    Inverted lists from each taxon (on each rank) to the rows of the genomes
+    in it, aligned w/ an embedding matrix (e.g. GenomeModel.db). Looking up
+    all genomes in a taxon is then a dict lookup and a slice, rather than a
+    scan over all records.
+
+    <names> are the genome UIDs in row order, <taxa> a dict of UID: list of
+    the 7 GTDB ranks (see load_taxonomy_gtdb()). Genomes w/o a taxonomy
+    record are in no list.
+
+    Usage:
+
+    from nanotext.classes import GenomeModel, TaxonomyIndex
+    model = GenomeModel(fp_models, index='path/to/index')
+    tax = TaxonomyIndex.from_gtdb('bac_taxonomy_r86.tsv', model.names)
+    rows = tax.lookup('f__Pseudomonadaceae')
+    model.db[rows]
+
+    # persist and load again
+    tax.save('taxonomy.npz')
+    tax = TaxonomyIndex.load('taxonomy.npz')
+    '''
+    ranks = 'd p c o f g s'.split()
+    # domain phylum class order family genus species
+
+    def __init__(self, names=None, taxa=None):
+        if names is None:
+            return  # see load()
+        
+        self.names = np.array(names, dtype=str)
+        self.labels, self.codes = [], []
+        for i in range(len(self.ranks)):
+            column = [taxa[n][i] if n in taxa else '' for n in names]
+            labels, codes = np.unique(column, return_inverse=True)
+            self.labels.append(labels)
+            self.codes.append(codes.astype(np.int32))
+        self._invert()
+
+
+    def _invert(self):
+        '''
+        Sort the rows by taxon on each rank, so the rows of taxon j are
+        rows[indptr[j]:indptr[j+1]] (like the CSR format of sparse matrices).
+        '''
+        self.rows, self.indptr = [], []
+        for labels, codes in zip(self.labels, self.codes):
+            self.rows.append(np.argsort(codes, kind='stable').astype(np.int64))
+            self.indptr.append(np.searchsorted(
+                codes[self.rows[-1]], np.arange(len(labels) + 1)))
+        self._index_labels()
+
+
+    def _index_labels(self):
+        self._lookup = {}
+        for i, (r, labels) in enumerate(zip(self.ranks, self.labels)):
+            for j, label in enumerate(labels):
+                if label:  # unknown taxa are no taxon
+                    self._lookup[f'{r}__{label}'] = (i, j)
+
+
+    @classmethod
+    def from_gtdb(cls, fp, names=None):
+        '''
+        Build the index from the GTDB taxonomy file (see load_taxonomy_gtdb()).
+        W/o <names>, the rows are in the order of the file.
+        '''
+        from nanotext.io import load_taxonomy_gtdb
+
+        taxa = load_taxonomy_gtdb(fp)
+        return cls(list(taxa) if names is None else names, taxa)
+
+
+    @classmethod
+    def from_db(cls, fp, names=None):
+        '''
+        Build the index from the GTDB metadata database (see TaxonomyDB).
+        Genomes w/o a taxonomy (e.g. that failed QC) are in no taxon.
+        '''
+        from nanotext.io import TaxonomyDB
+
+        records = TaxonomyDB.open(fp).records()
+        taxa = {}
+        for name, taxon in records:
+            if taxon:
+                taxa[name] = [j[3:] for j in taxon.split(';')]
+        return cls([i for i, _ in records] if names is None else names, taxa)
+
+
+    def save(self, fp):
+        arrays = {'names': self.names}
+        for r, labels, codes, rows, indptr in zip(
+            self.ranks, self.labels, self.codes, self.rows, self.indptr):
+            arrays.update({
+                f'{r}_labels': labels, f'{r}_codes': codes,
+                f'{r}_rows': rows, f'{r}_indptr': indptr})
+        np.savez(fp, **arrays)
+
+
+    @classmethod
+    def load(cls, fp):
+        data = np.load(fp)
+        tax = cls()
+        tax.names = data['names']
+        for k in ['labels', 'codes', 'rows', 'indptr']:
+            setattr(tax, k, [data[f'{r}_{k}'] for r in cls.ranks])
+        tax._index_labels()
+        return tax
+
+
+    def lookup(self, taxon):
+        '''
+        Return the rows of all genomes in <taxon>, given in the GTDB format
+        <first letter of rank>__<name>, e.g. "f__Pseudomonadaceae". The
+        result is empty for an unknown taxon.
+        '''
+        try:
+            i, j = self._lookup[taxon]
+        except KeyError:
+            return np.array([], dtype=np.int64)
+        return self.rows[i][self.indptr[i][j]:self.indptr[i][j+1]]
+
+
+    def taxonomy(self, row):
+        '''
+        Return the 7 ranks of the genome in <row> ('' if unknown).
+        '''
+        return [str(labels[codes[row]]) \
+            for labels, codes in zip(self.labels, self.codes)]
+
+
+    def __len__(self):
+        return len(self.names)
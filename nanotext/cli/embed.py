@@ -1,35 +1,12 @@
 import json
+import os
 
 import click
-from gensim.models.doc2vec import TaggedDocument
-from gensim.models import Doc2Vec
-# from gensim.models.callbacks import CallbackAny2Vec
 # from tqdm import tqdm
 
 from nanotext.io import eprint
 
 
-class CorpusStream(object):
-    def __init__(self, fp):
-        self.fp = fp
-        self.epoch = -1
-        # self.cnt = 0
-    
-    def __iter__(self):
-        self.epoch += 1
-        with open(self.fp, 'r') as file:
-            print(f'Pass {self.epoch} ...')
-
-            for line in file:
-                genome, contig, domains = line.strip().split('\t')
-                domains = domains.split(',')
-
-                # if self.cnt % 100000 == 0:
-                #     print(self.cnt)
-                # self.cnt += 1
-                yield TaggedDocument(words=domains, tags=[genome])
-
-
 @click.command()
 @click.option(
     '--corpus', '-i',
@@ -44,7 +21,10 @@ class CorpusStream(object):
 @click.option(
     '--threads', '-t',
     help='Number of parallel processes', default=1, type=int)
-def train(corpus, config, out, threads):
+@click.option(
+    '--corpus-file', 'corpus_file', is_flag=True,
+    help='Train w/ gensim\'s corpus_file mode, which scales to all threads')
+def train(corpus, config, out, threads, corpus_file):
     '''
     Usage:
 
@@ -54,6 +34,14 @@ def train(corpus, config, out, threads):
         --out nanotext.model \\
         --params config.json
 
+    The corpus can also be a binary corpus (see "nanotext convert").
+
+    By default, the corpus is streamed through Python, which limits training
+    to a handful of threads. W/ --corpus-file, it is first written to a
+    temporary file in LineSentence format w/ one genome per line, from which
+    gensim's workers read directly. Note that this changes what the model
+    learns: contigs are then concatenated, like when inferring a genome
+    vector, and gensim only reads the first 10000 domains of each genome.
     '''
     if not config:
         eprint('Will use preselected parameters ...')
@@ -76,23 +64,61 @@ def train(corpus, config, out, threads):
         with open(config, 'r') as file:
             params = json.load(file)
 
-    # TODO: use <corpus_file> arg
+    from gensim.models import Doc2Vec
+
+    from nanotext.learn import BinaryCorpusStream, CorpusStream, EpochLogger
+    from nanotext.learn import train_corpus_file
+
     # https://github.com/RaRe-Technologies/gensim/blob/develop/docs/notebooks/Any2Vec_Filebased.ipynb
-    # model = Doc2Vec(corpus_file=corpus, workers=threads, **params)
     model = Doc2Vec(workers=threads, **params)
     eprint('Setup:', model)
-    
-    eprint('Building vocabulary ...')
-    stream = CorpusStream(corpus)
-    model.build_vocab(stream)
 
-    eprint('Training starts ...')
-    _ = model.train(
-        stream, total_examples=model.corpus_count, epochs=model.epochs)
+    if corpus_file:
+        train_corpus_file(model, corpus, out)
+    else:
+        eprint('Building vocabulary ...')
+        if os.path.isdir(corpus):
+            stream = BinaryCorpusStream(corpus)
+        else:
+            stream = CorpusStream(corpus)
+        model.build_vocab(stream)
+
+        eprint('Training starts ...')
+        _ = model.train(
+            stream, total_examples=model.corpus_count, epochs=model.epochs,
+            callbacks=[EpochLogger()])
 
     model.save(out)
 
 
+@click.command()
+@click.option(
+    '--corpus', '-i',
+    help='Corpus of protein domains (text)', 
+    type=click.Path(), required=True)
+@click.option(
+    '--out', '-o',
+    help='Directory to write the binary corpus to',
+    type=click.Path(), required=True)
+def convert(corpus, out):
+    '''
+    Convert a text corpus into a binary one, where domains are stored as
+    memory-mapped integer codes. This makes the corpus several times smaller
+    and saves parsing it again in each training epoch.
+
+    Usage:
+
+    \b
+    nanotext convert -i corpus.txt -o corpus.bin
+    nanotext train -i corpus.bin -o nanotext.model
+    '''
+    from nanotext.io import write_binary_corpus
+
+    eprint('Converting corpus ...')
+    write_binary_corpus(corpus, out)
+    eprint('Done.')
+
+
 # @click.command()
 # @click.option(
 #     '--config',
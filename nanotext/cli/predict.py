@@ -1,39 +1,18 @@
 import click
 
 
-def cosine_similarity(a, b):
-    '''
-    https://en.wikipedia.org/wiki/Cosine_similarity
-    stackoverflow.com/questions/18424228
-    '''
-    from numpy import dot
-    from numpy.linalg import norm
-
-    return dot(a, b)/(norm(a)*norm(b))
-
-
-def cosim2(query, db, topn=10):
-    '''
-    cosim2(vv_media['1'], vv_media, 10)
-    '''
-    import operator 
-
-    result = {}
-    for k, v in db.items():
-        result[k] = cosine_similarity(v, query)
-
-
-    # sort in descending order
-    sorted_result = sorted(
-        result.items(), key=operator.itemgetter(1), reverse=True)
-    return sorted_result[:topn]
-
-
 @click.command()
 @click.option(
     '--genome',
-    help='Protein domain annotation',
+    help='Protein domain annotation, or a directory/ glob of them',
     type=click.Path())
+@click.option(
+    '--manifest',
+    help='Tsv file listing one annotation per line ("path" or "name<tab>path")',
+    default=None, type=click.Path())
+@click.option(
+    '--fmt',
+    help='Annotation fmt (pfamscan, hmmer or domtblout)', default='hmmer')
 @click.option(
     '--embedding',
     help='Genome embedding model')
@@ -48,11 +27,24 @@ def cosim2(query, db, topn=10):
     '--topn', 
     help='Top n hits to return.',
     default=10)
+@click.option(
+    '--threads', '-t',
+    help='Number of parallel processes for vector inference', default=1)
+@click.option(
+    '--no-cache', 'no_cache',
+    help='Neither cache parsed annotations nor inferred vectors',
+    is_flag=True, default=False)
+@click.option(
+    '--cache-dir', 'cachedir',
+    help='Cache directory (default: $NANOTEXT_CACHE or ~/.cache/nanotext)',
+    default=None, type=click.Path())
 @click.option(
     '--out',
     help='Output path. If not specified, write to stdout.',
     default='-')
-def predict(genome, embedding, db, model, out, topn):
+def predict(
+    genome, manifest, fmt, embedding, db, model, out, topn, threads, no_cache,
+    cachedir):
     '''
     From a <genome> w/ annotated protein domains predict a phenotype. Requires
     the learned <model> (genotype-phenotype mapping) as well as a genome
@@ -68,38 +60,52 @@ def predict(genome, embedding, db, model, out, topn):
         --embedding data/embedding.genomes.model \\
         --genome data/TARA_ION_MAG_00012.domtbl.tsv \\
         --topn 3
+
+    Like "nanotext search", this accepts a directory, a glob or a manifest of
+    genomes, which are predicted in one go. The results are then written as
+    (query, medium, cos).
+
+    Inferred genome vectors are cached, so predicting the same genomes again
+    skips the inference (see "nanotext search").
     '''
-    import json
     import os
 
-    import numpy as np
     import tensorflow as tf
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # turn off debugging info
     from keras.models import load_model
 
-    from nanotext.io import load_embedding, smart_open, eprint
-    from nanotext.utils import infer_genome_vector
+    from nanotext.io import load_media_vectors
+    from nanotext.io import smart_open, eprint, collect_annotations
+    from nanotext.io import VectorCache
+    from nanotext.utils import infer_batch, most_similar
 
+    queries = collect_annotations(genome, manifest)
+    if not queries:
+        raise click.UsageError('No annotation found, abort!')
+    batch = bool(manifest) or not os.path.isfile(genome)
+    qnames, fps = zip(*queries)
 
-    eprint('Loading embedding model for genomes ...')
-    e = load_embedding(embedding)
-    eprint('Inferring genome vector ...')
-    v = infer_genome_vector(genome, e)
+    if cachedir:
+        os.environ['NANOTEXT_CACHE'] = cachedir  # also for worker processes
+    cache = False if no_cache else VectorCache()
+    params = {'steps': 200, 'fmt': fmt, 'truncate_by': 0, 'seed': None}
 
+    eprint(f'Inferring {len(fps)} genome vector(s) ...')
+    vv = infer_batch(
+        fps, [embedding], workers=threads, cache=cache, **params)[:, 0]
 
     eprint('Loading media vector database ...')
-    with open(db, 'r') as file:
-        vv = json.load(file)  # vv .. vectors
+    names, m = load_media_vectors(db)
 
     eprint('Loading predictive model ...')
     nn = load_model(model)
 
-    y_hat = nn.predict(np.array([v]))[0]  # [0] .. only single genome for now
-    sim = cosim2(y_hat, vv, topn)
+    y_hat = nn.predict(vv)  # one row per genome
+    hits = most_similar(y_hat, names, m, topn)
     with smart_open(out) as fh:
         # fh.write('\nmedium\tcosine\n')
-        for name, cos in sim:
-            fh.write(f'{name}\t{round(cos, 4)}\n')
+        for query, sim in zip(qnames, hits):
+            for name, cos in sim:
+                line = f'{name}\t{round(cos, 4)}\n'
+                fh.write(f'{query}\t{line}' if batch else line)
     eprint('Done.')
-
-
@@ -0,0 +1,462 @@
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+from socketserver import ThreadingMixIn, UnixStreamServer
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import click
+
+
+formats = ['pfamscan', 'hmmer', 'domtblout']  # see load_domains()
+
+
+class MicroBatcher(object):
+    '''
+    Collect the requests of concurrent clients into batches, so that vector
+    inference, the neural net and the index are called once per batch rather
+    than once per request. A single worker thread waits for a request, then
+    for up to <wait> seconds for more, and hands at most <size> of them to
+    <fn>, which must return one result per request (in order). A result
+    that is an exception is raised for its request only.
+
+    Usage:
+
+    batcher = MicroBatcher(lambda items: [i * 2 for i in items])
+    batcher.submit(21)  # blocks until the batch is done
+    # 42
+    '''
+    def __init__(self, fn, size=32, wait=0.01):
+        self.fn = fn
+        self.size = size
+        self.wait = wait
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future.result()
+
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.wait
+            while len(batch) < self.size:
+                try:
+                    batch.append(
+                        self.queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            items, futures = zip(*batch)
+            try:
+                results = self.fn(list(items))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def grouped(items, key):
+    '''
+    Group the positions of <items> by <key>(item), e.g. to infer all requests
+    w/ the same annotation format in one go.
+    '''
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(key(item), []).append(i)
+    return groups.items()
+
+
+def isolate(fn, ix, errors):
+    '''
+    Call <fn> w/ all positions <ix> at once. If that fails, call it for each
+    position, so that only the requests that cause an error fail, and record
+    their exceptions in <errors> (position: exception).
+    '''
+    if not ix:
+        return
+    try:
+        fn(ix)
+    except Exception:
+        for i in ix:
+            try:
+                fn([i])
+            except Exception as e:
+                errors[i] = e
+
+
+class Service(object):
+    '''
+    Holds the models while the server is up and answers batches of requests.
+    Each request is a dict of parameters, e.g.
+
+    {'annotation': 'path/to/genome_pfam.tsv', 'topn': 10, 'within': None}
+    '''
+    def __init__(
+        self, model=None, embedding=None, predictor=None, media=None,
+        steps=1000, threads=1, seed=None, fp_embedding=None, cache=True):
+        self.model = model
+        self.embedding = embedding
+        self.fp_embedding = fp_embedding
+        self.predictor = predictor
+        self.media = media
+        self.steps = steps
+        self.threads = threads
+        self.seed = seed
+        self.cache = cache  # see GenomeModel.infer()
+
+        # one pool for the lifetime of the server, so its workers keep the
+        # models loaded across batches
+        self.pool = None
+        if threads > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=threads)
+
+
+    def validate(self, endpoint, params):
+        '''
+        Check the parameters of a request before it joins a batch, so that
+        it cannot fail the other requests in it. Raise a ValueError if they
+        are bad, otherwise convert them in place (e.g. <topn> to int).
+        '''
+        import os
+
+        annotation = params.get('annotation')
+        if not isinstance(annotation, str) or not os.path.isfile(annotation):
+            raise ValueError('Annotation not found')
+        if params.get('fmt', 'pfamscan') not in formats:
+            raise ValueError(f'fmt must be one of {", ".join(formats)}')
+        try:
+            params['topn'] = int(params.get('topn', 10))
+        except (TypeError, ValueError):
+            raise ValueError('topn must be an integer')
+        if params['topn'] < 1:
+            raise ValueError('topn must be positive')
+
+        within = params.get('within')
+        if endpoint == 'search' and within:
+            if not isinstance(within, str):
+                raise ValueError('within must be a taxon')
+            if not self.model.taxonomy:
+                raise ValueError('No taxonomy loaded')
+            if not len(self.model.taxonomy.lookup(within)):
+                raise ValueError(f'Taxon {within} not found')
+
+
+    def search(self, requests):
+        vv, errors = self._infer(requests, 'pfamscan')
+        results = [None] * len(requests)
+
+        for (within, topn), ix in grouped(
+            requests, lambda x: (x.get('within'), x.get('topn', 10))):
+            def search(ix):
+                hits = self.model.search_batch(vv[ix], topn, within=within)
+                for i, sim in zip(ix, hits):
+                    results[i] = [self._hit(name, cos) for name, cos in sim]
+            isolate(search, [i for i in ix if i not in errors], errors)
+        return [errors.get(i, r) for i, r in enumerate(results)]
+
+
+    def predict(self, requests):
+        from nanotext.utils import infer_batch, most_similar
+        import numpy as np
+
+        vv, errors = [None] * len(requests), {}
+        for f, ix in grouped(requests, lambda x: x.get('fmt', 'hmmer')):
+            def infer(ix):
+                # like "nanotext predict", so both share the vector cache
+                inferred = infer_batch(
+                    [requests[i]['annotation'] for i in ix],
+                    [self.fp_embedding], models=[self.embedding],
+                    workers=self.threads, pool=self.pool, cache=self.cache,
+                    steps=200, fmt=f, truncate_by=0, seed=self.seed)
+                for i, v in zip(ix, inferred[:, 0]):
+                    vv[i] = v
+            isolate(infer, ix, errors)
+
+        ok = [i for i in range(len(requests)) if i not in errors]
+        y_hat = {}
+        if ok:  # one call per batch
+            y_hat = dict(zip(ok, self.predictor.predict(
+                np.array([vv[i] for i in ok]))))
+
+        results = [None] * len(requests)
+        names, m = self.media
+        for topn, ix in grouped(requests, lambda x: x.get('topn', 10)):
+            def search(ix):
+                hits = most_similar(
+                    np.array([y_hat[i] for i in ix]), names, m, topn)
+                for i, sim in zip(ix, hits):
+                    results[i] = [{'medium': name, 'cos': round(cos, 4)} \
+                        for name, cos in sim]
+            isolate(search, [i for i in ix if i not in errors], errors)
+        return [errors.get(i, r) for i, r in enumerate(results)]
+
+
+    def taxonomy(self, request):
+        '''
+        Given a genome <name>, return its lineage; given a <taxon>, return
+        the genomes in it.
+        '''
+        if 'taxon' in request:
+            rows = self.model.taxonomy.lookup(request['taxon'])
+            return [self.model.names[i] for i in rows]
+        return self.model.lineage(request['name'])
+
+
+    def _infer(self, requests, fmt):
+        '''
+        Infer the vectors of all requests, one call per annotation format.
+        Return them and a dict of position: exception for the requests that
+        could not be inferred (see isolate()).
+        '''
+        import numpy as np
+
+        vv = np.zeros((len(requests), self.model.dim), dtype='float32')
+        errors = {}
+        for f, ix in grouped(requests, lambda x: x.get('fmt', fmt)):
+            def infer(ix):
+                vv[ix] = self.model.infer(
+                    [requests[i]['annotation'] for i in ix], fmt=f,
+                    steps=self.steps, workers=self.threads, seed=self.seed,
+                    cache=self.cache, pool=self.pool)
+            isolate(infer, ix, errors)
+        return vv, errors
+
+
+    def _hit(self, name, cos):
+        hit = {'name': name, 'cos': round(float(cos), 4)}
+        if self.model.taxonomy:
+            hit['taxonomy'] = self.model.lineage(name)
+        return hit
+
+
+def make_handler(service, batchers):
+
+    class Handler(BaseHTTPRequestHandler):
+        '''
+        GET /search?annotation=path/to/genome_pfam.tsv&topn=10
+
+        or POST the same parameters as a json object.
+        '''
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            self._answer(url.path, params)
+
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            size = int(self.headers.get('Content-Length', 0))
+            try:
+                params = json.loads(self.rfile.read(size) or '{}')
+            except ValueError:
+                return self._send(400, {'error': 'Body is not valid json'})
+            self._answer(url.path, params)
+
+
+        def _answer(self, path, params):
+            endpoint = path.strip('/')
+            if endpoint == 'taxonomy':
+                if not (service.model and service.model.taxonomy):
+                    return self._send(404, {'error': 'No taxonomy loaded'})
+                try:
+                    return self._send(200, service.taxonomy(params))
+                except KeyError:
+                    return self._send(404, {'error': 'Genome not found'})
+
+            if endpoint not in batchers:
+                return self._send(404, {'error': f'No endpoint /{endpoint}'})
+            try:
+                service.validate(endpoint, params)
+            except ValueError as e:
+                return self._send(400, {'error': str(e)})
+
+            try:
+                result = batchers[endpoint].submit(params)
+            except ValueError as e:
+                return self._send(400, {'error': str(e)})
+            except Exception as e:
+                return self._send(500, {'error': repr(e)})
+            self._send(200, result)
+
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+
+        def address_string(self):
+            # on a Unix socket, the client address is an empty string
+            return self.client_address[0] if self.client_address else 'unix'
+
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+@click.command()
+@click.option(
+    '--models',
+    help='Genome embedding models (for /search and /taxonomy)',
+    default=None, type=click.Path())
+@click.option(
+    '--mode',
+    help='Model w/ focus on core/ accessory/ an ensemble of domains',
+    default='core')
+@click.option(
+    '--index',
+    help='Precomputed index (see "nanotext index"), overrides --mode',
+    default=None, type=click.Path())
+@click.option(
+    '--taxonomy',
+    help='GTDB taxonomy (tsv) or metadata (.db), unless indexed',
+    default=None, type=click.Path())
+@click.option(
+    '--embedding',
+    help='Genome embedding model for /predict',
+    default=None, type=click.Path())
+@click.option(
+    '--model',
+    help='Predictive model for /predict',
+    default=None, type=click.Path())
+@click.option(
+    '--db',
+    help='Media vectors for /predict',
+    default=None, type=click.Path())
+@click.option(
+    '--host', help='Host to listen on', default='127.0.0.1')
+@click.option(
+    '--port', help='Port to listen on', default=8080)
+@click.option(
+    '--socket', 'unix_socket',
+    help='Listen on this Unix socket instead of host:port',
+    default=None, type=click.Path())
+@click.option(
+    '--batch-size', 'batch_size',
+    help='Max number of requests answered together', default=32)
+@click.option(
+    '--wait',
+    help='Seconds to wait for more requests to batch', default=0.01)
+@click.option(
+    '--threads', '-t',
+    help='Number of parallel processes for vector inference', default=1)
+@click.option(
+    '--seed',
+    help='Seed for reproducible vector inference', default=None, type=int)
+@click.option(
+    '--no-cache', 'no_cache',
+    help='Neither cache parsed annotations nor inferred vectors',
+    is_flag=True, default=False)
+@click.option(
+    '--cache-dir', 'cachedir',
+    help='Cache directory (default: $NANOTEXT_CACHE or ~/.cache/nanotext)',
+    default=None, type=click.Path())
+def serve(
+    models, mode, index, taxonomy, embedding, model, db, host, port,
+    unix_socket, batch_size, wait, threads, seed, no_cache, cachedir):
+    '''
+    Keep the models in memory and answer requests over HTTP, instead of
+    loading them for each call of "nanotext search" or "nanotext predict".
+    Concurrent requests are answered in batches.
+
+    Usage:
+
+    \b
+    nanotext serve --models models --index models/index_core \\
+        --taxonomy metadata_GTDB_r89.db --port 8080 &
+
+    \b
+    curl 'localhost:8080/search?annotation=/abs/path/MAG_pfam.tsv&topn=3'
+    # [{"name": "GCF_000158595.1", "cos": 0.9534, "taxonomy": [...]}, ...]
+    curl 'localhost:8080/search?annotation=/abs/path/MAG_pfam.tsv&within=f__Cyanobiaceae'
+    curl 'localhost:8080/taxonomy?name=GCF_000158595.1'
+    curl 'localhost:8080/taxonomy?taxon=g__Prochlorococcus_A'
+
+    W/ --embedding, --model and --db, /predict answers like "nanotext
+    predict". Paths are resolved by the server, so pass absolute ones.
+    Parameters can also be POSTed as json.
+
+    W/ --threads, inference runs in a pool of worker processes that is kept
+    (w/ the models loaded) for as long as the server is up. Inferred vectors
+    are cached like in "nanotext search".
+    '''
+    import os
+
+    from nanotext.io import eprint, VectorCache
+
+    if cachedir:
+        os.environ['NANOTEXT_CACHE'] = cachedir  # also for worker processes
+    cache = False if no_cache else VectorCache()
+    service = Service(threads=threads, seed=seed, cache=cache)
+    batchers = {}
+
+    if models or index:
+        from nanotext.classes import GenomeModel
+
+        eprint('Loading genome model ...')
+        if index:
+            service.model = GenomeModel(models, index=index)
+        else:
+            service.model = GenomeModel(models, mode=mode, norm='l2')
+        if taxonomy and not service.model.taxonomy:
+            eprint('Indexing taxonomy ...')
+            service.model.add_taxonomy(taxonomy)
+        if service.model.fps:
+            service.model.models  # load before the first request
+        batchers['search'] = MicroBatcher(service.search, batch_size, wait)
+
+    if embedding and model and db:
+        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # turn off debugging info
+        from keras.models import load_model
+
+        from nanotext.io import load_embedding, load_media_vectors
+
+        eprint('Loading models for prediction ...')
+        service.embedding = load_embedding(embedding)
+        service.fp_embedding = embedding
+        service.predictor = load_model(model)
+        service.media = load_media_vectors(db)
+        batchers['predict'] = MicroBatcher(service.predict, batch_size, wait)
+
+    if not batchers:
+        raise click.UsageError(
+            'Nothing to serve, pass --models/--index and/or --embedding, --model and --db')
+
+    handler = make_handler(service, batchers)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, handler)
+        eprint(f'Listening on {unix_socket} ...')
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        eprint(f'Listening on {host}:{port} ...')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        eprint('Done.')
+    finally:
+        server.server_close()
+        if service.pool:
+            service.pool.shutdown()
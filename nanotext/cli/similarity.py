@@ -1,15 +1,106 @@
 import click
 
-# TODO: nanotext index
-# https://github.com/facebookresearch/faiss
-# https://github.com/facebookresearch/faiss/wiki/Index-IO,-index-factory,-cloning-and-hyper-parameter-tuning#io-and-deep-copying-indexes
+
+@click.command()
+@click.option(
+    '--models',
+    help='Genome embedding models',
+    required=True, type=click.Path())
+@click.option(
+    '--mode',
+    help='Model w/ focus on core/ accessory/ an ensemble of domains',
+    default='core')
+@click.option(
+    '--norm',
+    help='Normalize vectors ("l2") or not ("none")',
+    default='l2')
+@click.option(
+    '--out', '-o',
+    help='Directory to write the index to',
+    required=True, type=click.Path())
+@click.option(
+    '--index-type', 'index_type',
+    help='faiss index factory string, e.g. "HNSW32" or "IVF4096,Flat"',
+    default='Flat')
+@click.option(
+    '--nprobe',
+    help='Number of lists an IVF index visits per query',
+    default=None, type=int)
+@click.option(
+    '--ef-search', 'ef_search',
+    help='Size of the candidate list of an HNSW index',
+    default=None, type=int)
+@click.option(
+    '--recall', is_flag=True,
+    help='Report recall and latency against an exact index')
+@click.option(
+    '--taxonomy',
+    help='GTDB taxonomy (tsv) or metadata (.db) to index along w/ the vectors',
+    default=None, type=click.Path())
+def index(
+    models, mode, norm, out, index_type, nprobe, ef_search, recall, taxonomy):
+    '''
+    Subtract the mean from the model(s), combine and normalize the vectors and
+    index them. The result is written to disk once, so that subsequent
+    searches can memory-map it instead of rebuilding it.
+
+    https://github.com/facebookresearch/faiss/wiki/Index-IO,-index-factory,-cloning-and-hyper-parameter-tuning#io-and-deep-copying-indexes
+
+    Usage:
+
+    \b
+    nanotext index --models models --mode core --out models/index_core
+    nanotext search --models models --index models/index_core \\
+        --annotation tara/TARA_ION_MAG_00012_pfam.tsv
+
+    The default index is exact. For large collections, use an approximate
+    one and check how its recall@10 and latency depend on --nprobe (IVF) or
+    --ef-search (HNSW), then pick a value:
+
+    \b
+    nanotext index --models models --mode core --out models/index_hnsw \\
+        --index-type HNSW32 --recall
+    '''
+    from nanotext.classes import GenomeModel
+    from nanotext.evaluate import index_recall
+    from nanotext.io import eprint
+
+    norm = None if norm == 'none' else norm
+
+    eprint('Loading model ...')
+    try:
+        model = GenomeModel(
+            models, mode=mode, norm=norm, index_type=index_type,
+            nprobe=nprobe, ef_search=ef_search)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    
+    if taxonomy:
+        eprint('Indexing taxonomy ...')
+        model.add_taxonomy(taxonomy)
+
+    if recall:
+        eprint('param\tvalue\trecall@10\tms/query')
+        for row in index_recall(model.db, model.index):
+            eprint('\t'.join(str(i) for i in row.values()))
+    
+    eprint(f'Writing index to {out} ...')
+    model.save(out)
+    eprint('Done.')
 
 
 @click.command()
 @click.option(
     '--annotation',
-    help='Protein domain annotation from pfam_scan.pl',
+    help='Protein domain annotation from pfam_scan.pl, or a directory/ glob of them',
     type=click.Path())
+@click.option(
+    '--manifest',
+    help='Tsv file listing one annotation per line ("path" or "name<tab>path")',
+    default=None, type=click.Path())
+@click.option(
+    '--fmt',
+    help='Annotation fmt (pfamscan, hmmer or domtblout)', default='pfamscan')
 @click.option(
     '--topn', 
     help='Top n hits to return',
@@ -22,15 +113,59 @@ import click
     '--mode',
     help='Model w/ focus on core/ accessory/ an ensemble of domains',
     default='core')
+@click.option(
+    '--index',
+    help='Precomputed index (see "nanotext index"), overrides --mode',
+    default=None, type=click.Path())
 @click.option(
     '--taxonomy',
-    help='Lookup GTDB taxonomy for hits',
-    default=False)
+    help='GTDB taxonomy (tsv) or metadata (.db) to add to hits, unless indexed',
+    default=None, type=click.Path())
+@click.option(
+    '--within',
+    help='Only search genomes in this taxon, e.g. "c__Clostridia"',
+    default=None)
+@click.option(
+    '--threads', '-t',
+    help='Number of parallel processes for vector inference', default=1)
+@click.option(
+    '--seed',
+    help='Seed for reproducible vector inference', default=None, type=int)
+@click.option(
+    '--steps',
+    help='(Max) number of steps for vector inference', default=1000)
+@click.option(
+    '--tol',
+    help='Stop inference once the vector changes less than this (cosine distance per 50 steps), e.g. 1e-4',
+    default=None, type=float)
+@click.option(
+    '--samples', 'n_samples',
+    help='Infer each vector this many times and average; adds the dispersion of the samples as a column (after cos)',
+    default=1)
+@click.option(
+    '--nprobe',
+    help='Override the lists an IVF index visits per query',
+    default=None, type=int)
+@click.option(
+    '--ef-search', 'ef_search',
+    help='Override the candidate list size of an HNSW index',
+    default=None, type=int)
+@click.option(
+    '--no-cache', 'no_cache',
+    help='Neither cache parsed annotations nor inferred vectors',
+    is_flag=True, default=False)
+@click.option(
+    '--cache-dir', 'cachedir',
+    help='Cache directory (default: $NANOTEXT_CACHE or ~/.cache/nanotext)',
+    default=None, type=click.Path())
 @click.option(
     '--out',
     help='Output path (tsv format). If not specified, write to stdout.',
     default='-')
-def search(annotation, topn, models, mode, taxonomy, out):
+def search(
+    annotation, manifest, fmt, topn, models, mode, index, taxonomy, within,
+    threads, seed, steps, tol, n_samples, nprobe, ef_search, no_cache,
+    cachedir, out):
     '''
     Usage:
 
@@ -44,25 +179,94 @@ def search(annotation, topn, models, mode, taxonomy, out):
     # GCF_000759935.1 0.9282
     # GCF_000759855.1 0.9276
     # Done.
+
+    To screen many genomes, pass a directory, a glob or a manifest. All
+    vectors are inferred in one process and searched at once; the hits are
+    written in long format (query, name, cos):
+
+    \b
+    nanotext search --models models --index models/index_core \\
+        --annotation 'tara/*_pfam.tsv' --out tara.most_similar.tsv
+
+    If the index includes the taxonomy (see "nanotext index --taxonomy") or
+    one is passed, each hit is followed by its 7 GTDB ranks, and the search
+    can be restricted to a taxon:
+
+    \b
+    nanotext search --models models --index models/index_core \\
+        --annotation tara/TARA_ION_MAG_00012_pfam.tsv \\
+        --taxonomy metadata_GTDB_r89.db --within f__Cyanobiaceae
+
+    Inferred vectors are cached (keyed by the annotation's content, the
+    models and the inference parameters), so searching the same genomes
+    again, e.g. w/ another --topn or --within, skips the inference. The
+    cache is capped at 1 GB, least recently used vectors are evicted.
+
+    W/ --tol, the inference of each vector stops once it has converged
+    instead of running all --steps (see scripts/benchmark_inference.py).
+
+    Inference is stochastic. W/ --samples, each vector is inferred several
+    times (in parallel given --threads) and averaged. Each hit is then
+    followed by the dispersion of the samples, i.e. their mean cosine
+    distance to the average. The larger it is compared to the differences
+    in cos btw/ the hits, the less we can trust their order.
     '''
+    import os
+
+    import numpy as np
+
     from nanotext.classes import GenomeModel
-    from nanotext.io import load_embedding, smart_open, eprint
-    from nanotext.utils import infer_genome_vector, get_taxa_from_names
+    from nanotext.io import smart_open, eprint, collect_annotations
+    from nanotext.io import VectorCache
 
-    # fp, mode, 
+    queries = collect_annotations(annotation, manifest)
+    if not queries:
+        raise click.UsageError('No annotation found, abort!')
+    batch = bool(manifest) or not os.path.isfile(annotation)
 
     eprint('Loading model ...')
-    model = GenomeModel(models, mode=mode, norm='l2')
-    v = model.infer(annotation, fmt='pfamscan', steps=1000)
-    sim = model.search(v, topn)
+    if index:
+        model = GenomeModel(models, index=index)
+        try:
+            model.tune(nprobe, ef_search)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    else:
+        model = GenomeModel(models, mode=mode, norm='l2')
+    
+    if taxonomy and not model.taxonomy:
+        eprint('Indexing taxonomy ...')
+        model.add_taxonomy(taxonomy)
+
+    if cachedir:
+        os.environ['NANOTEXT_CACHE'] = cachedir  # also for worker processes
+    cache = False if no_cache else VectorCache()
+
+    qnames, fps = zip(*queries)
+    eprint(f'Inferring {len(fps)} genome vector(s) ...')
+    v = model.infer(
+        list(fps), fmt=fmt, steps=steps, workers=threads, seed=seed,
+        cache=cache, tol=tol, n_samples=n_samples)
+    if model.steps_used:
+        eprint(
+            f'Inference converged after {int(np.median(model.steps_used))} '
+            f'steps (median, max {max(model.steps_used)})')
+    try:
+        hits = model.search_batch(v, topn, within=within)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    
     with smart_open(out) as fh:
-        for name, cos in sim:
-            fh.write(f'{name}\t{round(float(cos), 4)}\n')
-
-    if taxonomy:
-        names, _ = zip(*sim)
-        df = get_taxa_from_names(taxonomy, names)
-        df.to_csv('taxonomy.tsv', sep='\t', index=None)
+        for query, sim, dispersion in zip(qnames, hits, model.dispersion):
+            for name, cos in sim:
+                line = [name, str(round(float(cos), 4))]
+                if batch:
+                    line = [query] + line
+                if n_samples > 1:
+                    line.append(str(round(float(dispersion), 4)))
+                if model.taxonomy:
+                    line += model.lineage(name)
+                fh.write('\t'.join(line) + '\n')
 
     eprint('Done.')
 
@@ -101,11 +305,25 @@ def compare(genome, topn, out):
     help='File path genome annotation', required=True, type=click.Path())
 @click.option(
     '--fmt',
-    help='Query fmt (pfamscan or hmmer)', default='hmmer')
+    help='Query fmt (pfamscan, hmmer or domtblout)', default='hmmer')
 @click.option(
     '--steps',
     help='How many epochs for vector inference', default=200)
-def taxonomy(query, taxonomy, embedding, topn, outfile, fmt, steps):
+@click.option(
+    '--projection',
+    help='Project the genomes of the taxon into 2D (tsne, umap or none)',
+    default='tsne', type=click.Choice(['tsne', 'umap', 'none']))
+@click.option(
+    '--no-cache', 'no_cache',
+    help='Neither cache parsed annotations nor inferred vectors',
+    is_flag=True, default=False)
+@click.option(
+    '--cache-dir', 'cachedir',
+    help='Cache directory (default: $NANOTEXT_CACHE or ~/.cache/nanotext)',
+    default=None, type=click.Path())
+def taxonomy(
+    query, taxonomy, embedding, topn, outfile, fmt, steps, projection,
+    no_cache, cachedir):
     '''
     Given a query vector, get the <n> closest vectors and their taxonomy and
     then report their <raw> taxonomy or use <majority vote> to identify the
@@ -118,6 +336,8 @@ def taxonomy(query, taxonomy, embedding, topn, outfile, fmt, steps):
         --embedding nanotext_r89.model --taxonomy bac_taxonomy_r86.tsv \\
         --query JFOD01_pfam.tsv --fmt pfamscan --topn 10 -o results.json
 
+    All genomes of the last rank shared by the hits are projected into 2D
+    (columns c1, c2); skip this w/ --projection none.
     '''
 
     '''
@@ -131,15 +351,14 @@ def taxonomy(query, taxonomy, embedding, topn, outfile, fmt, steps):
     '''
     from collections import Counter, defaultdict
     import json
-    import pdb
+    import os
     import random
 
     import numpy as np
-    from sklearn.manifold import TSNE
-    import umap
 
-    from nanotext.io import load_taxonomy_gtdb, load_embedding, eprint
-    from nanotext.utils import infer_genome_vector, strip_name
+    from nanotext.classes import TaxonomyIndex
+    from nanotext.io import load_embedding, eprint, VectorCache
+    from nanotext.utils import infer_cached, infer_genome_vector
 
 
     config_umap_visualisation = {
@@ -157,10 +376,25 @@ def taxonomy(query, taxonomy, embedding, topn, outfile, fmt, steps):
         'domain', 'phylum', 'class', 'order', 'family', 'genus', 'species']
     notfound = []
     
-    db = load_taxonomy_gtdb(taxonomy)
     model = load_embedding(embedding)
-
-    v_query = infer_genome_vector(query, model, fmt=fmt, steps=steps)
+    names = list(model.docvecs.index2entity)
+    tax = TaxonomyIndex.from_gtdb(taxonomy, names)
+    rows = {name: i for i, name in enumerate(names)}
+
+    if cachedir:
+        os.environ['NANOTEXT_CACHE'] = cachedir
+    cache = False if no_cache else VectorCache()
+    params = {'steps': steps, 'fmt': fmt, 'truncate_by': 0, 'seed': None}
+
+    def infer(fps):
+        return np.array([[infer_genome_vector(
+            i, model, cache=bool(cache), **params)] for i in fps])
+
+    if cache:
+        v_query = infer_cached([query], [embedding], cache, infer, **params)
+    else:
+        v_query = infer([query])
+    v_query = v_query[0, 0]
     sim = model.docvecs.most_similar([v_query], topn=topn)
 
 
@@ -169,13 +403,12 @@ def taxonomy(query, taxonomy, embedding, topn, outfile, fmt, steps):
 
     for name, cos_sim in sim:
         distance[name] = round(cos_sim, 4)
-        try:
-            for k, v in zip(ranks, db[name]):
-                taxcollector[k].append(v)
-
-        except KeyError:
+        lineage = tax.taxonomy(rows[name])
+        if not any(lineage):
             eprint(f'{name} has no taxonomy record')
             continue
+        for k, v in zip(ranks, lineage):
+            taxcollector[k].append(v)
 
 
     # What is the last uniform rank?
@@ -189,43 +422,36 @@ def taxonomy(query, taxonomy, embedding, topn, outfile, fmt, steps):
     
 
     # p__Firmicutes_A
-    # Collect the UIDs for this rank.
+    # Collect the associated document vector for each UID of this rank.
     eprint(f'Will collect all vectors for {cache[0]} {cache[1]} ...')
-    names = []
-    with open(taxonomy, 'r') as file:
-        for line in file:
-            # if 'c__Clostridia' in line:
-            # if 'f__Pseudomonadaceae' in line:
-            # if ('p__Firmicutes_A' in line) or ('p__Firmicutes_B' in line): 
-            if f'{cache[0][0]}__{cache[1]}' in line:  # d__ for domain etc.
-                names.append(line.strip().split('\t')[0])
-
-
-    # Collect the associated document vector for each UID.
-    m, found = [], []
-    for name in names:
-        try:
-            m.append(model.docvecs[strip_name(name)])
-            found.append(strip_name(name))
-        except KeyError:
-            continue
+    ix = tax.lookup(f'{cache[0][0]}__{cache[1]}')  # d__ for domain etc.
+    found = [names[i] for i in ix]
+    m = model.docvecs.vectors_docs[ix]
 
 
     # Project into 2D.
-    eprint(f'Projecting with UMAP ...')
     m = np.array(m, dtype='float64')
-    reducer = umap.UMAP(**config_umap_visualisation)
-    # projection = reducer.fit_transform(m)
-    eprint(f'Projecting with TSNE ...')
-    projection = TSNE(n_components=2, random_state=42).fit_transform(m)
+    if projection == 'umap':
+        import umap
+
+        eprint(f'Projecting with UMAP ...')
+        reducer = umap.UMAP(**config_umap_visualisation)
+        projection = reducer.fit_transform(m)
+    elif projection == 'tsne':
+        from sklearn.manifold import TSNE
+
+        eprint(f'Projecting with TSNE ...')
+        projection = TSNE(n_components=2, random_state=42).fit_transform(m)
+    else:
+        projection = np.full((len(m), 2), np.nan)  # written as "nan"
 
     results = defaultdict(list)
     # results['query'].extend(reducer.transform([v_query])[0])
     # results['query'].extend(7*['query'])
 
-    for i, j in zip(found, projection):
+    for i, j, k in zip(found, projection, ix):
         results[i].extend(j)
-        results[i].extend(db[i])
+        results[i].extend(tax.taxonomy(k))
 
 
     # Add distance info.
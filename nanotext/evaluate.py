@@ -14,32 +14,111 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
-def odd_one(fp_test_corpus, fp_model, n_not_odd=5):
+def odd_one(fp_test_corpus, fp_model, n_not_odd=5, seed=42):
     '''
-    SOMO task.
+    SOMO task, returns the accuracy (see somo()).
     '''
-    import random
-    from nanotext.io import load_embedding
+    return somo(fp_test_corpus, fp_model, n_not_odd, seed)['accuracy']
+
+
+def somo(fp_test_corpus, model, n_not_odd=5, seed=42, batch_size=10000):
+    '''
+    SOMO task (semantic odd man out): Split each contig of the test corpus
+    into chunks of <n_not_odd> domains, add a random domain from the
+    vocabulary (the odd one) and count how often it is the one that fits
+    least (see odd_one_out()). Domains not in the vocabulary are ignored,
+    like gensim's doesnt_match() does, and chunks w/ less than 2 domains
+    left are skipped, they would be a coin flip.
+
+    The odd ones are drawn w/ <seed>, and the chunks are evaluated in
+    batches of <batch_size>. <model> is a gensim model or its path. Returns
+    the accuracy and its 95% (Wilson) confidence interval.
+
+    Usage:
+
+    somo('corpus.shuffle.test.txt', 'nanotext_r89.model')
+    # {'accuracy': 0.9927, 'low': 0.9921, 'high': 0.9932, 'n': 874211}
+    '''
+    import numpy as np
 
-    model = load_embedding(fp_model)
-    vocab = list(model.wv.vocab.keys())
-    pos, neg = 0, 0
+    from nanotext.io import load_embedding
 
+    if isinstance(model, str):
+        model = load_embedding(model)
+    wv = np.array(model.wv.vectors, dtype='float32')
+    wv /= np.linalg.norm(wv, axis=1, keepdims=True)
+    vocab = {w: i for i, w in enumerate(model.wv.index2word)}
+    
+    rng = np.random.RandomState(seed)
+    pos, n = 0, 0
+
+    def evaluate(batch):
+        tokens = np.zeros((len(batch), n_not_odd + 1), dtype=np.int64)
+        mask = np.zeros(tokens.shape, dtype=bool)
+        odd = rng.randint(len(wv), size=len(batch))
+        for i, seq in enumerate(batch):
+            tokens[i, :len(seq)] = seq
+            tokens[i, len(seq)] = odd[i]
+            mask[i, :len(seq)+1] = True
+        
+        guess = odd_one_out(wv, tokens, mask)
+        # the odd one might also be in the chunk, so compare the domains
+        return int((tokens[np.arange(len(batch)), guess] == odd).sum())
+
+    batch = []
     with open(fp_test_corpus, 'r') as file:
         for line in file:
             genome, contig, domains = line.strip().split('\t')
             domains = domains.split(',')
             for seq in chunks(domains, n_not_odd):
-                if len(seq) > 1:  # otherwise its a 50:50 coin flip
-                    odd = random.choice(vocab)
-                    guess = model.wv.doesnt_match(seq+[odd])
-                    if guess == odd:
-                        pos += 1
-                    else:
-                        neg += 1
+                seq = [vocab[i] for i in seq if i in vocab]
+                if len(seq) > 1:  # otherwise its a 50:50 coin flip (or a hit)
+                    batch.append(seq)
 
-    return round(pos/(pos+neg), 4)
+            if len(batch) >= batch_size:
+                pos, n = pos + evaluate(batch), n + len(batch)
+                batch = []
+    if batch:
+        pos, n = pos + evaluate(batch), n + len(batch)
 
+    low, high = wilson_interval(pos, n)
+    return {
+        'accuracy': round(pos/n, 4), 'low': round(low, 4),
+        'high': round(high, 4), 'n': n}
+
+
+def odd_one_out(wv, tokens, mask):
+    '''
+    Given L2-normalized word vectors <wv> (one per row) and padded rows of
+    word indices <tokens> w/ a boolean <mask> of the valid positions, return
+    the position of the word that fits least in each row. This is the word w/
+    the lowest cosine to the mean of the row's vectors, as in gensim's
+    doesnt_match() (except that gensim breaks exact ties alphabetically).
+    '''
+    import numpy as np
+
+    vv = wv[tokens] * mask[..., None]  # (rows, positions, dimensions)
+    mean = vv.sum(axis=1)
+    mean /= np.linalg.norm(mean, axis=1, keepdims=True)
+    
+    dist = np.einsum('ijk,ik->ij', vv, mean)
+    dist[~mask] = np.inf
+    return dist.argmin(axis=1)
+
+
+def wilson_interval(pos, n, z=1.96):
+    '''
+    Wilson score interval of a proportion of <pos> in <n>; z = 1.96 for 95%.
+
+    https://en.wikipedia.org/wiki/Binomial_proportion_confidence_interval
+    '''
+    from math import sqrt
+
+    p = pos / n
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2*n)) / denominator
+    margin = z * sqrt(p * (1-p) / n + z**2 / (4 * n**2)) / denominator
+    return center - margin, center + margin
 
 
 '''
@@ -116,6 +195,12 @@ def ecotype_task(ecotypes, model):
     Ecotypes are passed as a dict of (GenBank/ RefSeq) UIDs and their corresponding ecotype:
     
     {'GCA_000877625.1': 'VppAsia', ...}
+
+    For each genome, we look up its nearest neighbor (cosine) among the other
+    genomes and count a hit if both share the ecotype. Returns the fraction
+    of hits per ecotype. The <model> is a gensim model, a GenomeModel (to
+    evaluate an ensemble) or a dict of UID: vector (see get_vectors()).
+    Genomes not in the model are skipped.
     
     Usage:
     
@@ -130,41 +215,88 @@ def ecotype_task(ecotypes, model):
 
     ecotype_task({k: v2 for k, (v1, v2) in ecotypes.items()}, model)
     '''
-    from collections import defaultdict
     import numpy as np
 
-    pos, neg = 0, 0
-    notfound = []
-
-    # discard all keys that are not present in the model
-    for k in ecotypes.keys():
-        try:
-            _ = model.docvecs[k]
-        except KeyError:
-            notfound.append(k)
-
-    for k in notfound:
-        del ecotypes[k]
-
-    d = defaultdict(list)
-    for ix, (name, ecotype) in enumerate(ecotypes.items()):
-        all_but_ix = list(ecotypes.keys())
-        del all_but_ix[ix]
-        nn = model.docvecs.most_similar_to_given(name, all_but_ix) 
-        # nn .. nearest neighbor
-        ne = ecotypes[nn]
-        # ne .. nearest ecotype
-        if ecotype == ne:
-            d[ecotype].append(1)
-            # pos += 1
-        else:
-            d[ecotype].append(0)
-            # neg += 1
+    from nanotext.utils import get_vectors
+
+    found, m = get_vectors(list(ecotypes), model, normalized=True)
+    
+    sim = m @ m.T
+    np.fill_diagonal(sim, -np.inf)  # a genome is not its own neighbor
+    nn = sim.argmax(axis=1)  # nn .. nearest neighbor, first one on ties
+
+    labels = np.array([ecotypes[i] for i in found])
+    hits = labels[nn] == labels
     
     result = {}
-    for k, v in d.items():
-        result[k] = round(np.sum(v)/len(v), 4)
+    for k in dict.fromkeys(labels):  # in order of appearance
+        result[str(k)] = round(float(hits[labels == k].mean()), 4)
 
     return result
 
 
+def index_recall(
+    db, index, topn=10, n_queries=1000, nprobe=(1, 4, 16, 64, 256),
+    ef_search=(16, 32, 64, 128, 256), seed=42):
+    '''
+    Compare an approximate faiss <index> over the vectors <db> against an
+    exact (flat) one: For a random sample of <n_queries> vectors from <db>,
+    report the recall of the <topn> nearest neighbors and the latency (ms per
+    query) for each value of <nprobe> (IVF indices) or <ef_search> (HNSW
+    indices). Parameters that do not apply to the index are skipped, and the
+    index is left as we found it.
+
+    Usage:
+
+    from nanotext.classes import GenomeModel
+    model = GenomeModel('path/to/models', mode='core', index_type='HNSW32')
+    for row in index_recall(model.db, model.index):
+        print(row)
+    # {'param': 'efSearch', 'value': 16, 'recall': 0.912, 'ms': 0.0413}
+    # ...
+    '''
+    import time
+
+    import faiss
+    import numpy as np
+
+    from nanotext.utils import tune_index
+
+    db = np.asarray(db, dtype='float32')
+    rng = np.random.RandomState(seed)
+    queries = db[rng.choice(len(db), min(len(db), n_queries), replace=False)]
+
+    exact = faiss.IndexFlat(db.shape[1], index.metric_type)
+    exact.add(db)
+    _, truth = exact.search(queries, topn)
+
+    ivf, hnsw = faiss.try_extract_index_ivf(index), getattr(index, 'hnsw', None)
+    before = {
+        'nprobe': ivf.nprobe if ivf else None,
+        'ef_search': hnsw.efSearch if hnsw else None}
+
+    grid = [('default', None)]
+    grid += [('nprobe', i) for i in nprobe] + [('efSearch', i) for i in ef_search]
+    
+    result = []
+    for param, value in grid:
+        if value:
+            try:
+                tune_index(index, **{
+                    'nprobe': value if param == 'nprobe' else None,
+                    'ef_search': value if param == 'efSearch' else None})
+            except ValueError:
+                continue
+        
+        start = time.time()
+        _, found = index.search(queries, topn)
+        ms = (time.time() - start) * 1000 / len(queries)
+
+        recall = np.mean([
+            len(set(i) & set(j)) / topn for i, j in zip(found, truth)])
+        result.append({
+            'param': param, 'value': value, 'recall': round(recall, 4),
+            'ms': round(ms, 4)})
+    
+    tune_index(index, **before)
+    return result
@@ -1,5 +1,8 @@
 import contextlib
+import os
 import sqlite3
+import threading
+import time
 
 
 @contextlib.contextmanager
@@ -28,14 +31,20 @@ def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
-def load_domains(fp, fmt='pfamscan'):
+def load_domains(fp, fmt='pfamscan', columnar=False, evalue=1e-18, cov=0.35):
     '''
-    fmt .. format can be 'pfamscan' or 'hmmer'
+    fmt .. format can be 'pfamscan', 'hmmer' (hmmscan --domtblout reformatted
+    w/ HmmPy.py) or 'domtblout' (the raw hmmscan --domtblout)
 
-    TODO: filter, recommendation bacteria:
-    E-value 1e-18, cov 0.35
-    for bacteria, use E-value < 1e-18 and coverage > 0.35
+    Returns a dict of the form {(seq_id, start, end): Interval(...)}. If
+    <columnar>, return a DomainTable instead, i.e. one array per field w/o
+    creating an Interval for each domain. This is much faster and leaner for
+    large annotations, and all of remove_overlap(), deduplicate() and
+    create_domain_sequence() accept it.
 
+    For 'domtblout', domains are filtered on the fly like HmmPy.py does, i.e.
+    by their i-Evalue (<= <evalue>) and the fraction of the HMM they cover
+    (>= <cov>). The defaults are the dbCAN recommendations for bacteria:
 
     > Our suggestion is that for plants, use E-value < 1e-23 and coverage > 0.2; for bacteria, use E-value < 1e-18 and coverage > 0.35; and for fungi, use E-value < 1e-17 and coverage > 0.45.
 
@@ -49,6 +58,16 @@ def load_domains(fp, fmt='pfamscan'):
         num_lines_in_header = 29
         header = 'seq_id alignment_start alignment_end envelope_start envelope_end hmm_acc hmm_name type hmm_start hmm_end hmm_length bit_score E-value significance clan'.split()
 
+        if columnar:
+            # seq_id, envelope_start, envelope_end, hmm_acc, E-value
+            columns = [header.index(i) for i in [
+                'seq_id', 'envelope_start', 'envelope_end', 'hmm_acc',
+                'E-value']]
+            with open(fp, 'r') as file:
+                for i in range(num_lines_in_header):
+                    _ = next(file)  # skip header
+                return _read_columns(file, columns, sep=None)
+
         intervals = {}
         with open(fp, 'r') as file:
         
@@ -79,6 +98,15 @@ def load_domains(fp, fmt='pfamscan'):
                 header[4] = 'accession_query'  
                 # originally named "accession" -- would create 2 columns w/ 
                 # same name, bad
+
+                if columnar:
+                    # like the dict below, the last of several columns w/ the
+                    # same name wins (e.g. "from" and "to" of the envelope)
+                    ix = {k: i for i, k in enumerate(header)}
+                    columns = [ix[i] for i in [
+                        'query name', 'from', 'to', 'accession', 'E-value']]
+                    return _read_columns(file, columns, sep='\t')
+
                 for line in file:
                     d = {k:v for k, v in zip(header, line.split('\t'))}
                     uid = d['query name']
@@ -91,11 +119,174 @@ def load_domains(fp, fmt='pfamscan'):
             print('Yes, I thought so. Abort!')
             return None
 
+    elif fmt == 'domtblout':
+        # same columns as the (last) "query name", "from", "to", "accession"
+        # and "E-value" in the HmmPy.py output
+        columns = [3, 19, 20, 1, 6]
+        with open(fp, 'r') as file:
+            lines = _filter_domtblout(file, evalue, cov)
+            if columnar:
+                return _read_columns(lines, columns, sep=None)
+
+            a, b, c, d, e = columns
+            intervals = {}
+            for line in lines:
+                fields = line.split()
+                uid = fields[a]
+                start, end = int(fields[b]), int(fields[c])
+                intervals[(uid, start, end)] = to_interval(
+                    uid, start, end, fields[d], fields[e])
+        return intervals
+
     else:
-        print(f'Only formats "pfamscan" and "hmmer" are supported. Abort!')
+        print(f'Only formats "pfamscan", "hmmer" and "domtblout" are supported. Abort!')
         return None
 
 
+def _filter_domtblout(lines, evalue=1e-18, cov=0.35):
+    '''
+    Yield the domain lines of a hmmscan --domtblout w/ an i-Evalue <= <evalue>
+    that cover >= <cov> of the HMM, i.e. (hmm to - hmm from) / hmm length.
+    '''
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        fields = line.split(None, 22)  # the description can contain spaces
+        if len(fields) < 22:  # blank line
+            continue
+        if float(fields[12]) > evalue:
+            continue
+        if (int(fields[16]) - int(fields[15])) / int(fields[2]) < cov:
+            continue
+        yield line
+
+
+def _read_columns(lines, columns, sep=None):
+    '''
+    Read the fields at positions <columns> (seq_id, start, end, name and
+    E-value) from <lines> into a DomainTable.
+
+    Like the dict returned by load_domains(), a later domain w/ the same
+    (seq_id, start, end) replaces an earlier one but keeps its position.
+    '''
+    a, b, c, d, e = columns
+    seq_id, start, end, name, evalue = [], [], [], [], []
+    seen = {}
+
+    for line in lines:
+        fields = line.split(sep)
+        if len(fields) < 2:  # blank line
+            continue
+        k = (fields[a], int(fields[b]), int(fields[c]))
+        if k in seen:
+            ix = seen[k]
+            name[ix], evalue[ix] = fields[d], float(fields[e])
+            continue
+        seen[k] = len(seq_id)
+        seq_id.append(k[0])
+        start.append(k[1])
+        end.append(k[2])
+        name.append(fields[d])
+        evalue.append(float(fields[e]))
+
+    return DomainTable(seq_id, start, end, name, evalue)
+
+
+class DomainTable(object):
+    '''
+    Columnar protein domain annotation, one array per field:
+
+    seq_id .. ORF UID, e.g. NZ_CVUA01000001.1_993
+    start  .. domain start on the ORF
+    end    .. domain end
+    name   .. domain accession, e.g. PF00815.1
+    evalue .. E-value, smaller is more plausible
+
+    Rows are in the order of the annotation file. Index w/ a boolean mask or
+    an array of row numbers to get a subset.
+
+    Usage:
+
+    dom = load_domains('path/to/pfam.tsv', fmt='pfamscan', columnar=True)
+    dom = deduplicate(remove_overlap(dom))
+    seq = create_domain_sequence(dom, fmt_fn=lambda x: x.split('.')[0])
+    '''
+    __slots__ = ('seq_id', 'start', 'end', 'name', 'evalue')
+
+    def __init__(self, seq_id, start, end, name, evalue):
+        import numpy as np
+
+        self.seq_id = np.asarray(seq_id, dtype=str)
+        self.start = np.asarray(start, dtype='int64')
+        self.end = np.asarray(end, dtype='int64')
+        self.name = np.asarray(name, dtype=str)
+        self.evalue = np.asarray(evalue, dtype='float64')
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, ix):
+        return DomainTable(
+            self.seq_id[ix], self.start[ix], self.end[ix], self.name[ix],
+            self.evalue[ix])
+
+    def to_intervals(self):
+        '''
+        Return the dict of intervals that load_domains() returns by default.
+        '''
+        from nanotext.utils import to_interval
+
+        intervals = {}
+        for row in zip(
+            self.seq_id.tolist(), self.start.tolist(), self.end.tolist(),
+            self.name.tolist(), self.evalue.tolist()):
+            uid, start, end, name, evalue = row
+            intervals[(uid, start, end)] = to_interval(
+                uid, start, end, name, str(evalue))
+        return intervals
+
+
+def collect_annotations(annotation=None, manifest=None):
+    '''
+    Collect a batch of annotation files and return a list of (name, path)
+    tuples. The <annotation> can be a single file, a directory or a glob
+    pattern (e.g. "tara/*_pfam.tsv"); a <manifest> is a tsv file w/ one
+    annotation per line, either "path" or "name<tab>path". If no name is
+    given, it is derived from the file name w/o its extension.
+
+    collect_annotations('tara/')
+    # [('TARA_ION_MAG_00012_pfam', 'tara/TARA_ION_MAG_00012_pfam.tsv'), ...]
+    '''
+    from glob import glob
+    import os
+    from pathlib import Path
+
+    fps = []
+    if annotation:
+        if os.path.isdir(annotation):
+            fps.extend(sorted(
+                str(p) for p in Path(annotation).iterdir() if p.is_file()))
+        elif os.path.isfile(annotation):
+            fps.append(annotation)
+        else:
+            fps.extend(sorted(glob(annotation)))
+
+    result = [(Path(fp).stem, fp) for fp in fps]
+
+    if manifest:
+        with open(manifest, 'r') as file:
+            for line in file:
+                if (not line.strip()) or line[0] == '#':
+                    continue
+                fields = line.strip().split('\t')
+                if len(fields) == 1:
+                    result.append((Path(fields[0]).stem, fields[0]))
+                else:
+                    result.append((fields[0], fields[1]))
+
+    return result
+
+
 def load_orfs(fp, fmt='gff'):
     '''
     orfs = load_orfs('orfs.gff')
@@ -187,17 +378,180 @@ def tokenize_ensembl(anno, keep_unknown=True):
     return genome, result
 
 
-def load_embedding(fp, algorithm='doc2vec'):
+def load_embedding(fp, algorithm='doc2vec', mmap=None):
+    '''
+    Pass mmap='r' to memory-map the model's large arrays (read-only) instead
+    of reading them into memory, e.g. to share one model between processes.
+    '''
     from gensim.models import Doc2Vec
 
     if algorithm == 'doc2vec':
-        model = Doc2Vec.load(fp)
+        model = Doc2Vec.load(fp, mmap=mmap)
         return model
     else:
         print('Not implemented yet, sorry.')
         return None
 
 
+def _npy_cache(fp, keys, compute, cache=True, mmap_mode=None):
+    '''
+    Return the arrays that <compute>() derives from the file <fp>, cached as
+    "<fp>.<key>.npy" for each of <keys>. The cache is stamped w/ the path and
+    modification time of <fp>; as long as these match, we do not compute
+    again. If the cache cannot be written (e.g. on a read-only share), we
+    carry on w/o it.
+    '''
+    import json
+
+    import numpy as np
+
+    stamp = {'path': os.path.abspath(fp), 'mtime': os.stat(fp).st_mtime}
+    files = [f'{fp}.{k}.npy' for k in keys]
+
+    if cache:
+        try:
+            with open(f'{fp}.cache.json', 'r') as file:
+                if json.load(file) == stamp:
+                    return [np.load(i, mmap_mode=mmap_mode) for i in files]
+        except (OSError, ValueError):
+            pass  # no or corrupt cache, recompute
+
+    arrays = compute()
+
+    if cache:
+        try:
+            for i, array in zip(files, arrays):
+                np.save(i, array)
+            # write the stamp last, so an interrupted write is not used
+            with open(f'{fp}.cache.json', 'w+') as out:
+                json.dump(stamp, out)
+        except OSError:
+            eprint(f'Could not cache {fp}, continue w/o')
+    return arrays
+
+
+def load_demeaned(fp, cache=True):
+    '''
+    Return the names, the mean vector and the demeaned document vectors of
+    the model at <fp> (see demean()).
+
+    The result is cached as .npy files next to the model (see _npy_cache()),
+    so as long as the model does not change, it is not even loaded.
+    '''
+    import numpy as np
+
+    from nanotext.utils import demean
+
+    def compute():
+        names, mu, m = demean(load_embedding(fp))
+        return np.array(names, dtype=str), mu, m
+
+    names, mu, m = _npy_cache(
+        fp, ['names', 'mean', 'demeaned'], compute, cache, mmap_mode='r')
+    return names.tolist(), np.asarray(mu), m
+
+
+def load_media_vectors(fp, cache=True):
+    '''
+    Load the media vectors (json, medium: vector) and return their names and
+    a matrix of the L2-normalized vectors (float32), one row per medium. Both
+    are cached next to <fp> (see _npy_cache()).
+    '''
+    import json
+
+    import numpy as np
+    from sklearn.preprocessing import normalize
+
+    def compute():
+        with open(fp, 'r') as file:
+            vv = json.load(file)  # vv .. vectors
+        m = normalize(np.array(list(vv.values()), dtype='float32'), axis=1)
+        return np.array(list(vv.keys()), dtype=str), m
+
+    names, m = _npy_cache(fp, ['names', 'normalized'], compute, cache)
+    return names.tolist(), m
+
+
+def cache_dir():
+    '''
+    Where we cache what we derive from annotations; set NANOTEXT_CACHE to
+    change it.
+    '''
+    return os.environ.get(
+        'NANOTEXT_CACHE', os.path.expanduser('~/.cache/nanotext'))
+
+
+def file_hash(fp, size=2**20):
+    '''
+    sha1 of the content of <fp>, read in chunks of <size> bytes.
+    '''
+    import hashlib
+
+    h = hashlib.sha1()
+    with open(fp, 'rb') as file:
+        for chunk in iter(lambda: file.read(size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_tokens(fp, fmt='pfamscan', cache=True):
+    '''
+    Parse the genome annotation <fp> into its domain sequence (see
+    create_domain_sequence(), w/ Pfam versions removed), coded like the
+    binary corpus (see load_binary_corpus()):
+
+    vocab   .. the distinct domains
+    tokens  .. the domain sequence as positions in vocab
+    offsets .. contig i spans tokens[offsets[i]:offsets[i+1]]
+    contigs .. contig names
+
+    The result is cached under cache_dir(), keyed by the sha1 of the file
+    and <fmt>, so inference w/ other settings or models does not parse the
+    same annotation again.
+
+    Usage:
+
+    c = load_tokens('tara/TARA_ION_MAG_00012_pfam.tsv')
+    c['vocab'][c['tokens'][c['offsets'][0]:c['offsets'][1]]]
+    # array(['unknown', 'PF00005', ...
+    '''
+    import numpy as np
+
+    from nanotext.utils import create_domain_sequence
+
+    keys = ['vocab', 'tokens', 'offsets', 'contigs']
+    out = os.path.join(cache_dir(), 'tokens', f'{file_hash(fp)}.{fmt}.npz')
+
+    if cache:
+        try:
+            with np.load(out) as c:
+                return {k: c[k] for k in keys}
+        except (OSError, ValueError, KeyError):
+            pass  # no or corrupt cache, parse again
+
+    seq = create_domain_sequence(
+        load_domains(fp, fmt=fmt, columnar=True),
+        keep_unknown=True, fmt_fn=lambda x: x.split('.')[0])
+    flat = [i for v in seq.values() for i in v]
+    vocab, tokens = np.unique(np.array(flat, dtype=str), return_inverse=True)
+    c = {
+        'vocab': vocab,
+        'tokens': tokens.astype('int32').reshape(-1),
+        'offsets': np.cumsum(
+            [0] + [len(v) for v in seq.values()], dtype='int64'),
+        'contigs': np.array(list(seq.keys()), dtype=str)}
+
+    if cache:
+        try:
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            tmp = f'{out}.{os.getpid()}.tmp.npz'
+            np.savez(tmp, **c)
+            os.replace(tmp, out)  # readers never see a partial file
+        except OSError:
+            eprint(f'Could not cache {fp}, continue w/o')
+    return c
+
+
 def save_embedding(prefix, model):
     '''
     Save gensim model in GloVe format.
@@ -223,6 +577,189 @@ def save_embedding(prefix, model):
             out.write(f'{k} {v}\n')
 
 
+def save_index(outdir, names, db, means, index, meta):
+    '''
+    Persist a genome index to a directory:
+
+    names.txt   .. one genome UID per line, in the row order of the matrix
+    vectors.npy .. the demeaned (and normalized) ensemble matrix
+    means.npy   .. the mean vector of each model, to demean inferred vectors
+    index.faiss .. the faiss index over vectors.npy
+    meta.json   .. mode, norm and model paths the index was built from
+
+    Load it again w/ load_index().
+    '''
+    import json
+    from pathlib import Path
+
+    import faiss
+    import numpy as np
+
+    p = Path(outdir)
+    p.mkdir(parents=True, exist_ok=True)
+
+    with open(p / 'names.txt', 'w+') as out:
+        for name in names:
+            out.write(f'{name}\n')
+    np.save(p / 'vectors.npy', np.asarray(db, dtype='float32'))
+    np.save(p / 'means.npy', np.asarray(means, dtype='float32'))
+    faiss.write_index(index, str(p / 'index.faiss'))
+    with open(p / 'meta.json', 'w+') as out:
+        json.dump(meta, out, indent=4)
+
+
+def load_index(fp, mmap=True):
+    '''
+    Load a genome index written by save_index(). If <mmap>, the vector matrix
+    and the faiss index are memory-mapped rather than read into memory, which
+    makes loading near instantaneous.
+
+    names, db, means, index, meta = load_index('path/to/index')
+    '''
+    import json
+    from pathlib import Path
+
+    import faiss
+    import numpy as np
+
+    p = Path(fp)
+    with open(p / 'meta.json', 'r') as file:
+        meta = json.load(file)
+    with open(p / 'names.txt', 'r') as file:
+        names = [line.strip() for line in file]
+
+    mmap_mode = 'r' if mmap else None
+    db = np.load(p / 'vectors.npy', mmap_mode=mmap_mode)
+    means = np.load(p / 'means.npy')
+
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(str(p / 'index.faiss'), flags)
+    else:
+        index = faiss.read_index(str(p / 'index.faiss'))
+
+    return names, db, means, index, meta
+
+
+def write_binary_corpus(fp, outdir):
+    '''
+    Convert a corpus of the form
+
+    genome<tab>contig<tab>domain,domain,...
+
+    into a binary corpus, i.e. a directory w/ the integer-encoded domains:
+
+    vocab.txt   .. one domain per line, its line number is its code
+    genomes.txt .. one genome per line, ditto
+    contigs.txt .. the contig of each document (line in the corpus)
+    tokens.bin  .. all domain codes, concatenated (int32)
+    offsets.npy .. document i spans tokens[offsets[i]:offsets[i+1]]
+    docs.npy    .. the genome code of each document
+    meta.json   .. counts
+
+    Load it again w/ load_binary_corpus().
+    '''
+    import json
+    from pathlib import Path
+
+    import numpy as np
+
+    p = Path(outdir)
+    p.mkdir(parents=True, exist_ok=True)
+
+    vocab, genomes = {}, {}
+    offsets, docs = [0], []
+
+    with open(fp, 'r') as file, \
+         open(p / 'tokens.bin', 'wb') as tokens, \
+         open(p / 'contigs.txt', 'w+') as contigs:
+
+        for line in file:
+            genome, contig, domains = line.strip().split('\t')
+            codes = [vocab.setdefault(i, len(vocab)) for i in domains.split(',')]
+            np.array(codes, dtype='int32').tofile(tokens)
+
+            offsets.append(offsets[-1] + len(codes))
+            docs.append(genomes.setdefault(genome, len(genomes)))
+            contigs.write(f'{contig}\n')
+
+    np.save(p / 'offsets.npy', np.array(offsets, dtype='int64'))
+    np.save(p / 'docs.npy', np.array(docs, dtype='int32'))
+    for name, d in [('vocab', vocab), ('genomes', genomes)]:
+        with open(p / f'{name}.txt', 'w+') as out:
+            for k in d.keys():  # insertion order is code order
+                out.write(f'{k}\n')
+    with open(p / 'meta.json', 'w+') as out:
+        json.dump({
+            'documents': len(docs),
+            'tokens': offsets[-1],
+            'vocab': len(vocab),
+            'genomes': len(genomes),
+            }, out, indent=4)
+
+
+def load_binary_corpus(fp):
+    '''
+    Load a binary corpus written by write_binary_corpus(). The tokens are
+    memory-mapped. Returns a dict w/ the keys "vocab", "genomes", "contigs",
+    "tokens", "offsets" and "docs".
+
+    corpus = load_binary_corpus('corpus.bin')
+    a, b = corpus['offsets'][0], corpus['offsets'][1]
+    corpus['vocab'][corpus['tokens'][a:b]]  # domains of the first document
+    '''
+    from pathlib import Path
+
+    import numpy as np
+
+    p = Path(fp)
+    corpus = {}
+    for name in ['vocab', 'genomes', 'contigs']:
+        with open(p / f'{name}.txt', 'r') as file:
+            corpus[name] = np.array(
+                [line.rstrip('\n') for line in file], dtype=object)
+
+    corpus['tokens'] = np.memmap(p / 'tokens.bin', dtype='int32', mode='r')
+    corpus['offsets'] = np.load(p / 'offsets.npy')
+    corpus['docs'] = np.load(p / 'docs.npy')
+    return corpus
+
+
+def write_linesentence(fp, fp_out):
+    '''
+    Write a binary corpus (see write_binary_corpus()) in the LineSentence
+    format that gensim's <corpus_file> training mode expects: one document per
+    line, words separated by spaces. All contigs of a genome are concatenated
+    into one line, so line i holds genome i of "genomes.txt"; these names are
+    returned as the document tags.
+
+    Note that gensim only considers the first 10000 words of a document in
+    this mode, which we report for genomes that exceed it.
+    '''
+    import numpy as np
+
+    corpus = load_binary_corpus(fp)
+    vocab, tokens, offsets = \
+        corpus['vocab'], corpus['tokens'], corpus['offsets']
+    
+    # group the documents (contigs) by genome, keep their order otherwise
+    order = np.argsort(corpus['docs'], kind='stable')
+    bounds = np.searchsorted(
+        corpus['docs'][order], np.arange(len(corpus['genomes'])+1))
+
+    too_long = 0
+    with open(fp_out, 'w+') as out:
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            words = [vocab[tokens[offsets[i]:offsets[i+1]]] for i in order[a:b]]
+            words = np.concatenate(words) if words else []
+            too_long += len(words) > 10000
+            out.write(' '.join(words) + '\n')
+
+    if too_long:
+        eprint(f'{too_long} genomes exceed 10000 domains and will be truncated')
+    return corpus['genomes'].tolist()
+
+
 def load_taxonomy_gtdb(fp):
     '''
     Does what it says on the tin and returns a dict.
@@ -280,3 +817,237 @@ class dbopen(object):
     def __exit__(self, exc_class, exc, traceback):
         self.conn.commit()
         self.conn.close()
+
+
+def ensure_indexes(path, tablename='metadata'):
+    '''
+    Create the indexes that taxonomy lookups rely on, unless present: one on
+    the accession w/o prefix (accession_redux), one on each GTDB rank
+    (gtdb_domain, ..., gtdb_species). If the database is read-only, we carry
+    on w/o them.
+    '''
+    with dbopen(path) as cursor:
+        cursor.execute(f'PRAGMA table_info({tablename})')
+        columns = [i[1] for i in cursor.fetchall()]
+        columns = [i for i in columns if i == 'accession_redux' or \
+            (i.startswith('gtdb_') and i != 'gtdb_taxonomy')]
+        try:
+            for i in columns:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS ix_{tablename}_{i} '
+                    f'ON {tablename} ({i})')
+        except sqlite3.OperationalError:
+            eprint(f'Could not index {path}, lookups will be slower')
+
+
+class TaxonomyDB(object):
+    '''
+    Lookup service for the GTDB metadata database (sqlite3). Connections are
+    read-only and pooled, i.e. there is one per database and process, which
+    is reused across calls (and threads).
+
+    Usage:
+
+    db = TaxonomyDB.open('path/to/metadata_GTDB_r89.db')
+    db.taxonomy(['GCF_000158595.1', 'GCA_003281365.1'])
+    # [('GCF_000158595.1', 'd__Bacteria;p__Cyanobacteriota;...'), ...]
+    db.accessions('c__Clostridia')
+    # ['GB_GCA_002409805.1', ...]
+    '''
+    _pool = {}
+    _pool_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        key = os.path.abspath(path)
+        with cls._pool_lock:
+            if key not in cls._pool:
+                cls._pool[key] = cls(key)
+            return cls._pool[key]
+
+
+    def __init__(self, path, tablename='metadata'):
+        if not os.path.exists(path):
+            raise ValueError(f'Database {path} not found, abort!')
+        ensure_indexes(path, tablename)
+        
+        self.path = path
+        self.tablename = tablename
+        self.conn = sqlite3.connect(
+            f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+
+
+    def taxonomy(self, names):
+        '''
+        Return a list of (name, GTDB taxonomy string) in the order of <names>;
+        the taxonomy is None if a name is not found. Names are matched
+        against the accession w/o prefix (accession_redux).
+
+        All names go into a temporary table, which is joined against the
+        metadata in a single query. Unlike "WHERE ... IN (...)", this does not
+        run into SQLite's limits for thousands of names.
+        '''
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS query (pos INTEGER, name TEXT)')
+            cursor.execute('DELETE FROM temp.query')
+            cursor.executemany(
+                'INSERT INTO temp.query VALUES (?, ?)', enumerate(names))
+            cursor.execute(f'''
+                SELECT q.name, m.gtdb_taxonomy
+                FROM temp.query q LEFT JOIN {self.tablename} m
+                ON m.accession_redux = q.name
+                ORDER BY q.pos''')
+            result = cursor.fetchall()
+            cursor.execute('DELETE FROM temp.query')
+            self.conn.commit()
+        return result
+
+
+    def records(self):
+        '''
+        Return (name, GTDB taxonomy string) for all genomes in the database,
+        where name is the accession w/o prefix (accession_redux).
+        '''
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                f'SELECT accession_redux, gtdb_taxonomy FROM {self.tablename}')
+            return cursor.fetchall()
+
+
+    def accessions(self, taxon):
+        '''
+        Given a taxon in GTDB format (e.g. c__Clostridia) return the
+        accessions of all its genomes (e.g. GB_GCA_002409805.1).
+        '''
+        groups = {
+            'c': 'class',
+            's': 'species',
+            'p': 'phylum',
+            'f': 'family',
+            'd': 'domain',
+            'o': 'order',
+            'g': 'genus',}
+        rank = groups[taxon.split('__')[0]]  # c__Clostridia
+        
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                f'SELECT accession FROM {self.tablename} WHERE gtdb_{rank}=?',
+                (taxon,))
+            return [i[0] for i in cursor.fetchall()]
+
+
+class VectorCache(object):
+    '''
+    On-disk cache of inferred genome vectors (sqlite3), so repeated queries
+    of the same genome skip inference. Vectors are keyed by a hash of the
+    annotation's content, the model (path, size and modification time) and
+    all inference parameters. Once the vectors take up more than <max_size>
+    MB, the least recently used ones are evicted.
+
+    Usage:
+
+    cache = VectorCache()  # under cache_dir()
+    keys = [cache.key(
+        'MAG_pfam.tsv', 'models/93/nanotext_r89.model', steps=1000,
+        fmt='pfamscan', truncate_by=0, seed=42)]
+    cache.get(keys)  # [None], not cached yet
+    cache.put(keys, [v])
+    '''
+    def __init__(self, path=None, max_size=1024):
+        if not path:
+            path = os.path.join(cache_dir(), 'vectors.db')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.max_size = max_size * 2**20  # bytes
+        self._hashes = {}  # (path, size, mtime): sha1, see _hash()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS vectors (
+                    key TEXT PRIMARY KEY, vector BLOB, atime REAL)''')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_vectors_atime ON vectors (atime)')
+            self.conn.commit()
+
+
+    def _hash(self, fp):
+        st = os.stat(fp)
+        k = (os.path.abspath(fp), st.st_size, st.st_mtime)
+        if k not in self._hashes:
+            self._hashes[k] = file_hash(fp)
+        return self._hashes[k]
+
+
+    def key(self, fp, fp_model, **params):
+        '''
+        Key of the vector that the model <fp_model> infers for the genome
+        annotation <fp> w/ the inference <params>.
+        '''
+        import hashlib
+        import json
+
+        st = os.stat(fp_model)
+        model = [os.path.abspath(fp_model), st.st_size, st.st_mtime]
+        s = json.dumps(
+            {'genome': self._hash(fp), 'model': model, **params},
+            sort_keys=True)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+
+    def get(self, keys):
+        '''
+        Return the vectors for <keys>, None for those not cached.
+        '''
+        import numpy as np
+
+        found = {}
+        with self.lock:
+            for k in keys:
+                row = self.conn.execute(
+                    'SELECT vector FROM vectors WHERE key=?', (k,)).fetchone()
+                if row:
+                    found[k] = np.frombuffer(row[0], dtype='float32')
+            self.conn.executemany(
+                'UPDATE vectors SET atime=? WHERE key=?',
+                [(time.time(), k) for k in found])
+            self.conn.commit()
+        return [found.get(k) for k in keys]
+
+
+    def put(self, keys, vectors):
+        import numpy as np
+
+        rows = [
+            (k, np.asarray(v, dtype='float32').tobytes(), time.time())
+            for k, v in zip(keys, vectors)]
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO vectors VALUES (?, ?, ?)', rows)
+            self._evict()
+            self.conn.commit()
+
+
+    def _evict(self):
+        size = self.conn.execute(
+            'SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM vectors').fetchone()[0]
+        if size <= self.max_size:
+            return
+        
+        # evict down to 90% of the cap, so we do not evict on every put
+        drop = []
+        rows = self.conn.execute(
+            'SELECT key, LENGTH(vector) FROM vectors ORDER BY atime')
+        for k, n in rows:
+            if size <= 0.9 * self.max_size:
+                break
+            drop.append((k,))
+            size -= n
+        self.conn.executemany('DELETE FROM vectors WHERE key=?', drop)
@@ -1,2 +1,123 @@
+import os
+import time
+
+from gensim.models.doc2vec import TaggedDocument
+from gensim.models.callbacks import CallbackAny2Vec
+
+from nanotext.io import eprint
+
+
+class CorpusStream(object):
+    def __init__(self, fp):
+        self.fp = fp
+        self.epoch = -1
+        # self.cnt = 0
+    
+    def __iter__(self):
+        self.epoch += 1
+        with open(self.fp, 'r') as file:
+            print(f'Pass {self.epoch} ...')
+
+            for line in file:
+                genome, contig, domains = line.strip().split('\t')
+                domains = domains.split(',')
+
+                # if self.cnt % 100000 == 0:
+                #     print(self.cnt)
+                # self.cnt += 1
+                yield TaggedDocument(words=domains, tags=[genome])
+
+
+class BinaryCorpusStream(object):
+    '''
+    Like CorpusStream, but reads a binary corpus (see "nanotext convert"),
+    i.e. it looks up memory-mapped domain codes instead of parsing text.
+    '''
+    def __init__(self, fp):
+        from nanotext.io import load_binary_corpus
+
+        self.fp = fp
+        self.corpus = load_binary_corpus(fp)
+        self.epoch = -1
+    
+    def __iter__(self):
+        self.epoch += 1
+        print(f'Pass {self.epoch} ...')
+        
+        vocab, genomes = self.corpus['vocab'], self.corpus['genomes']
+        tokens, offsets = self.corpus['tokens'], self.corpus['offsets']
+        
+        for doc, a, b in zip(self.corpus['docs'], offsets[:-1], offsets[1:]):
+            yield TaggedDocument(
+                words=vocab[tokens[a:b]].tolist(), tags=[genomes[doc]])
+
+
+class EpochLogger(CallbackAny2Vec):
+    '''
+    Report the throughput (tokens per second) of each training epoch.
+    '''
+    def __init__(self):
+        self.epoch = 0
+        self.start = None
+    
+    def on_epoch_begin(self, model):
+        self.start = time.time()
+    
+    def on_epoch_end(self, model):
+        elapsed = time.time() - self.start
+        speed = int(model.corpus_total_words / elapsed)
+        eprint(f'Epoch {self.epoch}: {round(elapsed, 2)} s, {speed} tokens/s')
+        self.epoch += 1
+
+
+def tag_docvecs(model, tags):
+    '''
+    Training from a <corpus_file> tags each document w/ its line number. Name
+    the document vectors by <tags> instead, so that we can look them up like
+    the ones from a streamed corpus, e.g. model.docvecs['GCA_000008085.1'].
+    '''
+    from gensim.models.doc2vec import Doctag
+
+    docvecs = model.docvecs
+    docvecs.offset2doctag = list(tags)
+    docvecs.doctags = {t: Doctag(i, 0, 1) for i, t in enumerate(tags)}
+    docvecs.max_rawint = -1  # no plain int tags any more
+    docvecs.count = len(tags)
+    return model
+
+
+def train_corpus_file(model, corpus, out):
+    '''
+    Train <model> in gensim's corpus_file mode. A text <corpus> is converted
+    to a binary one first; all intermediate files are removed afterwards.
+    '''
+    import tempfile
+
+    from nanotext.io import write_binary_corpus, write_linesentence
+
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(out))) as tmp:
+        
+        if not os.path.isdir(corpus):
+            eprint('Converting corpus ...')
+            write_binary_corpus(corpus, f'{tmp}/corpus.bin')
+            corpus = f'{tmp}/corpus.bin'
+
+        eprint('Writing corpus in LineSentence format ...')
+        fp = f'{tmp}/corpus.linesentence.txt'
+        tags = write_linesentence(corpus, fp)
+
+        eprint('Building vocabulary ...')
+        model.build_vocab(corpus_file=fp)
+
+        eprint('Training starts ...')
+        _ = model.train(
+            corpus_file=fp, total_examples=model.corpus_count,
+            total_words=model.corpus_total_words, epochs=model.epochs,
+            callbacks=[EpochLogger()])
+
+    return tag_docvecs(model, tags)
+
+
 def hdbscan():
     pass
\ No newline at end of file
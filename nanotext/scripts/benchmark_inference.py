@@ -0,0 +1,83 @@
+import click
+
+
+@click.command()
+@click.option(
+    '--annotation', help='Genome annotations (directory or glob)',
+    required=True)
+@click.option(
+    '--models', help='Genome embedding models',
+    type=click.Path(), required=True)
+@click.option(
+    '--index', help='Precomputed index (see "nanotext index")',
+    default=None, type=click.Path())
+@click.option(
+    '--mode', help='Model w/ focus on core/ accessory/ an ensemble of domains',
+    default='core')
+@click.option(
+    '--fmt', help='Annotation fmt (pfamscan, hmmer or domtblout)',
+    default='pfamscan')
+@click.option(
+    '--steps', help='Fixed (and max) number of inference steps', default=1000)
+@click.option(
+    '--tol', help='Comma-separated list of tolerances to compare',
+    default='1e-3,1e-4,1e-5')
+@click.option(
+    '--topn', help='Compare the top n hits', default=10)
+@click.option(
+    '--seed', help='Seed for vector inference', default=42)
+def benchmark(annotation, models, index, mode, fmt, steps, tol, topn, seed):
+    '''Compare adaptive inference to a fixed number of steps
+
+    For each tolerance, report the steps used, the time per genome and how
+    many of the top n hits agree w/ those of the fixed steps. As a baseline
+    for the agreement, the fixed steps are repeated w/ another seed.
+
+    Usage:
+
+    \b
+    osf -p pjf7m fetch tara.zip && unzip tara.zip
+    python benchmark_inference.py --models models --index models/index_core \\
+        --annotation 'tara/*_pfam.tsv' --tol 1e-3,1e-4,1e-5
+    '''
+    import time
+
+    import numpy as np
+
+    from nanotext.classes import GenomeModel
+    from nanotext.io import collect_annotations
+
+    fps = [fp for _, fp in collect_annotations(annotation)]
+    if index:
+        model = GenomeModel(models, index=index)
+    else:
+        model = GenomeModel(models, mode=mode, norm='l2')
+    model.models  # load before we start the clock
+
+    def run(seed, tol=None):
+        start = time.time()
+        v = model.infer(
+            fps, steps=steps, fmt=fmt, seed=seed, cache=False, tol=tol)
+        elapsed = (time.time() - start) / len(fps)
+        hits = [{name for name, _ in sim} for sim in model.search_batch(
+            v, topn)]
+        used = np.median(model.steps_used) if tol else steps
+        return hits, used, elapsed
+
+    ref, _, elapsed_ref = run(seed)
+
+    print('mode\ttol\tsteps\tseconds/genome\tspeedup\ttop-n agreement')
+    rows = [('fixed', '-', seed + 1, None)] + \
+        [('adaptive', i, seed, float(i)) for i in tol.split(',')]
+    print(f'fixed\t-\t{steps}\t{round(elapsed_ref, 3)}\t1.0\t1.0')
+    for name, label, s, t in rows:
+        hits, used, elapsed = run(s, t)
+        agree = np.mean([len(a & b) / topn for a, b in zip(hits, ref)])
+        speedup = round(elapsed_ref / elapsed, 2)
+        print(
+            f'{name}\t{label}\t{int(used)}\t{round(elapsed, 3)}\t{speedup}\t'
+            f'{round(agree, 3)}')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,67 @@
+import click
+
+
+@click.command()
+@click.option(
+    '--corpus', help='Corpus of protein domains (text or binary)',
+    type=click.Path(), required=True)
+@click.option(
+    '--outdir', help='Where to store the models',
+    type=click.Path(), required=True)
+@click.option(
+    '--threads', help='Comma-separated list of thread counts to compare',
+    default='1,4,8')
+@click.option(
+    '--epochs', help='Number of training epochs',
+    default=1)
+def benchmark(corpus, outdir, threads, epochs):
+    '''Compare the throughput of streamed and corpus_file training
+
+    Usage:
+
+    \b
+    head -n 100000 corpus.txt > sample.txt
+    python benchmark_training.py \\
+        --corpus sample.txt --outdir bench --threads 1,4,8,16
+    '''
+    import os
+    import time
+
+    from gensim.models import Doc2Vec
+
+    from nanotext.learn import \
+        BinaryCorpusStream, CorpusStream, train_corpus_file
+
+    params = {
+        'vector_size': 100, 'hs': 0, 'negative': 5, 'min_count': 3,
+        'sample': 0.001, 'window': 10, 'dm': 0, 'dbow_words': 1,
+        'epochs': epochs, 'alpha': 0.025, 'min_alpha': 0.0001, 'seed': 42,
+        }
+    os.makedirs(outdir, exist_ok=True)
+
+    print('mode\tthreads\tseconds\ttokens/s')
+    for n in [int(i) for i in threads.split(',')]:
+        for mode in ['stream', 'corpus_file']:
+            model = Doc2Vec(workers=n, **params)
+            start = time.time()
+            
+            if mode == 'corpus_file':
+                train_corpus_file(model, corpus, f'{outdir}/{mode}.{n}.model')
+            else:
+                if os.path.isdir(corpus):
+                    stream = BinaryCorpusStream(corpus)
+                else:
+                    stream = CorpusStream(corpus)
+                model.build_vocab(stream)
+                model.train(
+                    stream, total_examples=model.corpus_count,
+                    epochs=model.epochs)
+            
+            elapsed = time.time() - start
+            speed = int(model.corpus_total_words * epochs / elapsed)
+            print(f'{mode}\t{n}\t{round(elapsed, 2)}\t{speed}')
+            model.save(f'{outdir}/{mode}.{n}.model')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -5,7 +5,6 @@ import random
 
 from gensim.models.doc2vec import TaggedDocument
 from gensim.models import Doc2Vec
-from pybedtools import BedTool
 from tqdm import tqdm
 
 from nanotext.io import load_domains
@@ -36,8 +35,7 @@ with open('/Users/phi/tmp/corpus.annotree.train.txt', 'w+') as out:
         # Rich Hickey would be proud ...
         # dom = deduplicate(remove_overlap(load_domains(file, fmt='pfamscan')))
     
-        result = load_domains(file, fmt='pfamscan')
-        dom = BedTool(list(result.values()))
+        dom = load_domains(file, fmt='pfamscan', columnar=True)
     
         # make sure Pfam ID is truncated: PF00815.1 -> PF00815
         seq = create_domain_sequence(
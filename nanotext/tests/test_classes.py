@@ -0,0 +1,182 @@
+import numpy as np
+import pytest
+
+from nanotext.classes import TaxonomyIndex
+
+
+def test_taxonomy_index(tmp_path):
+    from nanotext.utils import subset_taxonomy
+
+    taxa = {
+        'A': ['Bacteria', 'P1', 'C1', 'O1', 'F1', 'G1', 'S1'],
+        'B': ['Bacteria', 'P1', 'C1', 'O1', 'F1_A', 'G2', 'S2'],
+        'C': ['Bacteria', 'P2', 'C2', 'O2', 'F1', 'G3', 'S3'],
+        }
+    names = ['C', 'X', 'A', 'B']  # X has no record
+    tax = TaxonomyIndex(names, taxa)
+
+    assert tax.lookup('f__F1').tolist() == [0, 2]
+    assert tax.lookup('d__Bacteria').tolist() == [0, 2, 3]
+    assert tax.lookup('f__Nope').tolist() == []
+    assert tax.taxonomy(1) == 7 * ['']
+    assert sorted(subset_taxonomy('f__F1', taxa)) == \
+        sorted(names[i] for i in tax.lookup('f__F1'))
+
+    tax.save(str(tmp_path / 'taxonomy.npz'))
+    loaded = TaxonomyIndex.load(str(tmp_path / 'taxonomy.npz'))
+    assert loaded.lookup('p__P1').tolist() == tax.lookup('p__P1').tolist()
+    assert loaded.taxonomy(3) == taxa['B']
+
+
+
+def test_taxonomy_index_from_db(tmp_path):
+    import sqlite3
+
+    fp = str(tmp_path / 'metadata.db')
+    conn = sqlite3.connect(fp)
+    conn.execute('''CREATE TABLE metadata (
+        accession TEXT, accession_redux TEXT, gtdb_taxonomy TEXT)''')
+    conn.executemany('INSERT INTO metadata VALUES (?, ?, ?)', [
+        ('RS_A', 'A', 'd__B;p__P1;c__C;o__O;f__F1;g__G1;s__S1'),
+        ('GB_X', 'X', None),  # e.g. failed QC
+        ('RS_B', 'B', 'd__B;p__P2;c__C;o__O;f__F2;g__G2;s__S2')])
+    conn.commit()
+    conn.close()
+
+    tax = TaxonomyIndex.from_db(fp)
+    assert tax.names.tolist() == ['A', 'X', 'B']
+    assert tax.lookup('c__C').tolist() == [0, 2]
+    assert tax.taxonomy(1) == 7 * ['']
+    tax = TaxonomyIndex.from_db(fp, names=['B', 'X'])
+    assert tax.lookup('p__P2').tolist() == [0]
+
+def test_search_within(tmp_path):
+    from nanotext.classes import GenomeModel
+    from nanotext.io import save_index
+    from nanotext.utils import build_index
+
+    rng = np.random.RandomState(0)
+    names = [f'G{i}' for i in range(1000)]
+    fp = tmp_path / 'taxonomy.tsv'
+    fp.write_text(''.join(
+        f'RS_{n}\td__B;p__P;c__C;o__O;f__F{i % 3};g__G;s__{n}\n' \
+        for i, n in enumerate(names)))
+
+    for index_type in ['Flat', 'IVF,Flat', 'HNSW32']:
+        db, index = build_index(rng.rand(1000, 16), 'l2', index_type)
+        meta = {'mode': 'core', 'norm': 'l2', 'models': None}
+        save_index(tmp_path / 'ix', names, db, np.zeros((1, 16)), index, meta)
+
+        model = GenomeModel(index=str(tmp_path / 'ix'))
+        model.add_taxonomy(str(fp))
+        hits = model.search_batch(db[:2], topn=5, within='f__F1')
+
+        assert [len(i) for i in hits] == [5, 5]
+        assert all(model.lineage(n)[4] == 'F1' for i in hits for n, _ in i)
+        if index_type == 'Flat':
+            exact = np.argsort(-db[1::3] @ db[0])[:5] * 3 + 1
+            assert [n for n, _ in hits[0]] == [names[i] for i in exact]
+
+
+def test_infer_samples(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from nanotext.classes import GenomeModel
+    from nanotext.io import save_index, VectorCache
+    from nanotext.utils import build_index
+
+    monkeypatch.setenv('NANOTEXT_CACHE', str(tmp_path / 'cache'))
+
+    class Model():
+        '''The inferred vector only depends on the seed.'''
+        wv = SimpleNamespace(index2word=['unknown'], vocab={
+            'unknown': SimpleNamespace(index=0)})
+        random = np.random.RandomState(0)  # unless seeded
+
+        def infer_vector(self, words, steps):
+            return self.random.rand(16).astype('float32')
+
+    rng = np.random.RandomState(0)
+    db, index = build_index(rng.rand(100, 16), 'l2', 'Flat')
+    meta = {'mode': 'core', 'norm': 'l2', 'models': None}
+    save_index(
+        tmp_path / 'ix', [f'G{i}' for i in range(100)], db,
+        np.zeros((1, 16)), index, meta)
+    model = GenomeModel(index=str(tmp_path / 'ix'))
+    model.fps = [tmp_path / 'model']
+    model.fps[0].write_text('')
+    model._models = [Model()]
+
+    fp = tmp_path / 'pfam.tsv'
+    fp.write_text(
+        '#\n'*28 + '\n' + 'A_1 1 50 1 52 PF1.1 x D 1 50 50 3 1e-9 1 No\n')
+
+    v1 = model.infer([str(fp)] * 2, seed=1)
+    assert np.isnan(model.dispersion).all()
+    v = model.infer([str(fp)] * 2, seed=1, n_samples=4)
+    assert np.allclose(v[0], v[1]) and not np.allclose(v[0], v1[0])
+    assert (model.dispersion > 0).all()
+    dispersion = model.dispersion[:1]
+
+    cache = VectorCache()
+    w = model.infer(str(fp), seed=1, n_samples=4, cache=cache)
+    assert np.allclose(w, v[:1])
+    model._models = None  # cached, so the models are not needed
+    w = model.infer(str(fp), seed=1, n_samples=4, cache=cache)
+    assert np.allclose(w, v[:1])
+    assert np.allclose(model.dispersion, dispersion)
+
+    # w/o a seed, the samples must not share a cache entry
+    model._models = [Model()]
+    v = model.infer(str(fp), n_samples=4, cache=cache)
+    dispersion = model.dispersion
+    assert (dispersion > 0).all()
+    model._models = None
+    w = model.infer(str(fp), n_samples=4, cache=cache)
+    assert np.allclose(w, v)
+    assert np.allclose(model.dispersion, dispersion)
+
+
+def test_save_and_load_index(tmp_path):
+    import json
+    import os
+    from nanotext.classes import GenomeModel
+    from nanotext.utils import most_similar
+
+    # a "trained" model w/ its demeaned vectors already cached next to it,
+    # see load_demeaned(), so gensim is not needed
+    fp = tmp_path / 'models' / '93' / 'nanotext_r89.model'
+    fp.parent.mkdir(parents=True)
+    fp.write_text('')
+    rng = np.random.RandomState(0)
+    names = [f'G{i}' for i in range(200)]
+    m = rng.rand(200, 16).astype('float32')
+    np.save(f'{fp}.names.npy', np.array(names))
+    np.save(f'{fp}.mean.npy', m.mean(axis=0))
+    np.save(f'{fp}.demeaned.npy', m - m.mean(axis=0))
+    with open(f'{fp}.cache.json', 'w') as out:
+        json.dump({'path': os.path.abspath(fp), 'mtime': os.stat(fp).st_mtime}, out)
+
+    model = GenomeModel(str(tmp_path / 'models'), mode='core', norm='l2')
+    assert model._models is None  # models are only loaded for inference
+    model.save(str(tmp_path / 'ix'))
+
+    loaded = GenomeModel(index=str(tmp_path / 'ix'))
+    assert isinstance(loaded.db, np.memmap)
+    assert loaded._models is None
+    assert loaded.names == model.names
+    assert np.allclose(loaded.means, model.means)
+    assert str(loaded.fps[0]) == str(fp)
+
+    query = model.db[:5]
+    hits = loaded.search_batch(query, topn=10)
+    assert hits == model.search_batch(query, topn=10)
+    expected = most_similar(query, model.names, np.asarray(model.db), 10)
+    assert [[n for n, _ in i] for i in hits] == \
+        [[n for n, _ in i] for i in expected]
+
+    # one list per query, however many there are; search() takes one
+    assert loaded.search_batch(query[:1], topn=10) == hits[:1]
+    assert loaded.search(query[0], topn=10) == hits[0]
+    assert loaded.search(query[:1], topn=10) == hits[0]
+    with pytest.raises(ValueError):
+        loaded.search(query, topn=10)
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+
+HEAVY = ['faiss', 'gensim', 'pybedtools', 'sklearn', 'tensorflow', 'umap']
+
+
+def test_help_is_fast():
+    '''
+    "nanotext --help" must not import any of the heavy dependencies, which
+    are only needed once a subcommand runs.
+    '''
+    code = f'''
+import sys
+from nanotext.__main__ import cli
+try:
+    cli(['--help'])
+except SystemExit:
+    pass
+print([m for m in {HEAVY} if m in sys.modules])
+'''
+    out = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True,
+        check=True).stdout
+
+    assert 'search' in out and 'serve' in out
+    assert out.strip().split('\n')[-1] == '[]'
+
+
+def test_subcommand_help():
+    from click.testing import CliRunner
+
+    from nanotext.__main__ import cli
+
+    result = CliRunner().invoke(cli, ['index', '--help'])
+    assert result.exit_code == 0
+    assert '--index-type' in result.output
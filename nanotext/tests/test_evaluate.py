@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from nanotext.evaluate import ecotype_task
+
+
+def test_ecotype_task():
+    rng = np.random.RandomState(0)
+    names = [f'G{i}' for i in range(60)]
+    vectors = dict(zip(names, rng.rand(60, 8) - 0.5))
+    ecotypes = {n: 'ABC'[i % 3] for i, n in enumerate(names)}
+    ecotypes['missing'] = 'A'
+    
+    # naive: nearest neighbor among all other genomes, first one on ties
+    def cos(a, b):
+        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    hits = {}
+    for n in names:
+        others = [i for i in names if i != n]
+        nn = others[int(np.argmax([cos(vectors[n], vectors[i]) for i in others]))]
+        hits.setdefault(ecotypes[n], []).append(ecotypes[nn] == ecotypes[n])
+    expected = {k: round(np.sum(v) / len(v), 4) for k, v in hits.items()}
+
+    assert ecotype_task(ecotypes, vectors) == expected
+    assert 'missing' in ecotypes  # input is left alone
+    
+    docvecs = {n: vectors[n] for n in names}
+    model = SimpleNamespace(docvecs=docvecs)  # like a gensim model
+    assert ecotype_task(ecotypes, model) == expected
+
+
+def test_odd_one_out():
+    from nanotext.evaluate import odd_one_out, wilson_interval
+
+    rng = np.random.RandomState(0)
+    wv = rng.rand(30, 8) - 0.5
+    wv /= np.linalg.norm(wv, axis=1, keepdims=True)
+    rows = [list(rng.randint(30, size=rng.randint(3, 7))) for _ in range(100)]
+
+    tokens = np.zeros((len(rows), 6), dtype=np.int64)
+    mask = np.zeros(tokens.shape, dtype=bool)
+    for i, row in enumerate(rows):
+        tokens[i, :len(row)], mask[i, :len(row)] = row, True
+    guess = odd_one_out(wv, tokens, mask)
+
+    # naive, like gensim's doesnt_match()
+    for row, g in zip(rows, guess):
+        vv = wv[row]
+        mean = vv.mean(axis=0) / np.linalg.norm(vv.mean(axis=0))
+        assert row[g] == row[int(np.argmin(vv @ mean))]
+
+    low, high = wilson_interval(90, 100)
+    assert round(low, 4) == 0.8256 and round(high, 4) == 0.9448
+
+
+def test_somo_skips_oov(tmp_path):
+    from nanotext.evaluate import somo
+
+    words = [f'PF{i}' for i in range(20)]
+    vectors = np.random.RandomState(0).rand(20, 8) - 0.5
+    model = SimpleNamespace(wv=SimpleNamespace(
+        vectors=vectors, index2word=words))
+    fp = tmp_path / 'corpus.txt'
+    fp.write_text(
+        'G1\tc1\tX1,X2,X3\n'  # no domain in the vocabulary
+        'G1\tc2\tPF1,X1,X2\n'  # only one
+        'G2\tc1\tPF1,PF2,X1\n')
+    assert somo(str(fp), model)['n'] == 1
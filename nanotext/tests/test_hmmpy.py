@@ -0,0 +1,91 @@
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+
+SCRIPT = Path(__file__).parents[1] / \
+    'workflows/annotation_hmmer/scripts/HmmPy.py'
+
+ROWS = [
+    # tlen, query, ..., i-Evalue, score, ..., hmm from/ to, ali, env from/ to
+    'PF1 PF00001.1 100 A_1 - 300 1e-30 50 0 1 3 1e-30 1e-30 50 0 1 90 5 95 3 97 0.9 desc one',
+    'PF2 PF00002.1 100 A_1 - 300 1e-30 50 0 2 3 1e-5 1e-5 10 0 1 90 120 210 118 212 0.9 weak',
+    'PF3 PF00003.1 100 A_1 - 300 1e-30 50 0 3 3 1e-30 1e-30 50 0 1 20 150 170 150 171 0.9 short',
+    'PF4 PF00004.2 200 B_2 - 400 1e-25 40 0 1 2 1e-25 1e-25 40 0 1 150 5 160 4 165 0.9 ok',
+    'PF5 PF00005.1 200 B_2 - 400 1e-25 40 0 2 2 1e-20 1e-20 60 0 1 150 200 360 198 365 0.9 best',
+    ]
+
+
+@pytest.fixture
+def hmmpy():
+    spec = spec_from_file_location('HmmPy', SCRIPT)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write(fp, footer='#\n# Program:         hmmscan\n# [ok]\n'):
+    fp.write_text(
+        '# target name accession\n#---\n' + '\n'.join(ROWS) + '\n' + footer)
+    return str(fp)
+
+
+def names(hmm):
+    return [row[0] for row in hmm]
+
+
+def test_filters(tmp_path, hmmpy):
+    fp = write(tmp_path / 'orfs.domtbl')
+
+    hmm = hmmpy.HMMparser(fp)
+    assert names(hmm) == ['PF1', 'PF2', 'PF3', 'PF4', 'PF5']
+    assert hmm.matrix[0][-1] == 'desc one'  # spaces in the description
+
+    hmm = hmmpy.HMMparser(fp)
+    hmm.filterByEvalue(1e-18)
+    assert names(hmm) == ['PF1', 'PF3', 'PF4', 'PF5']
+
+    hmm = hmmpy.HMMparser(fp)
+    hmm.filterByBitscore(45)
+    assert names(hmm) == ['PF1', 'PF3', 'PF5']
+
+    hmm = hmmpy.HMMparser(fp)
+    hmm.filterByCoverage(0.35)
+    assert names(hmm) == ['PF1', 'PF2', 'PF4', 'PF5']
+
+    hmm = hmmpy.HMMparser(fp)
+    hmm.filterByEvalue(1e-18)
+    hmm.filterByCoverage(0.35)
+    assert names(hmm) == ['PF1', 'PF4', 'PF5']
+    assert names(hmm) == ['PF1', 'PF4', 'PF5']  # streams again
+
+
+def test_best_per_query(tmp_path, hmmpy):
+    fp = write(tmp_path / 'orfs.domtbl')
+
+    hmm = hmmpy.HMMparser(fp)
+    hmm.uniqueByBestBitscore()
+    assert names(hmm) == ['PF1', 'PF5']  # the first one on ties
+
+    out = subprocess.run(
+        [sys.executable, str(SCRIPT), '-u', '--evalue', '1e-18', fp],
+        capture_output=True, text=True, check=True).stdout.splitlines()
+    assert out[0].startswith('target name\taccession\ttlen')
+    assert [i.split('\t')[0] for i in out[1:]] == ['PF1', 'PF5']
+
+
+def test_footer(tmp_path, hmmpy):
+    # the program is looked for in the whole file if not in its last lines
+    long = '#\n# Program:         hmmscan\n' + \
+        f'# Option settings: hmmscan {"--cpu 8 " * 1000}\n# [ok]\n'
+    assert names(hmmpy.HMMparser(write(tmp_path / 'long', long)))[0] == 'PF1'
+
+    # a footer cut short after the program is fine, w/o it we cannot parse
+    torn = '#\n# Program:         hmmscan\n# Version:   3.'
+    assert len(names(hmmpy.HMMparser(write(tmp_path / 'torn', torn)))) == 5
+    for footer in ['', '#\n# Prog']:
+        with pytest.raises(ValueError):
+            hmmpy.HMMparser(write(tmp_path / 'missing', footer))
@@ -0,0 +1,89 @@
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+
+from click.testing import CliRunner
+import pytest
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    import sys
+
+    fp = Path(__file__).parents[1] / \
+        'workflows/model_training/scripts/ingest_corpus_gtdb.py'
+    spec = spec_from_file_location('ingest_corpus_gtdb', fp)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # so the pool can pickle its functions
+    monkeypatch.setitem(sys.modules, 'ingest_corpus_gtdb', module)
+    return module
+
+
+def test_ingest_resume(tmp_path, ingest, monkeypatch):
+    indir = tmp_path / 'annotation'
+    indir.mkdir()
+    for i in range(6):
+        rows = [
+            f'C{i}_{j} 1 50 1 52 PF0000{j}.1 x D 1 50 50 3 1e-9 1 No'
+            for j in range(1, 4)]
+        (indir / f'RS_GCF_00{i}.1_pfam.tsv').write_text(
+            '#\n'*28 + '\n' + '\n'.join(rows) + '\n')
+
+    runner = CliRunner()
+    serial = tmp_path / 'serial.txt'
+    result = runner.invoke(
+        ingest.ingest, ['--indir', str(indir), '--outfile', str(serial)])
+    assert result.exit_code == 0
+
+    # crash while ingesting the file w/ <name>, then leave a torn record
+    ingest_file = ingest.ingest_file
+    def crash_on(name):
+        def fn(file, minlen=0):
+            if name in file:
+                raise KeyboardInterrupt
+            return ingest_file(file, minlen)
+        return fn
+
+    outfile = tmp_path / 'corpus.txt'
+    args = ['--indir', str(indir), '--outfile', str(outfile)]
+    parts = tmp_path / 'corpus.txt.parts'
+
+    order = [Path(i).name for i in ingest.glob(f'{indir}/*')]
+    monkeypatch.setattr(ingest, 'ingest_file', crash_on(order[2]))
+    runner.invoke(ingest.ingest, args)
+    with open(parts / 'done.tsv', 'a') as out:
+        out.write(f'{indir}/{order[2]}\tshard')  # torn
+
+    monkeypatch.setattr(ingest, 'ingest_file', crash_on(order[4]))
+    runner.invoke(ingest.ingest, args)
+    assert sorted(parts.glob('shard.*.txt')) == \
+        [parts / 'shard.0.txt', parts / 'shard.1.txt']
+
+    monkeypatch.setattr(ingest, 'ingest_file', ingest_file)
+    result = runner.invoke(ingest.ingest, args + ['--threads', '2'])
+    assert result.exit_code == 0
+    assert not parts.exists()
+
+    lines = outfile.read_text().splitlines()
+    assert len(lines) == len(set(lines)) == 6  # 1 contig per genome
+    assert sorted(lines) == sorted(serial.read_text().splitlines())
+
+
+def broken(file, minlen=0):
+    raise ValueError(f'Cannot parse {file}')
+
+
+def test_ingest_error_stops_workers(tmp_path, ingest, monkeypatch):
+    import multiprocessing
+
+    indir = tmp_path / 'annotation'
+    indir.mkdir()
+    for i in range(4):
+        (indir / f'RS_GCF_00{i}.1_pfam.tsv').write_text('')
+
+    monkeypatch.setattr(ingest, 'ingest_file', broken)
+    result = CliRunner().invoke(ingest.ingest, [
+        '--indir', str(indir), '--outfile', str(tmp_path / 'corpus.txt'),
+        '--threads', '2'])
+    assert isinstance(result.exception, ValueError)
+    assert not multiprocessing.active_children()
@@ -0,0 +1,148 @@
+from nanotext.io import collect_annotations
+
+
+def test_collect_annotations(tmp_path):
+    for i in ['a_pfam.tsv', 'b_pfam.tsv']:
+        (tmp_path / i).write_text('')
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text(f'x\t{tmp_path}/a_pfam.tsv\n{tmp_path}/b_pfam.tsv\n')
+
+    by_dir = collect_annotations(str(tmp_path))
+    assert [name for name, _ in by_dir] == ['a_pfam', 'b_pfam', 'manifest']
+    by_glob = collect_annotations(f'{tmp_path}/*_pfam.tsv')
+    assert [name for name, _ in by_glob] == ['a_pfam', 'b_pfam']
+    by_manifest = collect_annotations(manifest=str(manifest))
+    assert by_manifest == [
+        ('x', f'{tmp_path}/a_pfam.tsv'), ('b_pfam', f'{tmp_path}/b_pfam.tsv')]
+
+
+def test_load_domains_columnar(tmp_path):
+    from nanotext.io import load_domains
+
+    rows = [
+        'A_1 1 50 1 52 PF00001.1 x Domain 1 50 50 30.1 1e-10 1 No_clan',
+        'A_1 60 90 58 95 PF00002.3 x Domain 1 30 30 20.4 1e-5 1 No_clan',
+        'A_1 1 50 1 52 PF00003.1 x Domain 1 50 50 35.3 1e-12 1 No_clan',
+        'B_2 5 70 3 75 PF00001.1 x Domain 1 50 50 30.1 1e-9 1 No_clan',
+        ]
+    fp = tmp_path / 'pfam.tsv'
+    fp.write_text('#\n'*28 + '\n' + '\n'.join(rows) + '\n')
+
+    intervals = load_domains(str(fp), fmt='pfamscan')
+    dom = load_domains(str(fp), fmt='pfamscan', columnar=True)
+    assert len(dom) == 3
+    assert [(i.chrom, i.start, i.end, i.name) for i in intervals.values()] \
+        == list(zip(dom.seq_id, dom.start, dom.end, dom.name))
+    assert dom.evalue.tolist() == [1e-12, 1e-5, 1e-9]
+
+
+def test_binary_corpus(tmp_path):
+    from nanotext.io import write_binary_corpus, load_binary_corpus
+
+    text = 'g1\tc1\tPF1,PF2,unknown\ng2\tc1\tPF2\ng1\tc2\tPF3,PF1\n'
+    fp = tmp_path / 'corpus.txt'
+    fp.write_text(text)
+    write_binary_corpus(str(fp), str(tmp_path / 'corpus.bin'))
+    
+    c = load_binary_corpus(str(tmp_path / 'corpus.bin'))
+    lines = []
+    for doc, contig, a, b in zip(
+        c['docs'], c['contigs'], c['offsets'][:-1], c['offsets'][1:]):
+        domains = ','.join(c['vocab'][c['tokens'][a:b]])
+        lines.append(f'{c["genomes"][doc]}\t{contig}\t{domains}\n')
+    assert ''.join(lines) == text
+
+
+def test_write_linesentence(tmp_path):
+    from nanotext.io import write_binary_corpus, write_linesentence
+
+    fp = tmp_path / 'corpus.txt'
+    fp.write_text('g1\tc1\tPF1,PF2\ng2\tc1\tPF2\ng1\tc2\tPF3,PF1\n')
+    write_binary_corpus(str(fp), str(tmp_path / 'corpus.bin'))
+
+    out = tmp_path / 'corpus.linesentence.txt'
+    tags = write_linesentence(str(tmp_path / 'corpus.bin'), str(out))
+    assert tags == ['g1', 'g2']
+    assert out.read_text() == 'PF1 PF2 PF3 PF1\nPF2\n'
+
+
+def test_load_domains_domtblout(tmp_path):
+    from pathlib import Path
+    import subprocess
+    import sys
+    from nanotext.io import load_domains
+
+    rows = [
+        # tlen, query, ..., i-Evalue, ..., hmm from/ to, ali, env from/ to
+        'PF1 PF00001.1 100 A_1 - 300 1e-30 50 0 1 2 1e-30 1e-30 50 0 1 90 5 95 3 97 0.9 desc one',
+        'PF2 PF00002.1 100 A_1 - 300 1e-30 50 0 2 2 1e-5 1e-5 10 0 1 90 120 210 118 212 0.9 weak',
+        'PF3 PF00003.1 100 A_1 - 300 1e-30 50 0 1 1 1e-30 1e-30 50 0 1 20 150 170 150 171 0.9 short',
+        'PF4 PF00004.2 200 B_2 - 400 1e-25 40 0 1 1 1e-25 1e-25 40 0 1 150 5 160 4 165 0.9 ok',
+        ]
+    fp = tmp_path / 'orfs.domtbl'
+    fp.write_text(
+        '# target name accession\n#---\n' + '\n'.join(rows) + '\n#\n'
+        '# Program:         hmmscan\n# [ok]\n')
+
+    script = Path(__file__).parents[1] / \
+        'workflows/annotation_hmmer/scripts/HmmPy.py'
+    with open(tmp_path / 'orfs.domtbl.tsv', 'w') as out:
+        subprocess.run(
+            [sys.executable, script, '--evalue', '1e-18', '--cov', '0.35',
+            str(fp)], stdout=out, check=True)
+
+    dom = load_domains(str(fp), fmt='domtblout', columnar=True)
+    assert dom.name.tolist() == ['PF00001.1', 'PF00004.2']
+    assert dom.start.tolist() == [3, 4]
+    expected = load_domains(str(tmp_path / 'orfs.domtbl.tsv'), fmt='hmmer')
+    intervals = load_domains(str(fp), fmt='domtblout')
+    assert [str(i) for i in intervals.values()] == \
+        [str(i) for i in expected.values()]
+
+
+def test_load_tokens(tmp_path, monkeypatch):
+    from nanotext.io import load_tokens
+
+    monkeypatch.setenv('NANOTEXT_CACHE', str(tmp_path / 'cache'))
+    rows = [
+        'B_2 5 70 3 75 PF00001.1 x Domain 1 50 50 30.1 1e-9 1 No_clan',
+        'A_1 1 50 1 52 PF00003.1 x Domain 1 50 50 35.3 1e-12 1 No_clan',
+        'A_3 1 50 1 52 PF00001.2 x Domain 1 50 50 35.3 1e-12 1 No_clan',
+        ]
+    fp = tmp_path / 'pfam.tsv'
+    fp.write_text('#\n'*28 + '\n' + '\n'.join(rows) + '\n')
+
+    c = load_tokens(str(fp), fmt='pfamscan')
+    seq = {
+        contig: c['vocab'][c['tokens'][a:b]].tolist() for contig, a, b in zip(
+            c['contigs'], c['offsets'][:-1], c['offsets'][1:])}
+    assert seq == {
+        'A': ['PF00003', 'unknown', 'PF00001'],
+        'B': ['unknown', 'PF00001']}
+    assert len(list((tmp_path / 'cache' / 'tokens').glob('*.npz'))) == 1
+
+    cached = load_tokens(str(fp), fmt='pfamscan')
+    assert all((cached[k] == c[k]).all() for k in c)
+
+
+def test_vector_cache(tmp_path):
+    import numpy as np
+    from nanotext.io import VectorCache
+
+    for i in ['a.tsv', 'b.tsv', 'model']:
+        (tmp_path / i).write_text(i)
+    cache = VectorCache(str(tmp_path / 'vectors.db'), max_size=0.0011)
+    
+    key = lambda fp, **kwargs: cache.key(
+        str(tmp_path / fp), str(tmp_path / 'model'), steps=10, **kwargs)
+    assert key('a.tsv') == key('a.tsv')
+    assert key('a.tsv') != key('b.tsv')
+    assert key('a.tsv') != key('a.tsv', seed=1)
+
+    keys = ['k0', 'k1', 'k2']
+    cache.put(keys[:2], np.ones((2, 100)))  # 800 of 1153 bytes
+    assert cache.get(['k0', 'k9'])[1] is None
+    cache.put(keys[2:], np.zeros((1, 100)))  # evicts k1, the least recent
+    v = cache.get(keys)
+    assert [i is None for i in v] == [False, True, False]
+    assert v[0].tolist() == [1.] * 100
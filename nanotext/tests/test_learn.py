@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+
+def test_train_corpus_file(tmp_path):
+    gensim = pytest.importorskip('gensim')
+    from nanotext.learn import CorpusStream, train_corpus_file
+
+    lines = []
+    for i in range(20):
+        for contig in range(3):
+            domains = [f'PF{(i + j) % 11}' for j in range(contig, contig + 8)]
+            lines.append(f'G{i}\tc{contig}\t{",".join(domains)}\n')
+    fp = tmp_path / 'corpus.txt'
+    fp.write_text(''.join(lines))
+    params = dict(
+        vector_size=10, min_count=1, dm=0, epochs=2, workers=1, seed=1)
+
+    streamed = gensim.models.Doc2Vec(**params)
+    stream = CorpusStream(str(fp))
+    streamed.build_vocab(stream)
+    streamed.train(
+        stream, total_examples=streamed.corpus_count, epochs=streamed.epochs)
+
+    filed = train_corpus_file(
+        gensim.models.Doc2Vec(**params), str(fp), str(tmp_path / 'm.model'))
+
+    names = [f'G{i}' for i in range(20)]
+    for model in [streamed, filed]:
+        docvecs = model.docvecs
+        assert sorted(docvecs.offset2doctag) == sorted(names)
+        assert len(docvecs.vectors_docs) == len(docvecs) == len(names)
+        for i, name in enumerate(docvecs.offset2doctag):
+            assert docvecs.doctags[name].offset == i
+            assert np.array_equal(docvecs[name], docvecs.vectors_docs[i])
+        assert all(n in names for n, _ in docvecs.most_similar('G0'))
+
+    # after saving, the names still point to the same rows
+    filed.save(str(tmp_path / 'm.model'))
+    loaded = gensim.models.Doc2Vec.load(str(tmp_path / 'm.model'))
+    for name in names:
+        assert np.array_equal(loaded.docvecs[name], filed.docvecs[name])
@@ -0,0 +1,155 @@
+from http.server import ThreadingHTTPServer
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from nanotext.cli.serve import MicroBatcher, Service, make_handler
+
+
+def test_micro_batcher():
+    sizes = []
+    def double(items):
+        sizes.append(len(items))
+        return [i * 2 for i in items]
+    batcher = MicroBatcher(double, size=8, wait=0.1)
+
+    results = {}
+    def submit(i):
+        results[i] = batcher.submit(i)
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert results == {i: i * 2 for i in range(20)}
+    assert len(sizes) < 20 and max(sizes) <= 8
+
+
+def test_server(tmp_path):
+    fp = tmp_path / 'genome_pfam.tsv'
+    fp.write_text('')
+    batchers = {'search': MicroBatcher(lambda items: [
+        [{'name': i['annotation'], 'cos': int(i.get('topn', 10))}] \
+        for i in items])}
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), make_handler(Service(), batchers))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    with urlopen(f'{url}/search?annotation={fp}&topn=3') as r:
+        assert json.load(r) == [{'name': str(fp), 'cos': 3}]
+    for path, status in [
+        ('/search?annotation=nope', 400), ('/predict', 404), ('/taxonomy', 404)]:
+        with pytest.raises(HTTPError) as e:
+            urlopen(url + path)
+        assert e.value.code == status
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_rejects_bad_annotation():
+    from urllib.request import Request
+
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), make_handler(Service(), {'search': None}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/search'
+
+    for annotation in [42, ['a.tsv'], None]:
+        data = json.dumps({'annotation': annotation}).encode()
+        with pytest.raises(HTTPError) as e:
+            urlopen(Request(url, data=data))
+        assert e.value.code == 400
+    server.shutdown()
+    server.server_close()
+
+
+def test_predict_batches(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    import numpy as np
+    import nanotext.utils
+    from nanotext.io import VectorCache
+
+    monkeypatch.setenv('NANOTEXT_CACHE', str(tmp_path / 'cache'))
+    fps = []
+    for i in range(3):
+        fp = tmp_path / f'g{i}.tsv'
+        fp.write_text(
+            '#\n'*28 + '\n' + f'A_1 1 50 1 52 PF{i}.1 x D 1 50 50 3 1e-9 1 No\n')
+        fps.append(str(fp))
+    (tmp_path / 'embedding').write_text('')
+
+    calls = []
+    def infer_genome_vectors(fps, fp_models, workers, pool=None, **kwargs):
+        calls.append((len(fps), pool))
+        return np.ones((len(fps), 1, 4), dtype='float32')
+    monkeypatch.setattr(
+        nanotext.utils, 'infer_genome_vectors', infer_genome_vectors)
+
+    service = Service(
+        threads=2, fp_embedding=str(tmp_path / 'embedding'),
+        cache=VectorCache(), embedding=SimpleNamespace(),
+        predictor=SimpleNamespace(predict=lambda vv: vv),
+        media=(['m1', 'm2'], np.eye(2, 4, dtype='float32')))
+    requests = [{'annotation': fp, 'fmt': 'pfamscan', 'topn': 1} for fp in fps]
+
+    first = service.predict(requests[:2])
+    second = service.predict(requests)  # only the 3rd genome is inferred
+    assert second[:2] == first
+    assert [n for n, _ in calls] == [2, 1]
+    assert calls[0][1] is calls[1][1] is service.pool  # workers are reused
+    service.pool.shutdown()
+
+
+def test_bad_request_in_batch(tmp_path):
+    from types import SimpleNamespace
+    import numpy as np
+
+    sizes = []
+    def infer(fps, **kwargs):
+        sizes.append(len(fps))
+        if any(fp.endswith('bad_pfam.tsv') for fp in fps):
+            raise ValueError('Cannot parse annotation')
+        return np.ones((len(fps), 4), dtype='float32')
+    model = SimpleNamespace(
+        dim=4, taxonomy=None, infer=infer,
+        search_batch=lambda vv, topn, within: [[('G1', 0.9)]] * len(vv))
+    service = Service(model=model)
+    batchers = {'search': MicroBatcher(service.search, wait=0.5)}
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), make_handler(service, batchers))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/search'
+
+    good, bad = tmp_path / 'good_pfam.tsv', tmp_path / 'bad_pfam.tsv'
+    good.write_text('')
+    bad.write_text('')
+    queries = {
+        'good': f'annotation={good}&topn=1',
+        'bad': f'annotation={bad}',
+        'topn': f'annotation={good}&topn=ten',
+        'within': f'annotation={good}&within=c__Clostridia'}
+    status = {}
+    def query(k):
+        try:
+            with urlopen(f'{url}?{queries[k]}') as r:
+                status[k] = (r.status, json.load(r))
+        except HTTPError as e:
+            status[k] = (e.code, json.load(e))
+    threads = [threading.Thread(target=query, args=(k,)) for k in queries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    server.shutdown()
+    server.server_close()
+
+    assert status['good'] == (200, [{'name': 'G1', 'cos': 0.9}])
+    assert status['bad'] == (400, {'error': 'Cannot parse annotation'})
+    assert status['topn'][0] == status['within'][0] == 400
+    # both annotations share one batch, then each is retried on its own
+    assert sizes == [2, 1, 1]
@@ -20,6 +20,15 @@ def mock_domains():
     return intervals
 
 
+@pytest.fixture
+def mock_table(mock_domains):
+    from nanotext.io import DomainTable
+
+    values = list(mock_domains.values())
+    return DomainTable(*zip(*[
+        (i.chrom, i.start, i.end, i.name, float(i.score)) for i in values]))
+
+
 def test_remove_overlap(mock_domains):
     text = []
     for i in remove_overlap(mock_domains):
@@ -48,3 +57,317 @@ def test_create_domain_sequence(mock_domains):
         deduplicate(remove_overlap(mock_domains)), keep_unknown=False)
     assert seq['A'] == ['zebra']
     assert seq['B'] == ['monkey', 'monkey', 'giraffe']
+
+
+def test_domain_table(mock_domains, mock_table):
+    dom = deduplicate(remove_overlap(mock_table))
+    assert dom.name.tolist() == ['zebra', 'monkey', 'monkey', 'giraffe']
+    assert create_domain_sequence(dom) == create_domain_sequence(
+        deduplicate(remove_overlap(mock_domains)))
+
+
+def test_create_domain_sequence_order():
+    from nanotext.io import DomainTable
+
+    rows = [
+        ('b_1', 'x'), ('b_1', 'y'), ('b_3', 'z'),
+        ('a_2', 'x'), ('a_4', 'y'), ('a_4', 'y')]
+    expected = {
+        'a': ['unknown', 'x', 'unknown', 'y', 'y'],
+        'b': ['x', 'y', 'unknown', 'z']}
+
+    for order in [
+        [0, 1, 2, 3, 4, 5],  # ordered, contigs not sorted by name
+        [3, 4, 5, 0, 1, 2],  # ordered
+        [2, 0, 1, 3, 5, 4],  # ORFs out of order
+        [0, 3, 1, 2, 4, 5],  # contigs interleaved
+        ]:
+        seq_id, name = zip(*[rows[i] for i in order])
+        dom = DomainTable(seq_id, range(6), range(1, 7), name, [1.] * 6)
+        seq = create_domain_sequence(dom)
+        assert seq == expected
+        assert list(seq) == ['a', 'b']
+
+
+def test_infer_encoded():
+    from types import SimpleNamespace
+    import numpy as np
+    from nanotext.utils import encode_tokens, infer_encoded
+
+    class Model():
+        '''Returns the words gensim would be asked to infer from.'''
+        def __init__(self, words):
+            self.wv = SimpleNamespace(index2word=words, vocab={
+                w: SimpleNamespace(index=i) for i, w in enumerate(words)})
+
+        def infer_vector(self, words, steps):
+            return words
+
+    tokens = {
+        'vocab': np.array(['PF1', 'PF2', 'PF9', 'unknown']),
+        'tokens': np.array([3, 0, 2, 1, 1], dtype='int32'),
+        'offsets': np.array([0, 3, 5])}
+    model = Model(['unknown', 'PF2', 'PF1'])
+
+    codes = encode_tokens(tokens, model)
+    assert [i.tolist() for i in codes] == [[0, 2, -1], [1, 1]]
+    words = infer_encoded(codes, model)
+    assert words == ['unknown', 'PF1', 'PF2', 'PF2']
+    assert words[0] is model.wv.index2word[0]
+    assert len(infer_encoded(codes, model, truncate_by=0.5, seed=1)) == 2
+
+    # seeding does not leak into the global random or the (shared) model
+    import random
+    model.hashfxn = hash
+    model.trainables = SimpleNamespace(hashfxn=hash)
+    state = random.getstate()
+    infer_encoded(codes, model, truncate_by=0.5, seed=1)
+    assert random.getstate() == state
+    assert model.hashfxn is model.trainables.hashfxn is hash
+    assert not hasattr(model, 'random')
+
+
+def test_infer_cached(tmp_path):
+    import numpy as np
+    from nanotext.io import VectorCache
+    from nanotext.utils import infer_cached
+
+    fps = []
+    for i in ['a.tsv', 'b.tsv', 'm1', 'm2']:
+        (tmp_path / i).write_text(i)
+        fps.append(str(tmp_path / i))
+    cache = VectorCache(str(tmp_path / 'vectors.db'))
+    calls = []
+
+    def infer(fps):
+        calls.append(fps)
+        return np.random.rand(len(fps), 2, 3)
+
+    vv = infer_cached(fps[:1], fps[2:], cache, infer, steps=10)
+    assert vv.shape == (1, 2, 3)
+    ww = infer_cached(fps[:2], fps[2:], cache, infer, steps=10)
+    assert calls == [fps[:1], fps[1:2]]  # only b.tsv was inferred again
+    assert np.allclose(vv[0], ww[0])
+    infer_cached(fps[:1], fps[2:], cache, infer, steps=20)
+    assert len(calls) == 3
+
+
+def test_infer_adaptive():
+    gensim = pytest.importorskip('gensim')
+    import numpy as np
+    from nanotext.utils import infer_adaptive
+
+    docs = [gensim.models.doc2vec.TaggedDocument(
+        [f'PF{i % 7}', f'PF{i % 5}', f'PF{i % 3}'] * 5, [str(i)])
+        for i in range(50)]
+    model = gensim.models.Doc2Vec(
+        docs, vector_size=10, min_count=1, dm=0, epochs=5, workers=1, seed=1)
+    words = ['PF1', 'PF2', 'PF3'] * 5
+
+    model.random = np.random.RandomState(42)
+    v, n = infer_adaptive(model, words, steps=100, tol=0)  # never converges
+    model.random = np.random.RandomState(42)
+    assert n == 100
+    assert np.allclose(v, model.infer_vector(words, steps=100))
+    
+    model.random = np.random.RandomState(42)
+    _, n = infer_adaptive(model, words, steps=1000, tol=1, block=10)
+    assert n == 10
+
+
+def test_seeded_inference_across_processes():
+    '''
+    gensim seeds the initial doc vector w/ model.trainables.hashfxn, which
+    must not depend on the (salted) hash() of the process.
+    '''
+    import os
+    from pathlib import Path
+    import subprocess
+    import sys
+
+    script = '''
+from types import SimpleNamespace
+import numpy as np
+from nanotext.utils import infer_encoded
+
+class Model():
+    wv = SimpleNamespace(index2word=['PF1', 'PF2'], vocab=None)
+    trainables = SimpleNamespace(hashfxn=hash)
+
+    def infer_vector(self, words, steps):  # like gensim's seeded_vector()
+        once = np.random.RandomState(
+            self.trainables.hashfxn(' '.join(words)) & 0xffffffff)
+        return once.rand(3) + self.random.rand(3)
+
+codes = [np.array([0, 1, -1], dtype='int32')]
+print(infer_encoded(codes, Model(), seed=42).tolist())
+'''
+    out = []
+    for salt in ['1', '2']:
+        out.append(subprocess.run(
+            [sys.executable, '-c', script], cwd=Path(__file__).parents[2],
+            env={**os.environ, 'PYTHONHASHSEED': salt},
+            capture_output=True, text=True, check=True).stdout)
+    assert out[0] == out[1]
+
+
+def test_infer_serial_vs_pool(tmp_path):
+    gensim = pytest.importorskip('gensim')
+    import numpy as np
+    from nanotext.io import load_embedding
+    from nanotext.utils import infer_genome_vector, infer_genome_vectors
+
+    docs = [gensim.models.doc2vec.TaggedDocument(
+        [f'PF{i % 7}', f'PF{i % 5}', f'PF{i % 3}'] * 5, [str(i)])
+        for i in range(50)]
+    model = gensim.models.Doc2Vec(
+        docs, vector_size=10, min_count=1, dm=0, epochs=5, workers=1, seed=1)
+    fp_model = str(tmp_path / 'model')
+    model.save(fp_model)
+
+    rows = [
+        f'A_{i} 1 50 1 52 PF{i % 7}.1 x D 1 50 50 3 1e-9 1 No'
+        for i in range(1, 20)]
+    fp = tmp_path / 'pfam.tsv'
+    fp.write_text('#\n'*28 + '\n' + '\n'.join(rows) + '\n')
+
+    kwargs = {'fmt': 'pfamscan', 'steps': 50, 'seed': 42, 'cache': False}
+    serial = infer_genome_vector(str(fp), load_embedding(fp_model), **kwargs)
+    pooled = infer_genome_vectors([str(fp)], [fp_model], 2, **kwargs)
+    assert np.allclose(serial, pooled[0, 0])
+
+
+def test_resolve_overlap_pairwise():
+    '''
+    Compare against the pairwise comparison of intervals that the bedtools
+    based implementation used to carry out.
+    '''
+    import random
+    from pybedtools import Interval
+    from nanotext.utils import resolve_overlap
+
+    random.seed(42)
+    domains = {}
+    for _ in range(300):
+        uid = random.choice(['A_1', 'A_2', 'B_1'])
+        start = random.randint(0, 200)
+        end = start + random.randint(1, 60)
+        evalue = random.choice(['1e-5', '1e-10', '1e-20', '0.01'])
+        domains[(uid, start, end)] = Interval(uid, start, end, score=evalue)
+    values = list(domains.values())
+
+    expected = set(domains.keys())
+    for u in values:
+        for v in values:
+            if (u.chrom != v.chrom) or not (u.start < v.end and v.start < u.end):
+                continue
+            try:
+                if not u == v:
+                    evalues = [float(u.score), float(v.score)]
+                    loser = [u, v][evalues.index(max(evalues))]
+                    expected.discard((loser.chrom, loser.start, loser.end))
+            except NotImplementedError:  # nested
+                inner = u if (u.start > v.start) and (u.end < v.end) else v
+                expected.discard((inner.chrom, inner.start, inner.end))
+
+    keep = resolve_overlap(
+        [i.chrom for i in values],
+        [i.start for i in values],
+        [i.end for i in values],
+        [float(i.score) for i in values])
+    observed = {k for k, ix in zip(domains.keys(), keep) if ix}
+    assert observed == expected
+
+
+def test_index_model():
+    from types import SimpleNamespace
+
+    import numpy as np
+
+    from nanotext.utils import demean, index_model, subtract_mean
+
+    rng = np.random.RandomState(0)
+    models = [SimpleNamespace(docvecs=SimpleNamespace(
+        index2entity=names, vectors_docs=rng.rand(len(names), 4)))
+        for names in [['a', 'b', 'c'], ['c', 'a', 'b', 'd']]]
+
+    names, mu, m = demean(models[0])
+    assert np.allclose(mu, models[0].docvecs.vectors_docs.mean(axis=0))
+    
+    nomean = [subtract_mean(i) for i in models]
+    found, db, _ = index_model(['a', 'b', 'c', 'd'], nomean, norm=None)
+    assert found == ['a', 'b', 'c']
+    assert np.allclose(db[2], (nomean[0]['c'] + nomean[1]['c']) / 2)
+    
+    # vectorized path yields the same
+    _, db_, _ = index_model(
+        ['a', 'b', 'c', 'd'], [demean(i)[::2] for i in models], norm=None)
+    assert np.allclose(db, db_)
+
+
+def test_build_index_approximate():
+    import numpy as np
+
+    from nanotext.evaluate import index_recall
+    from nanotext.utils import build_index
+
+    db = np.random.RandomState(0).rand(2000, 16)
+    _, exact = build_index(db, norm='l2')
+    db, index = build_index(db, norm='l2', index_type='IVF,Flat', nprobe=2)
+    assert index.nprobe == 2
+
+    report = index_recall(db, index, nprobe=(1, 1000), ef_search=(64,))
+    assert [i['param'] for i in report] == ['default', 'nprobe', 'nprobe']
+    assert report[-1]['recall'] == 1.0  # visiting all lists is exhaustive
+    assert index.nprobe == 2
+
+
+def test_get_taxa_from_names(tmp_path):
+    import sqlite3
+
+    from nanotext.io import TaxonomyDB
+    from nanotext.utils import get_taxa_from_names, get_names_from_taxon
+
+    fp = str(tmp_path / 'metadata.db')
+    conn = sqlite3.connect(fp)
+    conn.execute('''CREATE TABLE metadata (
+        accession TEXT, accession_redux TEXT, gtdb_taxonomy TEXT,
+        gtdb_class TEXT)''')
+    rows = [(f'RS_G{i}', f'G{i}', f'd__B;p__P;c__C{i % 2};o__O;f__F;g__G;s__S{i}',
+        f'c__C{i % 2}') for i in range(5000)]
+    conn.executemany('INSERT INTO metadata VALUES (?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+    names = [f'G{i}' for i in range(4999, -1, -2)] + ['missing']
+    df = get_taxa_from_names(fp, names)
+    assert df['name'].tolist() == names[:-1]
+    assert df['species'].tolist()[:2] == ['S4999', 'S4997']
+    assert get_taxa_from_names(fp, ['G7'])['class'].tolist() == ['C1']
+    assert len(get_names_from_taxon(fp, 'c__C0')) == 2500
+    
+    assert TaxonomyDB.open(fp) is TaxonomyDB.open(fp)  # pooled
+    with sqlite3.connect(fp) as conn:
+        ix = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'").fetchall()
+    assert len(ix) == 2
+
+
+def test_most_similar():
+    import numpy as np
+    from sklearn.preprocessing import normalize
+
+    from nanotext.utils import most_similar
+
+    rng = np.random.RandomState(0)
+    m = normalize(rng.rand(50, 8), axis=1)
+    names = [str(i) for i in range(50)]
+    query = rng.rand(2, 8)
+
+    hits = most_similar(query, names, m, topn=5)
+    for q, sim in zip(query, hits):
+        naive = sorted(
+            [(n, np.dot(q, v)/np.linalg.norm(q)) for n, v in zip(names, m)],
+            key=lambda x: x[1], reverse=True)[:5]
+        assert [n for n, _ in sim] == [n for n, _ in naive]
+        assert np.allclose([c for _, c in sim], [c for _, c in naive])
@@ -73,7 +73,18 @@ def deduplicate(intervals):
     NZ_CVUA01000001.1_953   991     1101    PF13403.1   1.9e-08 .
     NZ_CVUA01000001.1_953   1402    1718    PF00136.16  3.7e-33 .
     NZ_CVUA01000001.1_957   5       224     PF13476.1   4.5e-25 .
+
+    If given a DomainTable, return a DomainTable.
     '''
+    import numpy as np
+    from nanotext.io import DomainTable
+
+    if isinstance(intervals, DomainTable):
+        # compare each domain to its predecessor
+        same = (intervals.name[1:] == intervals.name[:-1]) & \
+               (intervals.seq_id[1:] == intervals.seq_id[:-1])
+        return intervals[np.concatenate([[True], ~same])[:len(intervals)]]
+
     from pybedtools import BedTool
 
     result = []
@@ -105,41 +116,87 @@ def remove_overlap(intervals, deduplicate=True):
     and remove those features that overlap based on their plausibility --
     namely their E-value in the score column. Smaller E-values are more 
     plausible.
+
+    The overlaps are resolved in-process w/o calling bedtools, see
+    resolve_overlap(). If given a DomainTable, return a DomainTable.
     '''
+    from nanotext.io import DomainTable
+    from nanotext.utils import resolve_overlap
+
+    if isinstance(intervals, DomainTable):
+        return intervals[resolve_overlap(
+            intervals.seq_id, intervals.start, intervals.end, intervals.evalue)]
+
     from pybedtools import BedTool
-    from nanotext.utils import to_interval, is_nested, get_interval_uid
 
-    result = intervals.copy()  # do not modify input in place
-    dom = BedTool(list(result.values()))
+    values = list(intervals.values())  # do not modify input in place
+    keep = resolve_overlap(
+        [i.chrom for i in values],
+        [i.start for i in values],
+        [i.end for i in values],
+        [float(i.fields[4]) for i in values])
 
-    for i in dom.intersect(dom, wa=True, wb=True):  # contig order is preserved
-        u = to_interval(*i.fields[:6])
-        v = to_interval(*i.fields[6:])
-        # features can (1) overlap partly, (2) be nested or (3) not overlap
-        try:
-            # (1) overlap but not w/ self (54/2964 of test cases) -- 
-            # drop smaller E
-            if not u == v:
-                evalues = [float(j.fields[4]) for j in [u, v]]
-                # get the interval w/ the higher E-value and delete
-                ix = evalues.index(max(evalues))
-                k = get_interval_uid([u, v][ix])
-                _ = result.pop(k, None)
+    return BedTool([i for i, k in zip(values, keep) if k])
+
+
+def resolve_overlap(seq_id, start, end, evalue):
+    '''
+    Given the columns of a domain table, return a boolean mask of the domains
+    to keep. For each pair of domains that overlap on the same ORF (<seq_id>),
+    features can (1) overlap partly, (2) be nested or (3) not overlap:
+
+    (1) drop the one w/ the larger E-value (both if they are equally large)
+    (2) drop the nested one, e.g. a helix-loop-helix in a larger domain
+    (3) keep both
+
+    All pairs are judged against the input, i.e. a dropped domain can still
+    remove others. Intervals are half-open like in BED, so book-ended domains
+    do not overlap.
+
+    Overlapping pairs are found w/ a sweep over the domains sorted by ORF and
+    start: domain j can only overlap domain i if it starts in [start_i,
+    end_i). This takes O(n log n + k) time for n domains and k overlaps.
+    '''
+    import numpy as np
+
+    start = np.asarray(start, dtype='int64')
+    end = np.asarray(end, dtype='int64')
+    evalue = np.asarray(evalue, dtype='float64')
+    n = len(start)
     
-            # (2) all features overlap w/ themselves, trivial -- skip
-            else:
-                pass
-        
-        # (3) nested domains (78/2964 test cases) -- get the larger interval
-        except NotImplementedError:
-            # "Features are nested -- comparison undefined"
-            # e.g. helix-loop-helix in larger domain
-            if is_nested(u, v):  # asks: u in v?
-                _ = result.pop(get_interval_uid(u), None)
-            else:
-                _ = result.pop(get_interval_uid(v), None)
+    keep = np.ones(n, dtype=bool)
+    if n < 2:
+        return keep
+
+    _, group = np.unique(np.asarray(seq_id), return_inverse=True)
+    order = np.lexsort((end, start, group))
+    g, s, e, ev = group[order], start[order], end[order], evalue[order]
+
+    # sort key that orders by ORF, then by start
+    offset = s.min()
+    span = int(max(e.max(), s.max()) - offset) + 1
+    key = g * span + (s - offset)
+    stop = np.searchsorted(key, g * span + (e - offset), side='left')
+    
+    # all pairs (i, j) w/ i < j where j starts before i ends
+    count = np.clip(stop - np.arange(n) - 1, 0, None)
+    i = np.repeat(np.arange(n), count)
+    j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(count) - count, count)
+
+    overlap = s[i] < e[j]  # only false for zero-length intervals
+    same = (s[i] == s[j]) & (e[i] == e[j])  # "overlap w/ themselves"
+    i, j = i[overlap & ~same], j[overlap & ~same]
+
+    i_in_j = (s[i] > s[j]) & (e[i] < e[j])
+    j_in_i = (s[j] > s[i]) & (e[j] < e[i])
+    nested = i_in_j | j_in_i
+
+    drop = np.zeros(n, dtype=bool)
+    drop[i[i_in_j | (~nested & (ev[i] >= ev[j]))]] = True
+    drop[j[j_in_i | (~nested & (ev[j] >= ev[i]))]] = True
 
-    return BedTool(list(result.values()))
+    keep[order] = ~drop
+    return keep
 
 
 def split_orf_uid(s):
@@ -167,20 +224,53 @@ def create_domain_sequence(domains, keep_unknown=True, fmt_fn=lambda x: x):
 
     If <keep_unknown>, all ORFs w/o domain calls are turned into "unknown"
     domains, 1 per ORF.
+
+    <domains> are either intervals (e.g. a BedTool) or a DomainTable.
+
+    Annotations from prodigal and pfam_scan come grouped by contig w/ the
+    ORFs in order. We collect the domains of consecutive rows of the same ORF
+    in one pass and, if the ORFs never go back on a contig, walk these blocks
+    as they are. Only if they do, we fall back to sorting all ORFs.
     '''
     from collections import defaultdict
+    from nanotext.io import DomainTable
     from nanotext.utils import split_orf_uid
 
-    d = defaultdict(list)
-    
-    for i in domains:
-        d[split_orf_uid(i.fields[0])].append(fmt_fn(i.fields[3]))
+    if isinstance(domains, DomainTable):
+        rows = zip(domains.seq_id.tolist(), domains.name.tolist())
+    else:
+        rows = ((i.fields[0], i.fields[3]) for i in domains)
+
+    blocks = []  # [((contig, orf), [domain, ...]), ...]
+    cache_uid = None
+    ordered = True
+    seen = set()  # contigs we have left
     
+    for uid, name in rows:
+        if uid != cache_uid:
+            k = split_orf_uid(uid)
+            if blocks:
+                last = blocks[-1][0]
+                if last[0] != k[0]:
+                    seen.add(last[0])
+                    ordered = ordered and (k[0] not in seen)
+                else:
+                    ordered = ordered and (k[1] > last[1])
+            blocks.append((k, []))
+            cache_uid = uid
+        blocks[-1][1].append(fmt_fn(name))
+
+    if not ordered:
+        d = defaultdict(list)
+        for k, v in blocks:
+            d[k].extend(v)
+        blocks = sorted(d.items())  # only sorts keys
+
     result = defaultdict(list)
     cache_orf = 0  # prodigal ORFs are indexed starting at 1
     cache_contig = ''
 
-    for k, v in sorted(d.items()):  # only sorts keys
+    for k, v in blocks:
         contig, orf = k
         
         # this block makes the routine contig aware
@@ -194,10 +284,13 @@ def create_domain_sequence(domains, keep_unknown=True, fmt_fn=lambda x: x):
         result[contig].extend(v)
         cache_orf = orf
 
-    return result
+    # contigs in the same order as if we had sorted the ORFs
+    return defaultdict(list, sorted(result.items()))
 
 
-def infer_genome_vector(fp, model, steps=200, fmt='hmmer', truncate_by=0):
+def infer_genome_vector(
+    fp, model, steps=200, fmt='hmmer', truncate_by=0, seed=None, cache=True,
+    tol=None):
     '''
     From a genome annotation either from Pfam or HMMER (formatted w/ HMMPy.py)
     infer a genome vector.
@@ -210,40 +303,315 @@ def infer_genome_vector(fp, model, steps=200, fmt='hmmer', truncate_by=0):
 
     We infer the vector w/ 200 steps (iterations) which during testing provided
     a mean cosine distance of the estimates < 0.01 -- more steps will reduce this variance and increase time needed to compute the vector.
+
+    Inference is stochastic; pass a <seed> to make it reproducible.
+
+    Given a <tol>, <steps> is the maximum, and we stop once the vector has
+    converged (see infer_adaptive()). We then return (vector, steps used).
+
+    The parsed annotation is cached (see load_tokens()) unless not <cache>.
+    To infer the same genome w/ several models or settings in one process,
+    encode it once per model and call infer_encoded() directly.
     '''
-    from pybedtools import BedTool
+    from nanotext.io import load_tokens
 
-    from nanotext.io import load_embedding, load_domains
-    from nanotext.utils import create_domain_sequence
+    codes = encode_tokens(load_tokens(fp, fmt=fmt, cache=cache), model)
+    return infer_encoded(codes, model, steps, truncate_by, seed, tol)
 
-    result = load_domains(fp, fmt=fmt)
-    dom = BedTool(list(result.values()))
-    seq = create_domain_sequence(
-        dom, keep_unknown=True, fmt_fn=lambda x: x.split('.')[0])
-    # fmt_fn here splits version number from Pfam domain PF00001.1 -> PF00001  
-    
-    # concatenate protein domain sequences from contigs
-    if truncate_by:
-        flat = [item for sublist in truncate(seq.values(), truncate_by) for item in sublist]
-    else:
-        flat = [item for sublist in seq.values() for item in sublist]
+
+def encode_tokens(tokens, model):
+    '''
+    Turn the <tokens> of a genome (see load_tokens()) into positions in the
+    vocabulary of <model>, one int32 array per contig, out-of-vocabulary
+    domains as -1. Only the distinct domains are looked up.
+    '''
+    import numpy as np
+
+    vocab = model.wv.vocab
+    lookup = np.array(
+        [vocab[w].index if w in vocab else -1 for w in tokens['vocab']],
+        dtype='int32')
+    return np.split(lookup[tokens['tokens']], tokens['offsets'][1:-1])
+
+
+def stable_hash(s):
+    '''
+    Like hash() for strings, but the same in every process (which hash() is
+    not, see PYTHONHASHSEED). Used as gensim's hashfxn for seeded inference.
+    '''
+    import hashlib
+
+    return int.from_bytes(hashlib.sha1(s.encode()).digest()[:8], 'little')
+
+
+def infer_encoded(
+    codes, model, steps=200, truncate_by=0, seed=None, tol=None):
+    '''
+    Infer a genome vector from its contigs encoded w/ encode_tokens(), see
+    infer_genome_vector().
+
+    Out-of-vocabulary domains are dropped once, after truncation, and the
+    remaining ones handed to gensim as the model's own vocabulary strings.
+    Their hashes are cached, so each of the <steps> looks them up cheaply.
+
+    A <seed> only applies to this call: the state it sets on <model> is
+    restored afterwards, as the model may be shared w/ unseeded calls (e.g.
+    in GenomeModel or the workers of "nanotext serve").
+    '''
+    import random
+
+    import numpy as np
+
+    rng, saved = random, []
+    if seed is not None:
+        rng = random.Random(seed)  # truncate()
+        # gensim draws negative samples and subsamples words from
+        # model.random; the initial doc vector is seeded w/
+        # hashfxn(' '.join(words)), and Python's hash() of a str differs
+        # btw/ processes
+        state = [
+            (model, 'random', np.random.RandomState(seed)),
+            (model, 'hashfxn', stable_hash)]
+        if hasattr(model, 'trainables'):
+            state.append((model.trainables, 'hashfxn', stable_hash))
+        for obj, k, v in state:
+            saved.append((obj, k, obj.__dict__.get(k, missing)))
+            setattr(obj, k, v)
+
+    try:
+        # concatenate protein domain sequences from contigs
+        if truncate_by:
+            codes = list(truncate(codes, truncate_by, rng))
+        flat = np.concatenate(codes) if len(codes) else \
+            np.zeros(0, dtype='int32')
+
+        index2word = model.wv.index2word
+        words = [index2word[i] for i in flat[flat >= 0].tolist()]
+
+        if tol:
+            return infer_adaptive(model, words, steps, tol)
+
+        # 200 epochs inference gives a varience < 0.01 cosine distance on
+        # when repeatedly inferring vectors (from our experiments)
+        return model.infer_vector(words, steps=steps)
+    finally:
+        for obj, k, v in reversed(saved):
+            if v is missing:
+                delattr(obj, k)
+            else:
+                setattr(obj, k, v)
+
+
+missing = object()  # an attribute that was not set, see infer_encoded()
+
+
+def infer_adaptive(model, words, steps=1000, tol=1e-4, block=50):
+    '''
+    Infer a document vector like gensim's infer_vector() (3.x), but check
+    every <block> steps how much it changed since the last check, and stop
+    once the cosine distance btw/ both estimates is below <tol>. The learning
+    rate decays over <steps> as in infer_vector(), so w/o early stopping the
+    result is the same.
+
+    Returns (vector, steps used).
+    '''
+    import numpy as np
+    from gensim import matutils
+    from gensim.models.doc2vec_inner import \
+        train_document_dbow, train_document_dm, train_document_dm_concat
+
+    vv, locks = model.trainables.get_doctag_trainables(
+        words, model.docvecs.vector_size)
+    doctags = [0]
+    work = np.zeros(model.trainables.layer1_size, dtype='float32')
+    if not model.sg:
+        neu1 = matutils.zeros_aligned(
+            model.trainables.layer1_size, dtype='float32')
     
-    # 200 epochs inference gives a varience < 0.01 cosine distance on
-    # when repeatedly inferring vectors (from our experiments)
-    return model.infer_vector(flat, steps=steps)  
+    alpha = model.alpha
+    alpha_delta = (model.alpha - model.min_alpha) / max(steps - 1, 1)
+    last = vv[0].copy()
+
+    for i in range(1, steps + 1):
+        kwargs = {
+            'learn_words': False, 'learn_hidden': False,
+            'doctag_vectors': vv, 'doctag_locks': locks}
+        if model.sg:
+            train_document_dbow(model, words, doctags, alpha, work, **kwargs)
+        elif model.dm_concat:
+            train_document_dm_concat(
+                model, words, doctags, alpha, work, neu1, **kwargs)
+        else:
+            train_document_dm(
+                model, words, doctags, alpha, work, neu1, **kwargs)
+        alpha -= alpha_delta
+
+        if i % block == 0:
+            if 1 - cosine(last, vv[0]) < tol:
+                break
+            last = vv[0].copy()
+
+    return vv[0], i
     
     
-def truncate(sequences, by=0.5):
-    '''Given several sequences, truncate them <by> a given fraction.'''
+_WORKER_MODELS = {}  # per worker process, see _infer_task()
+
+
+def _infer_task(args):
+    '''
+    Worker fn for infer_genome_vectors(). Models are loaded memory-mapped on
+    first use and then kept for the lifetime of the worker process.
+    '''
+    from nanotext.io import load_embedding
+
+    fp, fp_model, kwargs = args
+    if fp_model not in _WORKER_MODELS:
+        _WORKER_MODELS[fp_model] = load_embedding(fp_model, mmap='r')
+    return infer_genome_vector(fp, _WORKER_MODELS[fp_model], **kwargs)
+
+
+def infer_genome_vectors(
+    fps, fp_models, workers=1, seeds=None, pool=None, **kwargs):
+    '''
+    Infer a vector for each genome annotation in <fps> and each model in
+    <fp_models> using a pool of <workers> processes. All other keyword
+    arguments are passed on to infer_genome_vector(). To seed each genome
+    differently, e.g. to infer the same genome several times, pass one of
+    <seeds> per genome.
+
+    The workers load the models w/ mmap, so the weight matrices are shared
+    through the page cache instead of being copied into each process. Given a
+    <seed>, each (genome, model) task is seeded the same way as in a serial
+    run, so the result does not depend on the number of workers.
+
+    To not start (and load the models in) new workers on every call, pass a
+    ProcessPoolExecutor as <pool>, which is then used instead.
+
+    Returns an array of shape (genomes, models, dimensions). Given a <tol>
+    (see infer_adaptive()), also return the steps used, one per genome and
+    model.
+
+    Usage:
+
+    fp_models = [f'models/{n}/nanotext_r89.model' for n in [22, 45, 93]]
+    vv = infer_genome_vectors(
+        fps, fp_models, workers=8, fmt='pfamscan', steps=1000, seed=42)
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    import numpy as np
+
+    if seeds is None:
+        seeds = [kwargs.pop('seed', None)] * len(fps)
+    tasks = [
+        (fp, str(m), dict(kwargs, seed=s))
+        for fp, s in zip(fps, seeds) for m in fp_models]
+    if pool:
+        vv = list(pool.map(_infer_task, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            vv = list(pool.map(_infer_task, tasks))
+
+    shape = (len(fps), len(fp_models))
+    if kwargs.get('tol'):
+        vv, used = zip(*vv)
+        return np.array(vv, dtype='float32').reshape(*shape, -1), \
+            np.array(used).reshape(shape)
+    return np.array(vv, dtype='float32').reshape(*shape, -1)
+
+
+def infer_cached(
+    fps, fp_models, cache, infer, seeds=None, samples=None, **params):
+    '''
+    Return the vectors of shape (genomes, models, dimensions) for the genome
+    annotations <fps> and the models <fp_models>, looked up in <cache> (a
+    VectorCache) first. The genomes w/ any vector missing are passed to
+    <infer>(fps), which has to return their vectors in the same shape; these
+    are then cached. The inference <params> (steps, fmt, ...) are part of the
+    cache key.
+
+    Given one of <seeds> per genome, these replace the seed in <params>, and
+    <infer> is called as <infer>(fps, seeds). If the same genome is inferred
+    several times, pass the number of each sample in <samples>, so that the
+    samples are cached separately even w/o a seed.
+    '''
+    import numpy as np
+
+    n = len(fp_models)
+    keys = []
+    for i, fp in enumerate(fps):
+        p = dict(params)
+        if seeds is not None:
+            p['seed'] = seeds[i]
+        if samples is not None:
+            p['sample'] = samples[i]
+        keys.append([cache.key(fp, m, **p) for m in fp_models])
+    found = cache.get([k for row in keys for k in row])
+    found = [found[i:i+n] for i in range(0, len(found), n)]
+    todo = [i for i, row in enumerate(found) if any(v is None for v in row)]
+
+    if todo:
+        if seeds is None:
+            vv = infer([fps[i] for i in todo])
+        else:
+            vv = infer([fps[i] for i in todo], [seeds[i] for i in todo])
+        cache.put(
+            [k for i in todo for k in keys[i]],
+            [v for row in vv for v in row])
+        for i, row in zip(todo, vv):
+            found[i] = row
+    return np.array(found, dtype='float32').reshape(len(fps), n, -1)
+
+
+def infer_batch(
+    fps, fp_models, models=None, workers=1, pool=None, cache=True,
+    **params):
+    '''
+    Return the vectors of shape (genomes, models, dimensions) for the genome
+    annotations <fps> and the models <fp_models>. W/ more than one of
+    <workers> (or a <pool>), they are inferred in a process pool (see
+    infer_genome_vectors()), else in this process w/ the loaded <models>,
+    which are loaded from <fp_models> if not given. If <cache> is a
+    VectorCache, only the genomes not in it are inferred (see
+    infer_cached()). All <params> are passed on to infer_genome_vector().
+    '''
+    import numpy as np
+
+    from nanotext.io import load_embedding, VectorCache
+
+    fp_models = [str(m) for m in fp_models]
+
+    def infer(fps):
+        nonlocal models
+        if pool or workers > 1:
+            return infer_genome_vectors(
+                fps, fp_models, workers, pool=pool, cache=bool(cache),
+                **params)
+        if models is None:
+            models = [load_embedding(m) for m in fp_models]
+        return np.array([[
+            infer_genome_vector(fp, m, cache=bool(cache), **params)
+            for m in models] for fp in fps], dtype='float32')
+
+    if isinstance(cache, VectorCache):
+        return infer_cached(list(fps), fp_models, cache, infer, **params)
+    return infer(list(fps))
+
+
+def truncate(sequences, by=0.5, rng=None):
+    '''
+    Given several sequences, truncate them <by> a given fraction. Pass a
+    random.Random() as <rng> to not use (and change) the global one.
+    '''
     import random
 
+    rng = rng or random
     for seq in sequences:
         cut = int(by*len(seq))
-        start = random.choice(range(0, len(seq)-cut))
+        start = rng.choice(range(0, len(seq)-cut))
         seq1 = seq[:start]
         seq2 = seq[start+cut:]
         for j in [seq1, seq2]:
-            if j:
+            if len(j):
                 yield j
 
 
@@ -251,21 +619,19 @@ def subset_taxonomy(query, taxa):
     '''
     Given a query in the GTDB format of <first letter rank>__<name> (e.g.
     "f__Pseudomonadaceae"), return all IDs from the taxonomy database. 
+
+    For repeated lookups, build a TaxonomyIndex (nanotext.classes) once.
     '''
     taxon, name = query.split('__')
-    groups = 'd p c o f g s'.split()
-    result = []
-    
-    for k, v in taxa.items():
-        d = dict(zip(groups, v))
-        if d[taxon] == name:
-            result.append(k)
-    return result
+    ix = 'd p c o f g s'.split().index(taxon)
+    return [k for k, v in taxa.items() if v[ix] == name]
 
 
 def subset_model_by_rank(model, db, taxon):
     '''
     From a taxonomy database, select those records in the model that match.
+
+    For repeated lookups, build a TaxonomyIndex (nanotext.classes) once.
     '''
     entries = model.docvecs.index2entity
     ranks = 'd p c o f g s'.split()
@@ -287,7 +653,11 @@ def subset_model_by_rank(model, db, taxon):
 
 
 def get_vectors(l, model, normalized=False):
-    '''Get array of document vectors given an ID list and a model'''
+    '''Get array of document vectors given an ID list and a model
+
+    The <model> is either a gensim model, a GenomeModel (i.e. the demeaned
+    ensemble vectors) or a dict of name: vector.
+    '''
     import numpy as np
     from sklearn.preprocessing import normalize
 
@@ -295,10 +665,12 @@ def get_vectors(l, model, normalized=False):
 
     m, found = [], []
     cnt = 0
+    get = model.docvecs.__getitem__ if hasattr(model, 'docvecs') \
+        else model.__getitem__
 
     for i in l:
         try:
-            m.append(model.docvecs[i])
+            m.append(get(i))
             found.append(i)
         except KeyError:
             cnt += 1
@@ -333,35 +705,25 @@ def flatten(l):
 def get_names_from_taxon(db, taxon):
     '''Given a taxon in GTDB format (e.g. c__Clostridia) return model UIDs'''
     from nanotext.utils import strip_name
-    from nanotext.io import dbopen
-
-    groups = {
-        'c': 'class',
-        's': 'species',
-        'p': 'phylum',
-        'f': 'family',
-        'd': 'domain',
-        'o': 'order',
-        'g': 'genus',}
-    rank = groups[taxon.split('__')[0]]  # c__Clostridia
-
-    with dbopen(db) as cursor:
-        tablename = 'metadata'
-        t = (taxon,)
-        cursor.execute(
-            f'SELECT accession FROM {tablename} WHERE gtdb_{rank}=?', t)
-        l = [strip_name(i[0]) for i in cursor.fetchall()]  
-        # ('GB_GCA_002409805.1',),
-    return l
-
-
-def index_model(names, models, norm='l2'):
+    from nanotext.io import TaxonomyDB
+
+    # ('GB_GCA_002409805.1',),
+    return [strip_name(i) for i in TaxonomyDB.open(db).accessions(taxon)]
+
+
+def index_model(names, models, norm='l2', **kwargs):
     '''
     To normalize or not to normalize:
     
     - stats.stackexchange.com/questions/177905
     - stackoverflow.com/questions/36034454
 
+    <models> are either dicts of name: vector (see subtract_mean()) or
+    (names, matrix) tuples (see demean()). The latter are averaged w/o
+    looping over names in case all models share the order of <names>.
+
+    Any <kwargs> are passed on to build_index(), e.g. the <index_type>.
+
     Usage:
 
     fp = f'{base}/models/{n}/nanotext_r89.model'
@@ -369,48 +731,116 @@ def index_model(names, models, norm='l2'):
     m3 = subtract_mean(model3)
     found, m, index = index_model(names, [m1, m2, m3], norm=norm)
     '''
-    import faiss
     import numpy as np
-    from sklearn.preprocessing import normalize
     
     from nanotext.io import eprint
     
-    m = []
-    found, notfound = [], 0
+    names = list(names)
+    matrices, rows = [], []
+    found = np.ones(len(names), dtype=bool)
 
     # first take mean of vectors ...
-    for i in names:
-        model_vv = []
-        try:
-            for model in models:
-                model_vv.append(model[i])
-        except KeyError:
-            notfound += 1
+    for model in models:
+        if isinstance(model, dict):
+            keys, m = list(model.keys()), np.array(list(model.values()))
+        else:
+            keys, m = list(model[0]), model[1]
+        matrices.append(np.asarray(m, dtype='float32'))
+
+        if keys == names:
+            rows.append(None)  # same order, no need to look up rows
             continue
-        
-        sum_ = np.sum(model_vv, axis=0)/len(model_vv)
-        found.append(i)
-        m.append(sum_)
-        # if only one model is present, this will return the original vector
-    
-    db = np.array(m, dtype='float32')
-    dim = db.shape[1]  # dimensions
+        lookup = {name: i for i, name in enumerate(keys)}
+        ix = np.array([lookup.get(i, -1) for i in names], dtype=np.int64)
+        found &= ix >= 0
+        rows.append(ix)
+
+    db = np.zeros((found.sum(), matrices[0].shape[1]), dtype='float32')
+    for m, ix in zip(matrices, rows):
+        db += m[found] if ix is None else m[ix[found]]
+    db /= len(matrices)
+    # if only one model is present, this will return the original vectors
+    found = [i for i, j in zip(names, found) if j]
     
     # ... then normalize
+    db, index = build_index(db, norm, **kwargs)
+
+    notfound = len(names) - len(found)
+    if notfound > 0:
+        fraction = round(notfound/len(names), 4)
+        eprint(f'{notfound} entries ({fraction}) not found.')
+    return found, db, index
+
+
+def build_index(
+    db, norm='l2', index_type='Flat', nprobe=None, ef_search=None,
+    train_size=100000, seed=42):
+    '''
+    Given a matrix of vectors (one per row), return the (normalized) matrix
+    and a faiss index over it. For an l2 norm, the inner product of two
+    vectors equals their cosine similarity.
+
+    By default the index is exact (brute-force). For large collections, pass
+    any faiss factory string as <index_type> for an approximate index, e.g.
+    "IVF4096,Flat", "HNSW32" or "IVF,PQ20". W/o a number of lists, "IVF" is
+    sized to the number of vectors. Indices that need training are trained
+    on a random sample of <train_size> vectors. <nprobe> and <ef_search> trade
+    recall for speed (see tune_index()).
+
+    https://github.com/facebookresearch/faiss/wiki/The-index-factory
+    '''
+    import re
+
+    import faiss
+    import numpy as np
+    from sklearn.preprocessing import normalize
+
+    db = np.asarray(db, dtype='float32')
+    n, dim = db.shape  # dimensions
+
     if not norm:
-        index = faiss.IndexFlatL2(dim)
+        metric = faiss.METRIC_L2
     elif norm == 'l2':
-        index = faiss.IndexFlatIP(dim)
+        metric = faiss.METRIC_INNER_PRODUCT
         db = normalize(db, norm=norm, axis=1)
         # the inner product IP of two unit length vectors = cosine similarity
     else:
         raise ValueError('This norm is not supported, abort!')
 
+    # faiss wants >= 39 training points per list
+    nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    factory = re.sub(r'^IVF(?=,|$)', f'IVF{nlist}', index_type)
+    try:
+        index = faiss.index_factory(dim, factory, metric)
+    except RuntimeError:
+        raise ValueError(f'Index type "{index_type}" not understood, abort!')
+
+    if not index.is_trained:
+        rng = np.random.RandomState(seed)
+        sample = db[rng.choice(n, min(n, train_size), replace=False)]
+        index.train(sample)
+
     index.add(db)
-    if notfound > 0:
-        fraction = round(notfound/len(names), 4)
-        eprint(f'{notfound} entries ({fraction}) not found.')
-    return found, db, index
+    tune_index(index, nprobe, ef_search)
+    return db, index
+
+
+def tune_index(index, nprobe=None, ef_search=None):
+    '''
+    Set the search parameters of an approximate index: <nprobe> is the number
+    of lists an IVF index visits, <ef_search> the size of the candidate list
+    of an HNSW graph. Higher values give a higher recall at a higher latency.
+    '''
+    import faiss
+
+    space = faiss.ParameterSpace()
+    for k, v in [('nprobe', nprobe), ('efSearch', ef_search)]:
+        if v:
+            try:
+                space.set_index_parameter(index, k, int(v))
+            except RuntimeError:
+                raise ValueError(f'{k} does not apply to this index, abort!')
+    return index
 
 
 def subtract_mean(model, names=None, dtype='float32'):
@@ -426,26 +856,59 @@ def subtract_mean(model, names=None, dtype='float32'):
 
     m_ = subtract_mean(model)  # m_ .. m minus
     '''
+    names, _, m = demean(model, names, dtype)
+    return dict(zip(names, m))
+
+
+def demean(model, names=None, dtype='float32'):
+    '''
+    Like subtract_mean(), but return the names found, the mean vector and the
+    demeaned matrix (one row per name), which avoids building a dict.
+    W/o <names>, the model's document vectors are used as is.
+
+    Usage:
+
+    names, mu, m = demean(model)
+    '''
     import numpy as np
-    from nanotext.io import eprint
-    
-    vv = []
+
+    docvecs = model.docvecs
     if not names:
-        names = model.docvecs.index2entity
-    
-    notfound = 0
-    for i in names:
-        try:
-            vv.append(model.docvecs[i])
-        except KeyError:
-            notfound += 1
-            continue
-    
-    # eprint(f'{notfound} names {round(notfound/len(names), 4)} not found ...')
+        names = list(docvecs.index2entity)
+        m = np.array(docvecs.vectors_docs[:len(names)], dtype=dtype)
+    else:
+        rows = {name: i for i, name in enumerate(docvecs.index2entity)}
+        names = [i for i in names if i in rows]
+        m = np.array(
+            docvecs.vectors_docs[[rows[i] for i in names]], dtype=dtype)
 
-    m = np.array(vv, dtype=dtype)
-    mu = np.mean(m, axis=0)
-    return dict(zip(names, m-mu))
+    mu = m.mean(axis=0)
+    return names, mu, m - mu
+
+
+def most_similar(query, names, m, topn=10):
+    '''
+    Return the <topn> rows of <m> most similar (cosine) to each row of
+    <query>, as one list of (name, cosine) per row, in descending order.
+    The rows of <m> must be L2-normalized (see load_media_vectors()).
+
+    Usage:
+
+    names, m = load_media_vectors('embedding.media.json')
+    most_similar(m[:1], names, m, topn=3)
+    # [[('1', 1.0), ('137', 0.9215), ...]]
+    '''
+    import numpy as np
+    from sklearn.preprocessing import normalize
+
+    query = normalize(np.atleast_2d(query).astype('float32'), axis=1)
+    sim = query @ np.asarray(m).T
+    
+    k = min(topn, sim.shape[1])
+    top = np.argpartition(-sim, k-1, axis=1)[:, :k]  # unordered
+    order = np.argsort(-np.take_along_axis(sim, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return [[(names[j], float(s[j])) for j in row] for s, row in zip(sim, top)]
 
 
 def query_model(v, index, names, topn=1, norm='l2'):
@@ -477,31 +940,15 @@ def get_taxa_from_names(db, names):
     '''
     import pandas as pd
 
-    from nanotext.utils import strip_name
-    from nanotext.io import dbopen, eprint
+    from nanotext.io import TaxonomyDB, eprint
 
-    
-    with dbopen(db) as cursor:
-        # cannot use placeholders here
-        # stackoverflow.com/questions/31277027
-        
-        # needs to be a tuple otherwise OperationalError: no such table ...
-        n = tuple(names)
-        # hack that covers case of only one query
-        # problem is that tuple([1]) -> tuple(1,)
-        # -- trailing comma causes error
-        if len(n) == 1:
-            n = n*2
-        
-        statement = f'SELECT accession_redux, gtdb_taxonomy FROM metadata WHERE accession_redux IN {n}'
-        # statement = f'SELECT accession_redux, gtdb_taxonomy FROM metadata WHERE accession_redux = {n}'
-        
-        cursor.execute(statement)
-        l = cursor.fetchall()
+    l = TaxonomyDB.open(db).taxonomy(names)
     
     # order of names is preserved, e.g. when ordered by distance
     taxa = {}
     for name, taxon in l:
+        if not taxon:
+            continue
         # 'd__Bacteria;p__Cyanobacteriota;c__Cyanobacteriia;[...]'
         taxa[name] = [name] + [j.split('__')[1] for j in taxon.split(';')]
 
@@ -2,15 +2,17 @@
 # -*- coding: utf-8 -*-
 
 
-from re import split
-from itertools import groupby
-from operator import itemgetter
-# import sys
+import os
+import re
+import sys
 
 __author__ = 'Enzo Guerrero-Araya (biologoenzo@gmail.com)'
-__version__ = '0.1'
+__version__ = '0.2'
 __date__ = 'July 13, 2016'
 
+SPACES = re.compile(r"\s+")
+
+
 class HMMparser(object):
     """Parser of --domtblout of HMMER
        Default values of Evalue and coverage was taken from dbCAN. 
@@ -23,107 +25,134 @@ class HMMparser(object):
        Anaerocellum thermophilum DSM 6725. Our suggestion is that 
        for plants, use E-value < 1e-23 and coverage > 0.2;
        for bacteria, use E-value < 1e-18 and coverage > 0.35;
-       and for fungi, use E-value < 1e-17 and coverage > 0.45."""
+       and for fungi, use E-value < 1e-17 and coverage > 0.45.
+
+       The file is streamed: filters are only registered by the filterBy*
+       methods, and applied in a single pass over the lines when iterating
+       over the parser (or its rows()), so the domtblout never has to fit
+       into memory. Usage:
+
+       hmm = HMMparser("orfs.domtbl")
+       hmm.filterByEvalue(1e-18)
+       hmm.filterByCoverage(0.35)
+       for row in hmm:
+           ..."""
 
     def __init__(self, HMMfile):
         self.HMMfile = HMMfile
+        self.parameters = self.readParameters()  # dict_keys(["Target file", "Option settings", "Program", "Version", "Date", "Current dir", "Pipeline mode", "Query file"])
+        self.filters = []
+        self.unique = False
+        
+        if self.parameters.get("Program") == "hmmscan":
+            self.maxsplit = 22  # just 22 because the last can contain \s+ characters
+            self.evalue, self.bits = 12, 13  # i-Evalue (whole database), score of domain
+        elif self.parameters.get("Program") == "hmmsearch":
+            self.maxsplit = 18  # just 18 because the last can contain \s+ characters
+            self.evalue, self.bits = 7, 8  # Evalue, score of domain
+        else:
+            raise ValueError("No hmmscan or hmmsearch output: " + HMMfile)
+
+    def readParameters(self, tail=4096):
+        """The run parameters are in the last lines of the file, so we only
+        read its <tail> (in bytes). If the program is not among them (e.g.
+        w/ a very long command line), we scan all comment lines instead."""
         try:
-            self.data_HMMfile = open(self.HMMfile).read()
+            size = os.path.getsize(self.HMMfile)
+            with open(self.HMMfile, "rb") as file:
+                file.seek(max(0, size - tail))
+                lines = file.read().decode(errors="replace").split("\n")
         except FileNotFoundError as e:
             print("The name file or folder is incorrect.\
                   An error has occurred.")
             raise e
-        self.parameters = {}  # dict_keys(["Target file", "Option settings", "Program", "Version", "Date", "Current dir", "Pipeline mode", "Query file"])
-        for i, line in enumerate(self.data_HMMfile.split("\n")[-10:-2]):
-            line = line.split(":")
-            key = line[0][2:]
-            value = line[1].strip()
-            self.parameters[key] = value
-        if self.parameters["Program"] == "hmmscan":
-            self.matrix = self.hmmscanParser()
-        elif self.parameters["Program"] == "hmmsearch":
-            self.matrix = self.hmmsearchParser()
+
+        parameters = self.parseParameters(lines)
+        if "Program" not in parameters and size > tail:
+            with open(self.HMMfile, "r", errors="replace") as file:
+                parameters = self.parseParameters(
+                    line.rstrip("\n") for line in file if line[0] == "#")
+        return parameters
+
+    @staticmethod
+    def parseParameters(lines):
+        parameters = {}
+        for line in lines:
+            if line.startswith("# ") and ":" in line:
+                key, value = line[2:].split(":", 1)
+                parameters[key.strip()] = value.strip()
+        return parameters
 
     def filterByEvalue(self, evalue=1e-18):
-        if self.parameters["Program"] == "hmmscan":
-            for i, row in enumerate(self.matrix):
-                if float(row[12]) > evalue:  # domain[11] -> i-Evalue (whole database)
-                    # print(row, file=sys.stderr)
-                    self.matrix.pop(i)
-        elif self.parameters["Program"] == "hmmsearch":
-            for i, row in enumerate(self.matrix):
-                if float(row[7]) > evalue:  # domain[11] -> Evalue of domine
-                    self.matrix.pop(i)
+        ix = self.evalue
+        self.filters.append(lambda row: float(row[ix]) <= evalue)
 
     def filterByBitscore(self, bits=50):
-        if self.parameters["Program"] == "hmmscan":
-            for i, row in enumerate(self.matrix):
-                if float(row[13]) < bits:  # domain[13] -> Bitscore
-                    self.matrix.pop(i)
-        elif self.parameters["Program"] == "hmmsearch":
-            for i, row in enumerate(self.matrix):
-                if float(row[8]) < bits:  # domain[8] -> Bitscore
-                    self.matrix.pop(i)
+        ix = self.bits
+        self.filters.append(lambda row: float(row[ix]) >= bits)
 
     def filterByCoverage(self, cov=0.35):  # covered fraction of HMM
         if self.parameters["Program"] == "hmmscan":
-            for i, row in enumerate(self.matrix):
-                coverage = (float(row[16]) - float(row[15])) / float(row[2])
-                if coverage < cov:  # domain[13] -> Bitscore
-                    self.matrix.pop(i)
+            self.filters.append(lambda row: \
+                (float(row[16]) - float(row[15])) / float(row[2]) >= cov)
         elif self.parameters["Program"] == "hmmsearch":
             print("This type of filter due to technical stuff is only \
                    available for hmmscan program, please rerun your hmmsearch \
                    as hmmscan if you need this filter")
 
-    def uniqueByBestBitscore(self,):  # by domain
+    def uniqueByBestBitscore(self,):  # by query
         if self.parameters["Program"] == "hmmscan":
-            matrix = sorted(self.matrix, key=itemgetter(3), reverse=True)
-            for query, group in groupby(matrix, itemgetter(3)):
-                group = list(group)
-                if len(group) == 1:
-                    continue
-                group = sorted(group, key=itemgetter(13), reverse=True)
-                for dom in group[1:]:
-                    index = self.matrix.index(dom)
-                    self.matrix.pop(index)
+            self.unique = True
         elif self.parameters["Program"] == "hmmsearch":
             print("This type of filter due to technical stuff is only \
                    available for hmmscan program, please rerun your hmmsearch \
                    as hmmscan if you need this filter")
 
-    def hmmscanParser(self, ):
-        matrix = []
-        # header = ["target name", "accession", "tlen", "query name",
-        #           "accession", "qlen", "E-value", "score", "bias", "#", "of",
-        #           "c-Evalue", "i-Evalue", "score", "bias", "from", "to",
-        #           "from", "to", "from", "to", "acc", "description of target"]
-        # matrix.append(header)
-        for line in self.data_HMMfile.split("\n"):
-            if line.startswith("#") or line is "":
-                continue
-            line = split("\s+", line, 22)  # just 22 because the last can contain \s+ characters
-            matrix.append(line)
-        return matrix
-
-    def hmmsearchParser(self, ):
-        matrix = []
-        # header = ["target name", "accession", "query name", "accession",
-        #           "E-value", "score", "bias", "E-value", "score", "bias",
-        #           "exp", "reg", "clu", "ov", "env", "dom", "rep", "inc",
-        #           "description of target"]
-        # matrix.append(header)
-        for line in self.data_HMMfile.split("\n"):
-            if line.startswith("#") or line is "":
-                continue
-            line = split("\s+", line, 18)  # just 18 because the last can contain \s+ characters
-            matrix.append(line)
-        return matrix
+    def rows(self):
+        """Yield the rows (lists of fields) that pass all filters."""
+        rows = self.filtered()
+        return self.best(rows) if self.unique else rows
+
+    def filtered(self):
+        with open(self.HMMfile, "r") as file:
+            for line in file:
+                line = line.rstrip("\n")
+                if line.startswith("#") or line == "":
+                    continue
+                row = SPACES.split(line, maxsplit=self.maxsplit)
+                if all(f(row) for f in self.filters):
+                    yield row
+
+    def best(self, rows):
+        """Keep the first row w/ the highest bitscore of each query. hmmscan
+        reports the hits of a query en bloc, so we only need to hold one
+        row at a time."""
+        best, seen = None, set()
+        for row in rows:
+            if best and row[3] != best[3]:
+                yield best
+                best = None
+            if not best:
+                if row[3] in seen:
+                    print("Query " + row[3] + " is not reported en bloc, \
+                        it will appear more than once", file=sys.stderr)
+                seen.add(row[3])
+                best = row
+            elif float(row[self.bits]) > float(best[self.bits]):
+                best = row
+        if best:
+            yield best
+
+    def __iter__(self):
+        return self.rows()
+
+    @property
+    def matrix(self):
+        return list(self.rows())
 
 # Module test
 if __name__ == "__main__":
     import argparse
-    import sys
     usage = """%(prog)s reads .domtblout file and returns a custom filtred \
                result (by Evalue, Bitscore, Coverage of HMM model) or it can \
                show only the Best Bitscore domain for each query on hmmscan \
@@ -182,6 +211,6 @@ if __name__ == "__main__":
                   "exp", "reg", "clu", "ov", "env", "dom", "rep", "inc",
                   "description of target"]
     print(spacer.join(header), file=outfile)
-    for row in hmm.matrix:
+    for row in hmm:
         row = spacer.join(row)
         print(row, file=outfile)
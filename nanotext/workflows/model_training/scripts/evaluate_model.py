@@ -1,6 +1,6 @@
 import click
 
-from nanotext.evaluate import odd_one, ecotype_task
+from nanotext.evaluate import somo, ecotype_task
 from nanotext.io import load_ecotypes, load_embedding, eprint
 
 
@@ -21,25 +21,33 @@ from nanotext.io import load_ecotypes, load_embedding, eprint
     '--outfile', '-o', 
     help='Name of the resulting evaluation report', 
     type=click.Path(), required=True)
-def evaluate(model, corpus, ecotypes, outfile):
+@click.option(
+    '--seed', 
+    help='Seed for drawing the odd domains of the SOMO task', default=42)
+def evaluate(model, corpus, ecotypes, outfile, seed):
     '''
     A test battery:
     
     - SOMO task -- find the domain in a sequence that does not fit
     - Ecotype task -- separate niche-specific subpopulations of misc species
 
-    Returns a list of accuracy - (sub)task pairs.
+    Returns a list of accuracy - (sub)task pairs; the bounds of the 95%
+    confidence interval of the SOMO accuracy are reported as SOMO_low and
+    SOMO_high.
     '''
+    m = load_embedding(model)
+
     with open(outfile, 'w+') as out:
 
         # (1)
         eprint('SOMO task ...')
-        SOMO = odd_one(corpus, model, n_not_odd=5)
-        out.write(f'{str(SOMO)}\tSOMO\n')
+        SOMO = somo(corpus, m, n_not_odd=5, seed=seed)
+        out.write(f'{SOMO["accuracy"]}\tSOMO\n')
+        out.write(f'{SOMO["low"]}\tSOMO_low\n')
+        out.write(f'{SOMO["high"]}\tSOMO_high\n')
 
         # (2)
         eprint('Ecotype task ...')
-        m = load_embedding(model)
         for task in ['vibrio', 'prochlorococcus', 'pseudomonas']:
             rank, eco = load_ecotypes(f'{ecotypes}/{task}.tsv')
             d = {k: v2 for k, (v1, v2) in eco.items()}
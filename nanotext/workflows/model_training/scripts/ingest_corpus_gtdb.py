@@ -1,14 +1,79 @@
+from functools import partial
 from glob import glob
 import os
+import shutil
 
 import click
-from pybedtools import BedTool
 from tqdm import tqdm
 
 from nanotext.io import load_domains
 from nanotext.utils import create_domain_sequence
 
 
+def ingest_file(file, minlen=0):
+    '''
+    Turn a single annotation file into corpus lines of the form
+
+    genome<tab>contig<tab>domain,domain,...
+
+    and return them as one string, together w/ the file name.
+    '''
+    dom = load_domains(file, fmt='pfamscan', columnar=True)
+
+    # make sure Pfam ID is truncated: PF00815.1 -> PF00815
+    seq = create_domain_sequence(
+        dom, keep_unknown=True, fmt_fn=lambda x: x.split('.')[0])
+
+    genome = os.path.basename(file).strip('_pfam.tsv')
+    # e.g. ...
+    # UBA9934_pfam.tsv
+    # GB_GCA_001790445.1_pfam.tsv
+    # RS_GCF_000012865.1_pfam.tsv
+
+    # adjust name if pfam table name from GTDB
+    if (not 'UBA' in genome) and \
+       (any(x in genome for x in ['RS_', 'GB_'])):
+        genome = '_'.join(genome.split('_')[1:])
+
+    text = []
+    for k, v in seq.items():
+        if len(v) > minlen:
+            text.append(f'{genome}\t{k}\t{",".join(v)}\n')
+    return file, ''.join(text)
+
+
+def load_checkpoint(parts):
+    '''
+    Read the manifest of files ingested so far and return them as a set.
+
+    Each line of the manifest records a file, the shard its lines went to and
+    the size of the shard after they were written. Shards are truncated to
+    the last recorded size, which drops the output of a file that was being
+    written when the previous run crashed. Likewise, the manifest is
+    truncated after its last complete line, so the next record is not
+    appended to a torn one.
+    '''
+    done, sizes = set(), {}
+    checkpoint = os.path.join(parts, 'done.tsv')
+
+    if os.path.exists(checkpoint):
+        with open(checkpoint, 'rb+') as file:
+            lines = file.read()
+            lines = lines[:lines.rfind(b'\n') + 1]  # w/o incomplete last line
+            file.truncate(len(lines))
+
+        for line in lines.decode().splitlines():
+            fp, shard, size = line.split('\t')
+            done.add(fp)
+            sizes[shard] = max(int(size), sizes.get(shard, 0))
+
+    for shard in glob(os.path.join(parts, 'shard.*.txt')):
+        with open(shard, 'rb+') as file:
+            file.truncate(sizes.get(os.path.basename(shard), 0))
+
+    return done
+
+
 @click.command()
 @click.option(
     '--indir', help='Folder w/ input (annotation) files',
@@ -19,41 +84,69 @@ from nanotext.utils import create_domain_sequence
 @click.option(
     '--minlen', help='Minimum number of domains per contig',
     default=0)
-def ingest(indir, outfile, minlen):
+@click.option(
+    '--threads', '-t', help='Number of parallel processes',
+    default=1)
+def ingest(indir, outfile, minlen, threads):
     '''
     Ingest a collection of protein domain annotations generated using
     `pfam_scan.pl` into a corpus for later use with Doc2Vec.
+
+    Files are processed by a pool of <threads> processes. Their output goes
+    to shards in "<outfile>.parts/", which are merged into <outfile> at the
+    end. A manifest of ingested files is kept alongside, so a crashed run
+    picks up where it stopped when started again w/ the same arguments.
+
+    The order of lines depends on the order in which files finish, i.e. the
+    result is identical to that of a serial run after sorting.
     '''
     files = glob(f'{indir}/*')  # 145817
 
-    # the next step will take roughly 10 hours
-    with open(outfile, 'w+') as out:
-        for file in tqdm(files):
-        
-            result = load_domains(file, fmt='pfamscan')
-            dom = BedTool(list(result.values()))
-        
-            # make sure Pfam ID is truncated: PF00815.1 -> PF00815
-            seq = create_domain_sequence(
-                dom, keep_unknown=True, fmt_fn=lambda x: x.split('.')[0])
-        
-            text = list(seq.values())
-            genome = os.path.basename(file).strip('_pfam.tsv')
-            # e.g. ...
-            # UBA9934_pfam.tsv
-            # GB_GCA_001790445.1_pfam.tsv
-            # RS_GCF_000012865.1_pfam.tsv
-
-            # adjust name if pfam table name from GTDB
-            if (not 'UBA' in genome) and \
-               (any(x in genome for x in ['RS_', 'GB_'])):
-                genome = '_'.join(genome.split('_')[1:])
-
-    
-            for k, v in seq.items():
-                if len(v) > minlen:
-                    out.write(f'{genome}\t{k}\t{",".join(v)}\n')
+    parts = f'{outfile}.parts'
+    os.makedirs(parts, exist_ok=True)
+    done = load_checkpoint(parts)
+    todo = [i for i in files if i not in done]
+    if done:
+        print(f'Resuming, {len(done)} of {len(files)} files already ingested')
+
+    # one new shard per run, so we never append to a truncated one
+    shard = f'shard.{len(glob(os.path.join(parts, "shard.*.txt")))}.txt'
+    fn = partial(ingest_file, minlen=minlen)
+
+    # the next step will take roughly 10 hours on a single core
+    with open(os.path.join(parts, shard), 'wb') as out, \
+         open(os.path.join(parts, 'done.tsv'), 'a+') as checkpoint:
+
+        if threads > 1:
+            from multiprocessing import Pool
+            pool = Pool(threads)
+            results = pool.imap_unordered(fn, todo, chunksize=16)
+        else:
+            pool = None
+            results = map(fn, todo)
+
+        try:
+            for file, text in tqdm(results, total=len(todo)):
+                out.write(text.encode())
+                out.flush()
+                checkpoint.write(f'{file}\t{shard}\t{out.tell()}\n')
+                checkpoint.flush()
+        finally:
+            # after an error, stop the workers before we exit, so at most
+            # the tail of the shard is torn (see load_checkpoint())
+            if pool:
+                pool.terminate()
+                pool.join()
+
+    shards = sorted(
+        glob(os.path.join(parts, 'shard.*.txt')),
+        key=lambda x: int(x.split('.')[-2]))
+    with open(outfile, 'wb') as out:
+        for i in shards:
+            with open(i, 'rb') as file:
+                shutil.copyfileobj(file, out)
+    shutil.rmtree(parts)
 
 
 if __name__ == '__main__':
-    ingest()
\ No newline at end of file
+    ingest()